@@ -0,0 +1,243 @@
+"""
+Benchmark comparing the threaded and asyncio server engines.
+Each engine is started in a child process with the real RequestHandler and a
+stub VideoProcessor that hands the upload straight back, so only connection
+handling, upload and response delivery are measured. A burst of concurrent
+clients then uploads a payload in slow chunks, the way clients on poor links
+do, and the benchmark reports latency percentiles, throughput, refused
+connections and the peak number of server threads.
+Usage:
+    python -m benchmark.engine_benchmark [--clients N] [--payload-size BYTES]
+                                         [--chunks N] [--chunk-delay SECONDS]
+                                         [--backlog N] [--workers N] [--output results.json]
+Example:
+    python -m benchmark.engine_benchmark --clients 1000 --chunks 10 --chunk-delay 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from server.AsyncTCPSocketServer import AsyncTCPSocketServer
+from server.ConnectionManager import ConnectionManager
+from server.DiskWriter import DiskWriter
+from server.FileReceiver import FileReceiver
+from server.RequestHandler import RequestHandler
+from server.StatusResponder import StatusResponder
+from server.StorageChecker import StorageChecker
+from server.TCPSocketServer import TCPSocketServer
+
+ENGINES = ["threaded", "asyncio"]
+
+
+class EchoVideoProcessor:
+    """Stub processor that returns the uploaded file unchanged."""
+
+    def process(self, input_path: str, options: dict, media_info: Optional[dict] = None, progress=None) -> str:
+        return input_path
+
+
+class UnlimitedConnectionManager(ConnectionManager):
+    """Every benchmark client connects from 127.0.0.1, so admit them all."""
+
+    def admit(self, ip_address: str) -> Optional[str]:
+        return None
+
+    def remove_connection(self, ip_address: str):
+        pass
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_server(engine: str, port: int, backlog: int, workers: Optional[int], storage_dir: str):
+    logging.disable(logging.INFO)
+
+    disk_writer = DiskWriter(storage_dir)
+    file_receiver = FileReceiver(disk_writer)
+    storage_checker = StorageChecker(max_storage_tb=1.0, storage_path=storage_dir)
+    video_processor = EchoVideoProcessor()
+    status_responder = StatusResponder()
+
+    def create_request_handler(connection):
+        return RequestHandler(
+            file_receiver=file_receiver,
+            storage_checker=storage_checker,
+            video_processor=video_processor,
+            status_responder=status_responder
+        )
+
+    if engine == "asyncio":
+        server = AsyncTCPSocketServer("127.0.0.1", port, create_request_handler, UnlimitedConnectionManager(),
+                                      backlog=backlog, max_workers=workers)
+    else:
+        server = TCPSocketServer("127.0.0.1", port, create_request_handler, UnlimitedConnectionManager(),
+                                 backlog=backlog)
+    server.start()
+
+
+def count_threads(pid: int) -> Optional[int]:
+    # Linux only; other platforms report no thread figures
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+async def run_client(port: int, payload: bytes, chunks: int, chunk_delay: float) -> Optional[float]:
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return None
+
+    try:
+        json_data = b'{"operation": "compress"}'
+        media_type = b"mp4"
+        header = struct.pack('!HB', len(json_data), len(media_type)) + len(payload).to_bytes(5, 'big')
+        writer.write(header + json_data + media_type)
+
+        step = max(1, -(-len(payload) // chunks))
+        for offset in range(0, len(payload), step):
+            writer.write(payload[offset:offset + step])
+            await writer.drain()
+            if chunk_delay:
+                await asyncio.sleep(chunk_delay)
+
+        response_header = await reader.readexactly(8)
+        json_size, media_type_size = struct.unpack('!HB', response_header[:3])
+        payload_size = int.from_bytes(response_header[3:], 'big')
+        await reader.readexactly(json_size + media_type_size + payload_size)
+        if payload_size != len(payload):
+            return None
+        return time.perf_counter() - started
+    except (OSError, asyncio.IncompleteReadError):
+        return None
+    finally:
+        writer.close()
+
+
+async def run_burst(port: int, clients: int, payload: bytes, chunks: int, chunk_delay: float) -> List[Optional[float]]:
+    return await asyncio.gather(*(run_client(port, payload, chunks, chunk_delay) for _ in range(clients)))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def benchmark_engine(engine: str, args) -> dict:
+    port = find_free_port()
+    storage_dir = tempfile.mkdtemp(prefix=f"bench_{engine}_")
+    server = multiprocessing.Process(
+        target=run_server,
+        args=(engine, port, args.backlog, args.workers, storage_dir),
+        daemon=True
+    )
+    server.start()
+    if not wait_for_port(port):
+        server.terminate()
+        raise RuntimeError(f"{engine} engine did not start listening on port {port}")
+
+    payload = os.urandom(args.payload_size)
+    peak_threads = 0
+
+    async def sample_threads(done: asyncio.Event):
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, count_threads(server.pid) or 0)
+            await asyncio.sleep(0.05)
+
+    async def run():
+        done = asyncio.Event()
+        sampler = asyncio.create_task(sample_threads(done))
+        results = await run_burst(port, args.clients, payload, args.chunks, args.chunk_delay)
+        done.set()
+        await sampler
+        return results
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    server.terminate()
+    server.join()
+
+    latencies = [r for r in results if r is not None]
+    transferred = 2 * len(payload) * len(latencies)
+    return {
+        "engine": engine,
+        "clients": args.clients,
+        "completed": len(latencies),
+        "failed": len(results) - len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(transferred / elapsed / (1024 * 1024), 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "peak_threads": peak_threads or None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the threaded and asyncio server engines")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent clients in the burst")
+    parser.add_argument("--payload-size", type=int, default=256 * 1024, help="Upload size per client in bytes")
+    parser.add_argument("--chunks", type=int, default=8, help="Number of pieces each upload is split into")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Seconds each client waits between pieces")
+    parser.add_argument("--backlog", type=int, default=1024, help="Listen backlog for both engines")
+    parser.add_argument("--workers", type=int, default=None, help="Handler threads for the asyncio engine")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = [benchmark_engine(engine, args) for engine in args.engines]
+
+    print(f"{'engine':<10}{'done':>8}{'failed':>8}{'req/s':>10}{'MB/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'threads':>9}")
+    for r in results:
+        print(f"{r['engine']:<10}{r['completed']:>8}{r['failed']:>8}{r['requests_per_s']:>10}{r['mb_per_s']:>10}"
+              f"{r['p50_ms']:>10}{r['p99_ms']:>10}{str(r['peak_threads']):>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    sys.exit(0 if all(r["failed"] == 0 for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
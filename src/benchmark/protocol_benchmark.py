@@ -0,0 +1,305 @@
+"""
+Load generator and throughput benchmark for the MMP protocol.
+The server is started in a child process with the real RequestHandler and
+FileReceiver and a stub VideoProcessor, so only the protocol path is measured:
+header and JSON parsing, receiving the payload to disk and sending the response.
+With the "echo" processor the upload is sent back, with "noop" only a two-byte
+result is. N concurrent synthetic clients speak the 8-byte header protocol and
+each send a number of requests, writing the payload in pieces of the send chunk
+size. The benchmark sweeps payload sizes, send chunk sizes and the receive
+buffer size of FileReceiver (the chunk_size recv_into reads with; the splice
+path, which bypasses that buffer, can be added as one more configuration), and
+reports latency percentiles, MB/s and packets/s counted in packets of
+--packet-size bytes (1,400 by default, the size the requirements are stated in).
+Results are written as JSON together with the git revision, so runs of two
+versions can be compared with --compare.
+Usage:
+    python -m benchmark.protocol_benchmark [--engine threaded|asyncio] [--processor echo|noop]
+                                           [--clients N] [--requests N] [--keep-alive]
+                                           [--payload-sizes BYTES ...] [--send-chunk-sizes BYTES ...]
+                                           [--receive-chunk-sizes BYTES ...] [--splice]
+                                           [--packet-size BYTES] [--output results.json]
+                                           [--compare previous.json]
+Example:
+    python -m benchmark.protocol_benchmark --clients 32 --payload-sizes 1400 65536 1048576 \\
+        --send-chunk-sizes 1400 65536 --receive-chunk-sizes 4096 65536 --splice --output after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+from benchmark.engine_benchmark import EchoVideoProcessor, UnlimitedConnectionManager, find_free_port, percentile, wait_for_port
+from server.AsyncTCPSocketServer import AsyncTCPSocketServer
+from server.DiskWriter import DiskWriter
+from server.FileReceiver import FileReceiver
+from server.RequestHandler import RequestHandler
+from server.StatusResponder import StatusResponder
+from server.StorageChecker import StorageChecker
+from server.TCPSocketServer import TCPSocketServer
+
+ENGINES = ["threaded", "asyncio"]
+PROCESSORS = ["echo", "noop"]
+DEFAULT_PAYLOAD_SIZES = [1400, 64 * 1024, 1024 * 1024]
+DEFAULT_SEND_CHUNK_SIZES = [1400, 64 * 1024]
+# 4096 is FileReceiver's default
+DEFAULT_RECEIVE_CHUNK_SIZES = [4096, 64 * 1024]
+PACKET_SIZE = 1400
+# Packets per second the service is required to sustain
+TARGET_PACKETS_PER_S = 20000
+HEADER_SIZE = 8
+MB = 1024 * 1024
+
+
+class NoopVideoProcessor:
+    """Stub processor that answers every upload with a two-byte result."""
+
+    def process(self, input_path: str, options: dict, media_info: Optional[dict] = None, progress=None) -> str:
+        output_path = input_path + ".out"
+        with open(output_path, "wb") as f:
+            f.write(b"ok")
+        return output_path
+
+
+def run_server(engine: str, processor: str, port: int, receive_chunk_size: int, use_splice: bool, storage_dir: str):
+    logging.disable(logging.INFO)
+
+    disk_writer = DiskWriter(storage_dir)
+    file_receiver = FileReceiver(disk_writer, chunk_size=receive_chunk_size, use_splice=use_splice)
+    storage_checker = StorageChecker(max_storage_tb=1.0, storage_path=storage_dir)
+    video_processor = EchoVideoProcessor() if processor == "echo" else NoopVideoProcessor()
+    status_responder = StatusResponder()
+
+    def create_request_handler(connection):
+        return RequestHandler(
+            file_receiver=file_receiver,
+            storage_checker=storage_checker,
+            video_processor=video_processor,
+            status_responder=status_responder
+        )
+
+    if engine == "asyncio":
+        server = AsyncTCPSocketServer("127.0.0.1", port, create_request_handler, UnlimitedConnectionManager(), backlog=1024)
+    else:
+        server = TCPSocketServer("127.0.0.1", port, create_request_handler, UnlimitedConnectionManager(), backlog=1024)
+    server.start()
+
+
+def encode_request(options: dict, payload_size: int) -> bytes:
+    json_data = json.dumps(options).encode("utf-8")
+    media_type = b"mp4"
+    return struct.pack('!HB', len(json_data), len(media_type)) + payload_size.to_bytes(5, 'big') + json_data + media_type
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[dict, int, int]:
+    """Read one response. Returns its JSON, its payload size and its size on the wire."""
+    response_header = await reader.readexactly(HEADER_SIZE)
+    json_size, media_type_size = struct.unpack('!HB', response_header[:3])
+    payload_size = int.from_bytes(response_header[3:], 'big')
+    response_json = json.loads(await reader.readexactly(json_size) or b"{}")
+    await reader.readexactly(media_type_size)
+    remaining = payload_size
+    while remaining:
+        # Drain the payload without keeping it
+        remaining -= len(await reader.read(min(remaining, MB)))
+        if reader.at_eof() and remaining:
+            raise asyncio.IncompleteReadError(b"", remaining)
+    return response_json, payload_size, HEADER_SIZE + json_size + media_type_size + payload_size
+
+
+async def run_client(port: int, payload: bytes, send_chunk_size: int, requests: int, keep_alive: bool,
+                     processor: str) -> Tuple[List[float], int, int]:
+    """Send requests uploads. Returns the latency of every successful one, failures and bytes on the wire."""
+    latencies: List[float] = []
+    failures = 0
+    wire_bytes = 0
+    reader = writer = None
+    expected_size = len(payload) if processor == "echo" else 2
+
+    for request_id in range(requests):
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            options = {"operation": "compress", "request_id": request_id} if keep_alive else {"operation": "compress"}
+            request = encode_request(options, len(payload))
+            writer.write(request)
+            for offset in range(0, len(payload), send_chunk_size):
+                writer.write(payload[offset:offset + send_chunk_size])
+                await writer.drain()
+
+            response_json, response_size, response_bytes = await read_response(reader)
+            if "error" in response_json or response_size != expected_size:
+                failures += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+                wire_bytes += len(request) + len(payload) + response_bytes
+        except (OSError, asyncio.IncompleteReadError, json.JSONDecodeError):
+            failures += 1
+            if writer:
+                writer.close()
+            reader = writer = None
+        finally:
+            if writer and not keep_alive:
+                writer.close()
+                reader = writer = None
+    if writer:
+        writer.close()
+    return latencies, failures, wire_bytes
+
+
+async def run_load(port: int, clients: int, payload: bytes, send_chunk_size: int, requests: int, keep_alive: bool,
+                   processor: str) -> List[Tuple[List[float], int, int]]:
+    return await asyncio.gather(*(run_client(port, payload, send_chunk_size, requests, keep_alive, processor) for _ in range(clients)))
+
+
+def run_case(port: int, args, payload_size: int, send_chunk_size: int) -> dict:
+    payload = os.urandom(payload_size)
+    started = time.perf_counter()
+    results = asyncio.run(run_load(port, args.clients, payload, send_chunk_size, args.requests, args.keep_alive, args.processor))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for client_latencies, _, _ in results for latency in client_latencies]
+    failures = sum(failed for _, failed, _ in results)
+    wire_bytes = sum(sent for _, _, sent in results)
+    return {
+        "payload_size": payload_size,
+        "send_chunk_size": send_chunk_size,
+        "completed": len(latencies),
+        "failed": failures,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(wire_bytes / elapsed / MB, 2) if elapsed else 0.0,
+        "packets_per_s": round(wire_bytes / args.packet_size / elapsed) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def benchmark_receiver(args, receive_chunk_size: int, use_splice: bool) -> List[dict]:
+    port = find_free_port()
+    storage_dir = tempfile.mkdtemp(prefix="bench_protocol_")
+    server = multiprocessing.Process(
+        target=run_server,
+        args=(args.engine, args.processor, port, receive_chunk_size, use_splice, storage_dir),
+        daemon=True
+    )
+    server.start()
+    if not wait_for_port(port):
+        server.terminate()
+        raise RuntimeError(f"Server did not start listening on port {port}")
+
+    try:
+        results = []
+        for payload_size in args.payload_sizes:
+            for send_chunk_size in args.send_chunk_sizes:
+                result = run_case(port, args, payload_size, send_chunk_size)
+                result = {"receive": "splice" if use_splice else receive_chunk_size, **result}
+                print_result(result)
+                results.append(result)
+        return results
+    finally:
+        server.terminate()
+        server.join()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result: dict) -> tuple:
+    return str(result["receive"]), result["payload_size"], result["send_chunk_size"]
+
+
+def print_header():
+    print(f"{'receive':>8}{'payload':>10}{'send':>8}{'done':>7}{'fail':>6}{'req/s':>10}{'MB/s':>9}{'pkt/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+
+
+def print_result(r: dict):
+    print(f"{str(r['receive']):>8}{r['payload_size']:>10}{r['send_chunk_size']:>8}{r['completed']:>7}{r['failed']:>6}"
+          f"{r['requests_per_s']:>10}{r['mb_per_s']:>9}{r['packets_per_s']:>10}{r['p50_ms']:>9}{r['p99_ms']:>9}")
+
+
+def print_comparison(results: List[dict], previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    before = {case_key(r): r for r in previous.get("results", [])}
+    print(f"\nCompared with {previous_path} (revision {previous.get('revision')}):")
+    print(f"{'receive':>8}{'payload':>10}{'send':>8}{'MB/s':>16}{'p99 ms':>18}")
+    for r in results:
+        old = before.get(case_key(r))
+        if not old:
+            continue
+        mb_change = (r["mb_per_s"] / old["mb_per_s"] - 1) * 100 if old["mb_per_s"] else 0.0
+        p99_change = (r["p99_ms"] / old["p99_ms"] - 1) * 100 if old["p99_ms"] else 0.0
+        print(f"{str(r['receive']):>8}{r['payload_size']:>10}{r['send_chunk_size']:>8}"
+              f"{r['mb_per_s']:>9} {mb_change:+5.1f}%{r['p99_ms']:>11} {p99_change:+5.1f}%")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the MMP protocol path of the server")
+    parser.add_argument("--engine", choices=ENGINES, default="threaded")
+    parser.add_argument("--processor", choices=PROCESSORS, default="echo", help="echo sends the upload back, noop a two-byte result")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent synthetic clients")
+    parser.add_argument("--requests", type=int, default=10, help="Requests each client sends per case")
+    parser.add_argument("--keep-alive", action="store_true", help="Send each client's requests over one persistent connection")
+    parser.add_argument("--payload-sizes", type=int, nargs="+", default=DEFAULT_PAYLOAD_SIZES, help="Upload sizes in bytes")
+    parser.add_argument("--send-chunk-sizes", type=int, nargs="+", default=DEFAULT_SEND_CHUNK_SIZES, help="Pieces the clients write the payload in")
+    parser.add_argument("--receive-chunk-sizes", type=int, nargs="+", default=DEFAULT_RECEIVE_CHUNK_SIZES, help="FileReceiver chunk_size values (recv_into path)")
+    parser.add_argument("--splice", action="store_true", help="Also measure the os.splice receive path")
+    parser.add_argument("--packet-size", type=int, default=PACKET_SIZE, help="Bytes per packet when counting packets/s")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configurations = [(size, False) for size in args.receive_chunk_sizes]
+    if args.splice:
+        configurations.append((args.receive_chunk_sizes[0], True))
+
+    print(f"engine={args.engine} processor={args.processor} clients={args.clients} requests={args.requests} keep_alive={args.keep_alive}")
+    print_header()
+    results = []
+    for receive_chunk_size, use_splice in configurations:
+        results.extend(benchmark_receiver(args, receive_chunk_size, use_splice))
+
+    best = max((r["packets_per_s"] for r in results), default=0)
+    print(f"\nBest: {best} packets/s of {args.packet_size} bytes (target {TARGET_PACKETS_PER_S})")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+    if args.output:
+        report = {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    sys.exit(0 if all(r["failed"] == 0 for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+BatchUploader uploads many files through a bounded pool of persistent connections.
+The files come from directories and glob patterns, or from watching directories
+for new files. Every worker takes one connection from the pool and keeps it for
+as long as the server keeps it open, sending its uploads one after another with
+a request ID, so the server keeps serving the connection instead of closing it
+after each response. With several workers there is always a file waiting when a
+processing slot on the server becomes free. Failed uploads are retried with
+exponential backoff: lost connections, checksum mismatches, and "server busy" /
+"rate limited" answers, after which the worker waits as long as the server
+asked (at most MAX_BACKOFF seconds).
+At the end a summary reports files, bytes and throughput.
+Attributes:
+    connections (int): Uploads in flight at once, one connection each.
+    max_retries (int): Retries per file after the first attempt.
+    backoff (float): Seconds waited before the first retry, doubled on every further one.
+    extensions (tuple): File extensions picked up from directories and watch mode.
+Example:
+    >>> batch = BatchUploader('compression-server.example.com', 5000, connections=4)
+    >>> files = batch.collect(['/data/incoming', '/data/more/*.mov'])
+    >>> summary = batch.upload_all(files, {"operation": "compress"})
+    >>> batch.print_summary(summary)
+    >>> batch.watch(['/data/incoming'], {"operation": "compress"})
+"""
+
+import glob
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from .TCPSocketClient import TCPSocketClient
+from .uploader import Uploader
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# Seconds between two scans of the watched directories
+DEFAULT_WATCH_INTERVAL = 2.0
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi", ".webm", ".m4v", ".flv", ".wmv", ".ts", ".mpg", ".mpeg")
+# Errors that go away by themselves: server busy, rate limited and corruption in transit
+RETRYABLE_ERRORS = (1006, 1008, 1012)
+
+
+class BatchUploader(Uploader):
+
+    def __init__(self, host: str = "localhost", port: int = 5000, output_dir: str = "downloads",
+                 connections: int = DEFAULT_CONNECTIONS, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF, extensions: Tuple[str, ...] = VIDEO_EXTENSIONS):
+        super().__init__(host, port, output_dir)
+        # Concurrent uploads would overwrite each other's readout; the summary reports throughput instead
+        self.show_transfer = False
+        self.connections = max(1, connections)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.extensions = tuple(extension.lower() for extension in extensions)
+
+        # Idle connected sockets, reused by whichever worker needs one next
+        self._idle: "queue.LifoQueue[TCPSocketClient]" = queue.LifoQueue()
+        self._request_ids = iter(range(1, 1 << 62))
+        self._lock = threading.Lock()
+
+    def collect(self, sources: Iterable[str], recursive: bool = False) -> List[str]:
+        """Expand files, directories and glob patterns into a sorted list of files without duplicates."""
+        files = set()
+        for source in sources:
+            if os.path.isdir(source):
+                files.update(self._scan(source, recursive))
+            elif os.path.isfile(source):
+                files.add(os.path.abspath(source))
+            else:
+                matches = glob.glob(source, recursive=recursive)
+                if not matches:
+                    print(f"No files match {source}.")
+                for match in matches:
+                    if os.path.isfile(match):
+                        files.add(os.path.abspath(match))
+                    elif os.path.isdir(match):
+                        files.update(self._scan(match, recursive))
+        return sorted(files)
+
+    def upload_all(self, file_paths: List[str], options: dict = None) -> dict:
+        """Upload file_paths through the connection pool and return the summary of the batch."""
+        summary = self._new_summary()
+        with ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="upload") as executor:
+            for file_path in file_paths:
+                executor.submit(self._upload, file_path, options, summary)
+        self._close_pool()
+        summary["elapsed"] = time.monotonic() - summary["started"]
+        return summary
+
+    def watch(self, directories: List[str], options: dict = None, interval: float = DEFAULT_WATCH_INTERVAL,
+              recursive: bool = False, include_existing: bool = False) -> dict:
+        """
+        Upload files as they appear in directories until interrupted (Ctrl+C), then return the summary.
+        A file is uploaded once its size has stopped changing between two scans, so files that are
+        still being copied in are left alone.
+        """
+        summary = self._new_summary()
+        seen = set() if include_existing else {path for directory in directories for path in self._scan(directory, recursive)}
+        pending: Dict[str, int] = {}
+        executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="upload")
+        print(f"Watching {', '.join(directories)} for new files. Press Ctrl+C to stop.")
+        try:
+            while True:
+                for directory in directories:
+                    for path in self._scan(directory, recursive):
+                        if path in seen:
+                            continue
+                        try:
+                            size = os.path.getsize(path)
+                        except OSError:
+                            continue
+                        if pending.get(path) == size and size > 0:
+                            del pending[path]
+                            seen.add(path)
+                            executor.submit(self._upload, path, options, summary)
+                        else:
+                            pending[path] = size
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("\nStopping; waiting for the uploads in progress...")
+        finally:
+            executor.shutdown(wait=True)
+            self._close_pool()
+        summary["elapsed"] = time.monotonic() - summary["started"]
+        return summary
+
+    @staticmethod
+    def print_summary(summary: dict):
+        elapsed = max(summary["elapsed"], 1e-9)
+        sent_mb = summary["bytes_sent"] / (1024 * 1024)
+        received_mb = summary["bytes_received"] / (1024 * 1024)
+        print("\n---Batch summary---")
+        print(f"Files: {summary['succeeded']} succeeded, {summary['failed']} failed, {summary['retries']} retries")
+        print(f"Uploaded: {sent_mb:.1f} MB ({sent_mb / elapsed:.2f} MB/s)")
+        print(f"Downloaded: {received_mb:.1f} MB ({received_mb / elapsed:.2f} MB/s)")
+        print(f"Elapsed: {summary['elapsed']:.1f}s ({summary['succeeded'] / elapsed:.2f} files/s)")
+        for file_path in summary["failed_files"]:
+            print(f"  failed: {file_path}")
+        print("-------------------\n")
+
+    def _upload(self, file_path: str, options: Optional[dict], summary: dict):
+        basename = os.path.basename(file_path)
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count(summary, "retries")
+            client = self._acquire()
+            if client is None:
+                self._wait(attempt, 0, f"{basename}: cannot connect")
+                continue
+
+            result = None
+            try:
+                if self._send_upload(file_path, {**(options or {}), "request_id": next(self._request_ids)}, client):
+                    result = self._receive_result(os.path.splitext(basename)[0], client)
+            except Exception as e:
+                print(f"{basename}: {e}")
+
+            if result is None:
+                # The connection is in an unknown state; drop it and try again on a fresh one
+                client.close()
+                self._wait(attempt, 0, f"{basename}: connection lost")
+                continue
+            self._idle.put(client)
+
+            response_json, output = result
+            if output:
+                output_paths = output if isinstance(output, list) else [output]
+                with self._lock:
+                    summary["succeeded"] += 1
+                    summary["bytes_sent"] += size
+                    summary["bytes_received"] += sum(os.path.getsize(path) for path in output_paths)
+                    summary["outputs"][file_path] = output
+                return
+
+            error = response_json.get("error") or {}
+            if error.get("code") in RETRYABLE_ERRORS:
+                self._wait(attempt, error.get("retry_after", 0), f"{basename}: {error.get('description')}")
+                continue
+            print(f"{file_path} failed:")
+            self._print_error(response_json)
+            break
+
+        with self._lock:
+            summary["failed"] += 1
+            summary["failed_files"].append(file_path)
+
+    def _acquire(self) -> Optional[TCPSocketClient]:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            client = TCPSocketClient()
+            return client if client.connect(self.host, self.port) else None
+
+    def _close_pool(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _wait(self, attempt: int, retry_after: float, reason: str):
+        if attempt >= self.max_retries:
+            return
+        # Exponential backoff with jitter, so workers that failed together do not retry together
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+        delay = min(MAX_BACKOFF, max(retry_after, delay))
+        print(f"{reason}. Retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+        time.sleep(delay)
+
+    def _count(self, summary: dict, key: str):
+        with self._lock:
+            summary[key] += 1
+
+    def _scan(self, directory: str, recursive: bool) -> List[str]:
+        pattern = os.path.join(directory, "**", "*") if recursive else os.path.join(directory, "*")
+        return [os.path.abspath(path) for path in glob.glob(pattern, recursive=recursive)
+                if os.path.isfile(path) and path.lower().endswith(self.extensions)]
+
+    @staticmethod
+    def _new_summary() -> dict:
+        return {
+            "started": time.monotonic(),
+            "elapsed": 0.0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "outputs": {},
+            "failed_files": [],
+        }
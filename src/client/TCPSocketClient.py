@@ -1,3 +1,4 @@
+import os
 import socket
 from typing import Optional
 
@@ -26,6 +27,8 @@ class TCPSocketClient:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((host, port))
+            # Requests are written as a header followed by the payload; do not hold the payload back for an ACK
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             return True
         except Exception as e:
             print(f"Connection failed: {e}")
@@ -43,6 +46,25 @@ class TCPSocketClient:
         except Exception as e:
             print(f"Send failed: {e}")
             return False
+
+    def send_file(self, file, offset: int = 0, count: Optional[int] = None) -> bool:
+        """Send count bytes of an open file starting at offset, copied by the kernel (sendfile) where possible."""
+        if not self.socket:
+            print("Socket is not connected.")
+            return False
+
+        try:
+            expected = count if count is not None else os.fstat(file.fileno()).st_size - offset
+            sent = self.socket.sendfile(file, offset, count)
+        except Exception as e:
+            print(f"Send failed: {e}")
+            return False
+        if sent != expected:
+            # The file shrank while it was sent; the server would take the next request's bytes for the rest of the payload
+            print(f"Send failed: sent {sent} of {expected} bytes. Closing the connection.")
+            self.close()
+            return False
+        return True
     
     def receive(self, size: int) -> bytes:
 
@@ -55,6 +77,18 @@ class TCPSocketClient:
         except Exception as e:
             print(f"Receive failed: {e}")
             return b''
+
+    def receive_into(self, buffer) -> int:
+        """Receive into a writable buffer (e.g. a memoryview of a reused bytearray). Returns 0 on EOF or error."""
+        if not self.socket:
+            print("Socket is not connected.")
+            return 0
+
+        try:
+            return self.socket.recv_into(buffer)
+        except Exception as e:
+            print(f"Receive failed: {e}")
+            return 0
     
     def close(self) -> None:
         if self.socket:
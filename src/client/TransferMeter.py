@@ -0,0 +1,57 @@
+"""
+TransferMeter prints a live readout of a transfer: bytes done, total and throughput.
+The line is rewritten in place at most once per interval, so a transfer moving
+gigabytes in small blocks costs one print every half second, not one per block.
+Attributes:
+    label (str): Text shown in front of the numbers, e.g. "Uploading video.mp4".
+    total (int): Size of the transfer in bytes, or None if it is not known in advance.
+    interval (float): Smallest number of seconds between two printed lines.
+Example:
+    meter = TransferMeter("Downloading video.mp4", total=size)
+    meter.update(received)
+    ...
+    meter.finish()
+"""
+
+import time
+from typing import Optional
+
+DEFAULT_METER_INTERVAL = 0.5
+MB = 1024 * 1024
+
+
+class TransferMeter:
+
+    def __init__(self, label: str, total: Optional[int], interval: float = DEFAULT_METER_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+
+        self._started = time.monotonic()
+        self._last_print = self._started
+
+    def update(self, done: int):
+        self.done = done
+        now = time.monotonic()
+        if now - self._last_print >= self.interval:
+            self._last_print = now
+            self._print(now)
+
+    def finish(self):
+        self._print(time.monotonic())
+        print()
+
+    def throughput(self) -> float:
+        """Bytes per second since the meter was created."""
+        elapsed = time.monotonic() - self._started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def _print(self, now: float):
+        elapsed = now - self._started
+        rate = self.done / elapsed / MB if elapsed > 0 else 0.0
+        if self.total is None:
+            print(f"\r{self.label}: {self.done / MB:.1f} MB  {rate:.2f} MB/s   ", end='', flush=True)
+            return
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        print(f"\r{self.label}: {self.done / MB:.1f} / {self.total / MB:.1f} MB ({percent:5.1f}%)  {rate:.2f} MB/s   ", end='', flush=True)
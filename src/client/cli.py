@@ -1,30 +1,48 @@
 """
 Command Line Interface for the Video Compressor Service client.
 This module provides a CLI to select a video file, validate its size,
-and upload it to the compression service.
+and upload it to the compression service. Given several files, directories
+or glob patterns it uploads them as a batch through a pool of connections,
+and with --watch it keeps uploading new files as they appear in a directory.
 Classes:
     CLI: Handles the command line interface operations.
 Usage:
-    python -m src.client.cli [host] [port]
+    python -m src.client.cli [host] [port] [--batch PATH ...] [--options JSON] [--connections N]
+                             [--retries N] [--watch] [--recursive]
     Where:
         host: Server hostname or IP (default: localhost)
         port: Server port (default: 5000)
+        --batch: Files, directories or glob patterns to upload instead of asking for one file
+        --options: Processing options as JSON, e.g. '{"operation": "compress"}'
+        --connections: Uploads in flight at once in batch mode (default: 4)
+        --retries: Retries per file after a failed upload (default: 3)
+        --watch: Keep uploading files that appear in the given directories
 Example:
     python -m src.client.cli compression-server.example.com 8080
+    python -m src.client.cli localhost 5000 --batch '/data/incoming/*.mp4' --options '{"operation": "compress"}'
+    python -m src.client.cli --batch /data/incoming --watch --connections 8
 """
 
+import argparse
+import json
 import sys
-import os
+from typing import List, Optional
+from .BatchUploader import BatchUploader, DEFAULT_BACKOFF, DEFAULT_CONNECTIONS, DEFAULT_MAX_RETRIES, DEFAULT_WATCH_INTERVAL
 from .FileSelector import FileSelector
-from .Uploader import Uploader
-from .Validator import Validator
+from .uploader import Uploader
+from .validator import Validator
+
+MAX_SIZE_MB = 100
 
 class CLI:
-    
-    def __init__(self, host:str = "localhost", port: int = 5000):
+
+    def __init__(self, host:str = "localhost", port: int = 5000, max_size_mb: int = MAX_SIZE_MB):
+        self.host = host
+        self.port = port
+        self.max_size_mb = max_size_mb
         self.uploader = Uploader(host, port)
 
-    def run(self):
+    def run(self, options: Optional[dict] = None):
         file_path = FileSelector.select_file()
         if not file_path:
             print("No file selected. Exiting.")
@@ -32,38 +50,71 @@ class CLI:
 
         print(f"Selected file: {file_path}")
 
-        max_size_mb = 100
-        if not Validator.check_file_size(file_path, max_size_mb):
-            print(f"File size is too large. Maximum allowed size is {max_size_mb} MB.")
+        if not Validator.check_file_size(file_path, self.max_size_mb):
+            print(f"File size is too large. Maximum allowed size is {self.max_size_mb} MB.")
             return False
-        
+
         print("Uploading file...")
-        success = self.uploader.send_file(file_path)
+        success = self.uploader.send_file(file_path, options)
 
         if success:
             print("File uploaded successfully.")
+            return True
         else:
-            print("Failed to upload file.") 
+            print("Failed to upload file.")
             return False
-    
+
+    def run_batch(self, sources: List[str], options: Optional[dict] = None, connections: int = DEFAULT_CONNECTIONS,
+                  max_retries: int = DEFAULT_MAX_RETRIES, backoff: float = DEFAULT_BACKOFF, watch: bool = False,
+                  recursive: bool = False, interval: float = DEFAULT_WATCH_INTERVAL):
+        batch = BatchUploader(self.host, self.port, self.uploader.output_dir, connections, max_retries, backoff)
+
+        if watch:
+            summary = batch.watch(sources, options, interval, recursive)
+            batch.print_summary(summary)
+            return not summary["failed"]
+
+        file_paths = []
+        for file_path in batch.collect(sources, recursive):
+            if Validator.check_file_size(file_path, self.max_size_mb):
+                file_paths.append(file_path)
+            else:
+                print(f"Skipping {file_path}: larger than {self.max_size_mb} MB.")
+        if not file_paths:
+            print("No files to upload. Exiting.")
+            return False
+
+        print(f"Uploading {len(file_paths)} files over {batch.connections} connections...")
+        summary = batch.upload_all(file_paths, options)
+        batch.print_summary(summary)
+        return not summary["failed"]
+
 def main():
-    host = "localhost"
-    port = 5000
-
-    args = sys.argv[1:]
-    if len(args) >= 1:
-        host = args[0]
-    if len(args) >= 2:
-        try:
-            port = int(args[1])
-        except ValueError:
-            print(f"Invalid port number: {args[1]}.")
-            sys.exit(1)
-    
-    cli = CLI(host, port)
-    success = cli.run()
+    parser = argparse.ArgumentParser(description="Upload videos to the Video Compressor Service.")
+    parser.add_argument("host", nargs="?", default="localhost", help="Server hostname or IP (default: localhost)")
+    parser.add_argument("port", nargs="?", type=int, default=5000, help="Server port (default: 5000)")
+    parser.add_argument("--batch", nargs="+", metavar="PATH", help="Files, directories or glob patterns to upload")
+    parser.add_argument("--options", type=json.loads, default=None, help="Processing options as JSON")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="Uploads in flight at once in batch mode")
+    parser.add_argument("--retries", type=int, default=DEFAULT_MAX_RETRIES, help="Retries per file after a failed upload")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF, help="Seconds before the first retry, doubled on every further one")
+    parser.add_argument("--watch", action="store_true", help="Keep uploading files that appear in the --batch directories")
+    parser.add_argument("--interval", type=float, default=DEFAULT_WATCH_INTERVAL, help="Seconds between two scans in watch mode")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories")
+    parser.add_argument("--max-size-mb", type=int, default=MAX_SIZE_MB, help="Largest file accepted, in MB")
+    args = parser.parse_args()
+
+    if args.watch and not args.batch:
+        parser.error("--watch needs the directories to watch, given with --batch")
+
+    cli = CLI(args.host, args.port, args.max_size_mb)
+    if args.batch:
+        success = cli.run_batch(args.batch, args.options, args.connections, args.retries, args.backoff,
+                                args.watch, args.recursive, args.interval)
+    else:
+        success = cli.run(args.options)
 
     sys.exit(0 if success else 1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,6 +2,12 @@
 A client for uploading files to a remote server via TCP.
 This class encapsulates the functionality needed to upload files to a video compression service.
 It handles the connection, file transmission, and response reading from the server.
+Uploads are sent from the file with sendfile() and processed files are written to disk
+while they arrive, so memory use stays the same whatever the size of the video.
+Uploads carry a BLAKE2 checksum that the server verifies, and downloads are hashed as
+they arrive and only renamed to their final name if they match the server's checksum.
+A download whose checksum algorithm this client cannot compute (an xxHash algorithm
+without the xxhash package) is saved, but reported as unverified.
 Attributes:
     socket (TCPSocketClient): The socket client used for communication.
     host (str): The hostname or IP address to connect to.
@@ -13,14 +19,48 @@ Example:
     ...     print("File uploaded successfully")
     ... else:
     ...     print("Failed to upload file")
+    >>> job_id = uploader.submit_job('/path/to/video.mp4', {"operation": "compress"})
+    >>> output_path = uploader.wait_for_job(job_id)
+    >>> output_path = uploader.send_file_resumable('/path/to/video.mp4', {"operation": "compress"}, stripes=4)
+    >>> output_path = uploader.send_file_streaming('/path/to/video.mp4', {"operation": "compress", "format": "webm"})
+    >>> output_paths = uploader.send_files(['/path/to/a.mp4', '/path/to/b.mp4'], {"operation": "compress"})
 """
 
 import os
 import struct
-from typing import Tuple, Optional
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional, Union
 from .TCPSocketClient import TCPSocketClient
+from .TransferMeter import TransferMeter
 import json
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_STRIPES = 4
+# Remembers the server session of interrupted resumable uploads, per source file
+SESSIONS_FILE = ".upload_sessions.json"
+# Media type of a response that carries several outputs back to back
+MEDIA_TYPE_MULTI = "multi"
+# Read size while a streaming upload is being sent
+STREAM_SEND_CHUNK_SIZE = 64 * 1024
+# Requests send_files() keeps in flight on its persistent connection
+DEFAULT_PIPELINE_DEPTH = 4
+# Bytes handed to one sendfile() call; the throughput readout is updated in between
+SENDFILE_SLICE = 8 * 1024 * 1024
+# Size of the reused buffer that downloads are received into
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+# Digest sent with every upload and asked for on every download
+CHECKSUM_ALGORITHM = "blake2b"
+# Suffix of a download until it is complete and verified
+TEMP_SUFFIX = ".part"
+
 class Uploader:
 
     def __init__(self, host: str = "localhost", port: int = 5000, output_dir: str = "downloads"):
@@ -28,8 +68,13 @@ class Uploader:
         self.host = host
         self.port = port
         self.output_dir = output_dir
+        # Live throughput readout of uploads and downloads
+        self.show_transfer = True
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+
+        # One receive buffer per thread, reused for every download
+        self._buffers = threading.local()
     
     def send_file(self, file_path: str, options: dict = None) -> Optional[str]:
         if not os.path.exists(file_path):
@@ -40,87 +85,610 @@ class Uploader:
             return False
         
         try:
-            # Prepare the header with JSON metadata, media type, and payload size
-            json_data = json.dumps(options or {}).encode('utf-8')
-            json_size = len(json_data)
+            # Ask for progress frames while the server processes the file
+            self._send_upload(file_path, {"progress": True, **(options or {})})
 
-            # Extract media type from file name
-            file_name = os.path.basename(file_path)
-            media_type = os.path.splitext(file_name)[1].lstrip('.').encode('utf-8')
-            media_type_size = len(media_type)
+            # Wait for the server's response
+            print(f"Request senf.Waiting for reponse...")
 
-            # Read the file payload
-            with open(file_path, 'rb') as f:
-                payload = f.read()
-            payload_size = len(payload)
+            original_basename = os.path.splitext(os.path.basename(file_path))[0]
+            result = self._receive_result(original_basename)
+            if not result:
+                return None
+            response_json, output = result
 
-            # Construct the header
-            header = struct.pack('!HB', json_size, media_type_size) + payload_size.to_bytes(5, 'big')
+            if output:
+                return output
+            else: 
+                self._print_error(response_json)
+                return None
+                
+        except Exception as e:
+            print(f"An error occurred while uploading the file: {e}")
+            return False
+        finally:
+            self.socket.close()
 
-            self.socket.send(header)
-            self.socket.send(json_data)
-            self.socket.send(media_type)
-            self.socket.send(payload)
+    def send_file_streaming(self, file_path: str, options: dict = None) -> Optional[str]:
+        """
+        Upload file_path with "stream": true. The server transcodes while the upload is still
+        arriving and sends the output back in chunks, so sending and receiving run concurrently.
+        """
+        if not os.path.exists(file_path):
+            print(f"File {file_path} does not exist.")
+            return None
 
-            print(f"Sending requset: json_size={json_size}, media_type={media_type.decode('utf-8')}, payload_size={payload_size}")
+        if not self.socket.connect(self.host, self.port):
+            return None
 
-            # Wait for the server's response
-            print(f"Request senf.Waiting for reponse...")
+        client = self.socket
+        file_size = os.path.getsize(file_path)
+        media_type = os.path.splitext(file_path)[1].lstrip('.').encode('utf-8')
+        json_data = json.dumps({**(options or {}), "stream": True}).encode('utf-8')
+        header = struct.pack('!HB', len(json_data), len(media_type)) + file_size.to_bytes(5, 'big')
+
+        def send_payload():
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(STREAM_SEND_CHUNK_SIZE), b''):
+                    if not client.send(block):
+                        return
 
-            response_header = self._receive_all(8)
-            if not response_header:
-                print("Failed to receive response header from server.")
+        output_path = None
+        try:
+            client.send(header + json_data + media_type)
+            sender = threading.Thread(target=send_payload, daemon=True)
+            sender.start()
+
+            response = self._receive_response(client)
+            if not response:
                 return None
-            
-            json_size, media_type_size = struct.unpack('!HB', response_header[:3])
-            payload_size = int.from_bytes(response_header[3:], 'big')
-
-            response_json_data = self._receive_all(json_size)
-            response_media_type = self._receive_all(media_type_size)
-            response_payload = self._receive_all(payload_size)
-
-            if payload_size > 0 and response_payload:
-                response_media_type = response_media_type.decode('utf-8')
-                original_basename = os.path.splitext(os.path.basename(file_path))[0]
-                output_filename = f"{original_basename}_processed.{response_media_type}"
-                output_path = os.path.join(self.output_dir, output_filename)
-
-                with open(output_path, 'wb') as f:
-                    f.write(response_payload)
-                
-                print(f"Success! Processed file saved to {output_path}")
-                return output_path
-            else: 
-                if response_json_data:
-                    try:
-                        error_data = json.loads(response_json_data.decode('utf-8'))
-                        if "error" in error_data:
-                            error_details = error_data["error"]
-                            print("\n---An error occurred on the server---")
-                            print(f"Error code: {error_details.get('code', 'N/A')}")
-                            print(f"Description: {error_details.get('description', 'No description provided')}")
-                            print(f"Suggested solution: {error_details.get('solution', 'No solition provided')}")
-                            print("-----------------------------------------\n")
-                        else:
-                            print(f"Received an unexpected response from server: {error_data}")
-                    except json.JSONDecodeError:
-                        print("Failed to decode the error response from the server.Raw data might be corrupted.")
+            response_json, response_media_type, _ = response
+            if not response_json.get("stream"):
+                self._print_error(response_json)
+                return None
+
+            original_basename = os.path.splitext(os.path.basename(file_path))[0]
+            output_path = os.path.join(self.output_dir, f"{original_basename}_processed.{response_media_type}")
+            # The size of the output is only known once the stream ends
+            meter = TransferMeter(f"Receiving {os.path.basename(output_path)}", None) if self.show_transfer else None
+            with open(output_path, 'wb') as f:
+                while True:
+                    head = self._receive_head(client)
+                    if not head:
+                        return None
+                    response_json, _, chunk_size = head
+                    if response_json:
+                        break
+                    if not self._receive_stream(client, f, chunk_size):
+                        return None
+                    if meter:
+                        meter.update(meter.done + chunk_size)
+            if meter:
+                meter.finish()
+
+            if "error" in response_json:
+                self._print_error(response_json)
+                os.remove(output_path)
+                return None
+            sender.join()
+            print(f"Success! Processed file saved to {output_path}")
+            return output_path
+        except Exception as e:
+            print(f"An error occurred while streaming the file: {e}")
+            return None
+        finally:
+            client.close()
+
+    def send_files(self, file_paths: List[str], options: dict = None, pipeline_depth: int = DEFAULT_PIPELINE_DEPTH) -> List[Optional[str]]:
+        """
+        Upload several files over one persistent connection. Up to pipeline_depth requests are
+        in flight at once, each tagged with a request ID; the server answers them as they finish,
+        in any order. Returns the output path (or None) of every file, in the order given.
+        """
+        results: List[Optional[str]] = [None] * len(file_paths)
+        client = TCPSocketClient()
+        if not client.connect(self.host, self.port):
+            return results
 
+        in_flight = threading.BoundedSemaphore(pipeline_depth)
+        sent_count = [0]
 
+        def send_requests():
+            for request_id, file_path in enumerate(file_paths):
+                in_flight.acquire()
+                if not os.path.exists(file_path):
+                    print(f"File {file_path} does not exist.")
+                    in_flight.release()
+                    continue
+                if not self._send_upload(file_path, {"progress": True, **(options or {}), "request_id": request_id}, client, show_transfer=False):
+                    break
+                sent_count[0] += 1
+
+        sender = threading.Thread(target=send_requests, daemon=True)
+        try:
+            sender.start()
+            answered = 0
+            while sender.is_alive() or answered < sent_count[0]:
+                head = self._receive_head(client)
+                if not head:
+                    print("Connection closed before all responses arrived.")
+                    break
+                response_json, response_media_type, payload_size = head
+                request_id = response_json.pop("request_id", None)
+                if not isinstance(request_id, int) or not 0 <= request_id < len(file_paths):
+                    print(f"Received a response for an unknown request: {response_json}")
+                    if payload_size and not self._receive_stream(client, None, payload_size):
+                        break
+                    continue
+                file_path = file_paths[request_id]
+                if list(response_json) == ["progress"] and not payload_size:
+                    self._print_progress(response_json["progress"], os.path.basename(file_path))
+                    continue
+
+                print()
+                if payload_size:
+                    original_basename = os.path.splitext(os.path.basename(file_path))[0]
+                    results[request_id] = self._save_stream(client, original_basename, response_media_type, payload_size, response_json.get("outputs"),
+                                                            response_json.get("checksum"), response_json.get("checksum_algorithm"))
+                    if results[request_id] is None:
+                        break
                 else:
-                    print("Received an empty or invalid response from server.")
+                    print(f"{file_path} failed:")
+                    self._print_error(response_json)
+                answered += 1
+                in_flight.release()
+            return results
+        except Exception as e:
+            print(f"An error occurred while uploading the files: {e}")
+            return results
+        finally:
+            client.close()
+
+    def submit_job(self, file_path: str, options: dict = None) -> Optional[str]:
+        """Upload a file for asynchronous processing and return the server's job ID."""
+        if not os.path.exists(file_path):
+            print(f"File {file_path} does not exist.")
+            return None
+
+        if not self.socket.connect(self.host, self.port):
+            return None
+
+        try:
+            self._send_upload(file_path, dict(options or {}, mode="async"))
+            response = self._receive_response()
+            if not response:
                 return None
-                
+            response_json = response[0]
+            if "job_id" not in response_json:
+                self._print_error(response_json)
+                return None
+            print(f"Job submitted: {response_json['job_id']} ({response_json.get('status')})")
+            return response_json["job_id"]
         except Exception as e:
-            print(f"An error occurred while uploading the file: {e}")
-            return False
+            print(f"An error occurred while submitting the job: {e}")
+            return None
         finally:
             self.socket.close()
+
+    def get_job_status(self, job_id: str) -> Optional[dict]:
+        response = self._request({"request_type": "job_status", "job_id": job_id})
+        if not response:
+            return None
+        response_json = response[0]
+        if "error" in response_json:
+            self._print_error(response_json)
+            return None
+        return response_json
+
+    def fetch_job(self, job_id: str, output_basename: Optional[str] = None) -> Optional[str]:
+        """Download the result of a finished job. Returns None while the job is still running."""
+        result = self._request_result({"request_type": "job_fetch", "job_id": job_id, "checksum_algorithm": CHECKSUM_ALGORITHM}, output_basename or job_id)
+        if not result:
+            return None
+        response_json, output = result
+
+        if output:
+            return output
+        if "error" in response_json:
+            self._print_error(response_json)
+        else:
+            print(f"Job {job_id} is not finished yet (status: {response_json.get('status')}).")
+        return None
+
+    def wait_for_job(self, job_id: str, output_basename: Optional[str] = None, poll_interval: float = 2.0) -> Optional[str]:
+        showed_progress = False
+        while True:
+            status = self.get_job_status(job_id)
+            if status is None:
+                return None
+            if status.get("progress"):
+                self._print_progress(status["progress"])
+                showed_progress = True
+            elif showed_progress and status.get("status") != "running":
+                print()
+                showed_progress = False
+            if status.get("status") == "failed":
+                print(f"Job {job_id} failed on the server.")
+                return None
+            if status.get("status") == "done":
+                return self.fetch_job(job_id, output_basename)
+            time.sleep(poll_interval)
+
+    def send_file_resumable(self, file_path: str, options: dict = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                            stripes: int = DEFAULT_STRIPES, max_retries: int = 3) -> Optional[str]:
+        """
+        Upload a file as offset-addressed chunks over several parallel connections, then
+        commit it for processing. If an earlier attempt for the same file was interrupted,
+        only the chunks the server is missing are sent again.
+        """
+        if not os.path.exists(file_path):
+            print(f"File {file_path} does not exist.")
+            return None
+
+        total_size = os.path.getsize(file_path)
+        media_type = os.path.splitext(os.path.basename(file_path))[1].lstrip('.').encode('utf-8')
+        # A session only serves the client that opened it, so every request names the same client
+        identity = {"api_key": options["api_key"]} if options and options.get("api_key") else {}
+
+        session = None
+        session_id = self._load_session_id(file_path)
+        if session_id:
+            response = self._request({"request_type": "upload_status", "session_id": session_id, **identity})
+            if response and "session_id" in response[0]:
+                session = response[0]
+                print(f"Resuming upload session {session_id}")
+
+        if not session:
+            response = self._request({"request_type": "upload_open", "total_size": total_size, "chunk_size": chunk_size, **identity}, media_type)
+            if not response or "session_id" not in response[0]:
+                self._print_error(response[0] if response else {})
+                return None
+            session = response[0]
+            self._save_session_id(file_path, session["session_id"])
+
+        session_id = session["session_id"]
+        chunk_size = session["chunk_size"]
+        missing = self._missing_offsets(total_size, chunk_size, session["received_ranges"])
+        print(f"Uploading {len(missing)} of {-(-total_size // chunk_size)} chunks over {stripes} connections...")
+
+        with ThreadPoolExecutor(max_workers=stripes) as executor:
+            results = list(executor.map(
+                lambda offset: self._send_chunk(file_path, session_id, offset, min(chunk_size, total_size - offset), max_retries, identity),
+                missing
+            ))
+        if not all(results):
+            print(f"Upload incomplete. Run the upload again to resume session {session_id}.")
+            return None
+
+        print("All chunks uploaded. Waiting for the server to process the file...")
+        original_basename = os.path.splitext(os.path.basename(file_path))[0]
+        result = self._request_result({"request_type": "upload_commit", "session_id": session_id, **identity, "options": {"progress": True, "checksum_algorithm": CHECKSUM_ALGORITHM, **(options or {})}}, original_basename)
+        if not result:
+            return None
+        self._forget_session_id(file_path)
+        response_json, output = result
+
+        if output:
+            return output
+        if "job_id" in response_json:
+            print(f"Job submitted: {response_json['job_id']} ({response_json.get('status')})")
+            return response_json["job_id"]
+        self._print_error(response_json)
+        return None
+
+    def _send_chunk(self, file_path: str, session_id: str, offset: int, size: int, max_retries: int, identity: Optional[dict] = None) -> bool:
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(size)
+        request = {
+            "request_type": "upload_chunk",
+            "session_id": session_id,
+            "offset": offset,
+            "checksum": hashlib.sha256(chunk).hexdigest(),
+            "checksum_algorithm": "sha256",
+            **(identity or {}),
+        }
+
+        for attempt in range(max_retries + 1):
+            if attempt:
+                # Back off before retrying a failed chunk
+                time.sleep(min(2 ** attempt, 30))
+            response = self._request(request, payload=chunk, client=TCPSocketClient())
+            if response and response[0].get("offset") == offset:
+                return True
+            print(f"Chunk at offset {offset} failed (attempt {attempt + 1} of {max_retries + 1}).")
+        return False
+
+    @staticmethod
+    def _missing_offsets(total_size: int, chunk_size: int, received_ranges: List[List[int]]) -> List[int]:
+        missing = []
+        for offset in range(0, total_size, chunk_size):
+            if not any(start <= offset < end for start, end in received_ranges):
+                missing.append(offset)
+        return missing
+
+    def _session_key(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load_sessions(self) -> dict:
+        try:
+            with open(os.path.join(self.output_dir, SESSIONS_FILE)) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _write_sessions(self, sessions: dict):
+        with open(os.path.join(self.output_dir, SESSIONS_FILE), 'w') as f:
+            json.dump(sessions, f)
+
+    def _load_session_id(self, file_path: str) -> Optional[str]:
+        return self._load_sessions().get(self._session_key(file_path))
+
+    def _save_session_id(self, file_path: str, session_id: str):
+        sessions = self._load_sessions()
+        sessions[self._session_key(file_path)] = session_id
+        self._write_sessions(sessions)
+
+    def _forget_session_id(self, file_path: str):
+        sessions = self._load_sessions()
+        if sessions.pop(self._session_key(file_path), None):
+            self._write_sessions(sessions)
+
+    def _request(self, request: dict, media_type: bytes = b'', payload: bytes = b'',
+                 client: Optional[TCPSocketClient] = None) -> Optional[Tuple[dict, str, bytes]]:
+        client = client or self.socket
+        if not client.connect(self.host, self.port):
+            return None
+        try:
+            self._send_request(request, media_type, payload, client)
+            return self._receive_response(client)
+        except Exception as e:
+            print(f"An error occurred while contacting the server: {e}")
+            return None
+        finally:
+            client.close()
+
+    def _request_result(self, request: dict, basename: str) -> Optional[Tuple[dict, Union[str, List[str], None]]]:
+        # Like _request, for requests answered with a processed file that is streamed to disk
+        if not self.socket.connect(self.host, self.port):
+            return None
+        try:
+            self._send_request(request, b'', b'')
+            return self._receive_result(basename)
+        except Exception as e:
+            print(f"An error occurred while contacting the server: {e}")
+            return None
+        finally:
+            self.socket.close()
+
+    def _send_upload(self, file_path: str, options: Optional[dict], client: Optional[TCPSocketClient] = None,
+                     show_transfer: bool = True) -> bool:
+        client = client or self.socket
+        # Extract media type from file name
+        file_name = os.path.basename(file_path)
+        media_type = os.path.splitext(file_name)[1].lstrip('.').encode('utf-8')
+        file_size = os.path.getsize(file_path)
+        # The digest goes in the JSON ahead of the payload; reading the file for it also warms the page cache for sendfile
+        options = {"checksum": self._file_checksum(file_path), "checksum_algorithm": CHECKSUM_ALGORITHM, **(options or {})}
+
+        print(f"Sending requset: options={options or {}}, media_type={media_type.decode('utf-8')}, payload_size={file_size}")
+        json_data = json.dumps(options or {}).encode('utf-8')
+        if not client.send(self._encode_header(json_data, media_type, file_size) + json_data + media_type):
+            return False
+
+        # The payload goes from the file to the socket without passing through user space
+        meter = TransferMeter(f"Uploading {file_name}", file_size) if show_transfer and self.show_transfer else None
+        with open(file_path, 'rb') as f:
+            offset = 0
+            while offset < file_size:
+                count = min(SENDFILE_SLICE, file_size - offset)
+                if not client.send_file(f, offset, count):
+                    return False
+                offset += count
+                if meter:
+                    meter.update(offset)
+        if meter:
+            meter.finish()
+        return True
+
+    def _send_request(self, options: dict, media_type: bytes, payload: bytes, client: Optional[TCPSocketClient] = None) -> bool:
+        client = client or self.socket
+        # Prepare the header with JSON metadata, media type, and payload size
+        json_data = json.dumps(options).encode('utf-8')
+        header = self._encode_header(json_data, media_type, len(payload))
+
+        return client.send(header) and client.send(json_data) and client.send(media_type) and client.send(payload)
+
+    @staticmethod
+    def _file_checksum(file_path: str) -> str:
+        hasher = hashlib.new(CHECKSUM_ALGORITHM)
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(RECEIVE_BUFFER_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _encode_header(json_data: bytes, media_type: bytes, payload_size: int) -> bytes:
+        return struct.pack('!HB', len(json_data), len(media_type)) + payload_size.to_bytes(5, 'big')
+
+    def _receive_response(self, client: Optional[TCPSocketClient] = None) -> Optional[Tuple[dict, str, bytes]]:
+        # Progress frames may come ahead of the actual response; show them and keep reading
+        showed_progress = False
+        while True:
+            response = self._receive_message(client)
+            if response and list(response[0]) == ["progress"] and not response[1] and not response[2]:
+                self._print_progress(response[0]["progress"])
+                showed_progress = True
+                continue
+            if showed_progress:
+                print()
+            return response
+
+    def _receive_result(self, basename: str, client: Optional[TCPSocketClient] = None) -> Optional[Tuple[dict, Union[str, List[str], None]]]:
+        """
+        Receive the response to an upload. A processed file is written to the output directory
+        while it arrives, through a reused buffer, so memory use does not grow with its size.
+        Returns the response JSON and the output path(s), or None as the output for an error response.
+        """
+        client = client or self.socket
+        showed_progress = False
+        while True:
+            head = self._receive_head(client)
+            if not head:
+                return None
+            response_json, response_media_type, payload_size = head
+            fields = [key for key in response_json if key != "request_id"]
+            if fields == ["progress"] and not response_media_type and not payload_size:
+                self._print_progress(response_json["progress"])
+                showed_progress = True
+                continue
+            if showed_progress:
+                print()
+            if not payload_size:
+                return response_json, None
+            output = self._save_stream(client, basename, response_media_type, payload_size, response_json.get("outputs"),
+                                       response_json.get("checksum"), response_json.get("checksum_algorithm"))
+            return (response_json, output) if output else None
+
+    def _receive_head(self, client: Optional[TCPSocketClient] = None) -> Optional[Tuple[dict, str, int]]:
+        # Header, JSON and media type of a message; the caller reads the payload
+        client = client or self.socket
+        response_header = self._receive_all(8, client)
+        if not response_header:
+            print("Failed to receive response header from server.")
+            return None
+
+        json_size, media_type_size = struct.unpack('!HB', response_header[:3])
+        payload_size = int.from_bytes(response_header[3:], 'big')
+
+        response_json_data = self._receive_all(json_size, client)
+        response_media_type = self._receive_all(media_type_size, client)
+
+        try:
+            response_json = json.loads(response_json_data.decode('utf-8')) if response_json_data else {}
+        except json.JSONDecodeError:
+            print("Failed to decode the response from the server.Raw data might be corrupted.")
+            response_json = {}
+
+        return response_json, (response_media_type or b'').decode('utf-8'), payload_size
+
+    def _receive_message(self, client: Optional[TCPSocketClient] = None) -> Optional[Tuple[dict, str, bytes]]:
+        client = client or self.socket
+        head = self._receive_head(client)
+        if not head:
+            return None
+        response_json, response_media_type, payload_size = head
+        response_payload = self._receive_all(payload_size, client)
+
+        if payload_size > 0 and not response_payload:
+            print("Connection closed before the full response payload arrived.")
+            return None
+
+        return response_json, response_media_type, response_payload or b''
+
+    def _save_stream(self, client: TCPSocketClient, basename: str, media_type: str, payload_size: int,
+                     outputs: Optional[List[dict]] = None, checksum: Optional[str] = None,
+                     checksum_algorithm: Optional[str] = None) -> Union[str, List[str], None]:
+        if media_type == MEDIA_TYPE_MULTI and outputs:
+            # Several outputs back to back; the JSON says how long each one is
+            output_paths = []
+            for index, output in enumerate(outputs):
+                output_path = self._save_stream(client, f"{basename}_{index}", output["media_type"], output["payload_size"],
+                                                checksum=output.get("checksum"), checksum_algorithm=checksum_algorithm)
+                if output_path is None:
+                    return None
+                output_paths.append(output_path)
+            return output_paths
+
+        output_filename = f"{basename}_processed.{media_type}"
+        output_path = os.path.join(self.output_dir, output_filename)
+        hasher = self._new_hasher(checksum_algorithm) if checksum else None
+        if checksum and hasher is None:
+            print(f"Warning: cannot compute {checksum_algorithm} checksums here (for xxHash, install the xxhash package); {output_filename} will not be verified.")
+
+        # The output only appears under its name once it is complete and verified
+        with open(output_path + TEMP_SUFFIX, 'wb') as f:
+            received = self._receive_stream(client, f, payload_size, f"Downloading {output_filename}", hasher)
+            if received:
+                f.flush()
+                os.fsync(f.fileno())
+        if not received:
+            os.remove(output_path + TEMP_SUFFIX)
+            print("Connection closed before the full response payload arrived.")
+            return None
+        if hasher and hasher.hexdigest() != checksum:
+            os.remove(output_path + TEMP_SUFFIX)
+            print(f"Checksum mismatch on {output_filename}: the download was corrupted and has been discarded.")
+            return None
+        os.replace(output_path + TEMP_SUFFIX, output_path)
+
+        if checksum and not hasher:
+            print(f"Processed file saved to {output_path}, UNVERIFIED: its checksum could not be checked.")
+        else:
+            print(f"Success! Processed file saved to {output_path}")
+        return output_path
+
+    @staticmethod
+    def _new_hasher(algorithm: Optional[str]):
+        # The same algorithms the server offers: hashlib's, and xxHash when the package is installed
+        if algorithm in hashlib.algorithms_available:
+            return hashlib.new(algorithm)
+        if xxhash and algorithm and algorithm.startswith("xxh") and hasattr(xxhash, algorithm):
+            return getattr(xxhash, algorithm)()
+        return None
+
+    def _receive_stream(self, client: TCPSocketClient, f, size: int, label: Optional[str] = None, hasher=None) -> bool:
+        # Copy size bytes from the socket to f (or drop them if f is None) through the thread's buffer,
+        # updating hasher on the way so the download is verified without reading it back
+        buffer = getattr(self._buffers, "buffer", None)
+        if buffer is None:
+            buffer = self._buffers.buffer = memoryview(bytearray(RECEIVE_BUFFER_SIZE))
+        meter = TransferMeter(label, size) if label and self.show_transfer else None
+
+        remaining = size
+        while remaining:
+            received = client.receive_into(buffer[:min(remaining, len(buffer))])
+            if not received:
+                return False
+            if hasher:
+                hasher.update(buffer[:received])
+            if f is not None:
+                f.write(buffer[:received])
+            remaining -= received
+            if meter:
+                meter.update(size - remaining)
+        if meter:
+            meter.finish()
+        return True
+
+    @staticmethod
+    def _print_progress(progress: dict, label: str = "Processing"):
+        percent = f"{progress['percent']:5.1f}%" if progress.get("percent") is not None else f"{progress.get('out_time', 0):.1f}s"
+        speed = f"{progress['speed']:.2f}x" if progress.get("speed") else "-"
+        eta = f"{progress['eta']:.0f}s" if progress.get("eta") is not None else "-"
+        print(f"\r{label}: {percent}  fps {progress.get('fps') or 0:.1f}  speed {speed}  ETA {eta}   ", end='', flush=True)
+
+    def _print_error(self, response_json: dict):
+        if not response_json:
+            print("Received an empty or invalid response from server.")
+        elif "error" in response_json:
+            error_details = response_json["error"]
+            print("\n---An error occurred on the server---")
+            print(f"Error code: {error_details.get('code', 'N/A')}")
+            print(f"Description: {error_details.get('description', 'No description provided')}")
+            print(f"Suggested solution: {error_details.get('solution', 'No solition provided')}")
+            if "retry_after" in error_details:
+                print(f"Server is busy. Retry after {error_details['retry_after']} seconds.")
+            print("-----------------------------------------\n")
+        else:
+            print(f"Received an unexpected response from server: {response_json}")
     
-    def _receive_all(self, n: int) -> Optional[bytes]:
+    def _receive_all(self, n: int, client: Optional[TCPSocketClient] = None) -> Optional[bytes]:
+        client = client or self.socket
         data = bytearray()
         while len(data) < n:
-            packet = self.socket.receive(n - len(data))
+            packet = client.receive(n - len(data))
             if not packet:
                 return None
             data.extend(packet)
@@ -1,5 +1,8 @@
+import argparse
 import logging
+import os
 from server.TCPSocketServer import TCPSocketServer
+from server.AsyncTCPSocketServer import AsyncTCPSocketServer
 from server.RequestHandler import RequestHandler
 from server.FileReceiver import FileReceiver
 from server.DiskWriter import DiskWriter
@@ -7,6 +10,17 @@ from server.StorageChecker import StorageChecker
 from server.VideoProcessor import VideoProcessor
 from server.ConnectionManager import ConnectionManager
 from server.StatusResponder import StatusResponder
+from server.ProcessingPool import ProcessingPool
+from server.JobManager import JobManager
+from server.UploadSessionManager import UploadSessionManager
+from server.ResultCache import ResultCache
+from server.QuotaManager import QuotaManager
+from server.StreamingTranscoder import StreamingTranscoder
+from server.MediaProber import MediaProber
+from server.EncoderTuner import EncoderTuner
+from server.RateLimiter import RateLimiter
+from server.Metrics import Metrics
+from server.MetricsServer import MetricsServer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,35 +33,126 @@ PORT = 5000
 STORAGE_PATH = "uploads"
 PROCESSED_PATH = "processed"
 MAX_STORAGE_SIZE = 10
+RESULT_CACHE_PATH = os.path.join(PROCESSED_PATH, "cache")
+RESULT_CACHE_MAX_BYTES = 50 * 1024 * 1024 * 1024
+BACKLOG = 1024
+PROCESSING_WORKERS = os.cpu_count() or 1
+PROCESSING_QUEUE_SIZE = 16
+COMPRESS_SEGMENTS = os.cpu_count() or 1
+JOB_RESULT_TTL = 3600
+# Parallel stripes of a resumable upload each use their own connection, and clients behind NAT share an IP
+MAX_CONNECTIONS_PER_IP = 64
+# Token bucket on new connections per IP: sustained connections per second and burst
+CONNECTION_RATE = 20.0
+CONNECTION_BURST = 100
+# Per-client quotas; clients are identified by their "api_key" option or their IP (0 = unlimited)
+CLIENT_STORAGE_QUOTA_BYTES = 100 * 1024 * 1024 * 1024
+CLIENT_MAX_CONCURRENT_UPLOADS = 8
+CLIENT_TRANSFER_QUOTA_BYTES = 0
+# Token bucket on uploads per client: sustained requests per second and burst
+CLIENT_REQUEST_RATE = 2.0
+CLIENT_REQUEST_BURST = 20
+# Fair scheduling of the processing slots (0 = unlimited); weights give a client a larger share
+CLIENT_MAX_ACTIVE_JOBS = 2
+CLIENT_MAX_QUEUED_JOBS = 8
+CLIENT_JOB_WEIGHTS = {}
+# Prometheus endpoint (GET /metrics); loopback only, the figures are for the operator.
+# Off unless a port is given: the common exporter ports (e.g. node_exporter's 9100) are likely taken on the host
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Video Compressor Service server")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded",
+                        help="Connection engine: one thread per connection, or a single asyncio event loop")
+    parser.add_argument("--backlog", type=int, default=BACKLOG, help="Listen backlog of the server socket")
+    parser.add_argument("--workers", type=int, default=None, help="Handler threads for the asyncio engine")
+    parser.add_argument("--processing-workers", type=int, default=PROCESSING_WORKERS, help="Concurrent ffmpeg jobs")
+    parser.add_argument("--segments", type=int, default=COMPRESS_SEGMENTS,
+                        help="Most segments one compress job encodes in parallel (1 disables segmenting)")
+    parser.add_argument("--queue-size", type=int, default=PROCESSING_QUEUE_SIZE, help="Jobs allowed to wait for a processing slot")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Port of the Prometheus metrics endpoint (0 disables it)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     logger = logging.getLogger('Main')
     logger.info("initializing Video Compressor Service...")
 
-    disk_writer = DiskWriter(STORAGE_PATH)
-    file_receiver = FileReceiver(disk_writer)
-    storage_checker = StorageChecker(STORAGE_PATH, MAX_STORAGE_SIZE)
-    video_processor = VideoProcessor(PROCESSED_PATH)
-    connection_manager = ConnectionManager()
+    metrics = Metrics()
+
+    quota_manager = QuotaManager(
+        max_storage_bytes=CLIENT_STORAGE_QUOTA_BYTES,
+        max_concurrent_reservations=CLIENT_MAX_CONCURRENT_UPLOADS,
+        max_transfer_bytes=CLIENT_TRANSFER_QUOTA_BYTES
+    )
+    storage_checker = StorageChecker(max_storage_tb=MAX_STORAGE_SIZE, storage_path=STORAGE_PATH, quota_manager=quota_manager)
+    disk_writer = DiskWriter(STORAGE_PATH, storage_checker, metrics=metrics)
+    file_receiver = FileReceiver(disk_writer, metrics=metrics)
+    encoder_tuner = EncoderTuner()
+    video_processor = VideoProcessor(PROCESSED_PATH, max_segments=args.segments, encoder_tuner=encoder_tuner, metrics=metrics)
+    streaming_transcoder = StreamingTranscoder(file_receiver)
+    media_prober = MediaProber()
+    processing_pool = ProcessingPool(
+        video_processor,
+        max_workers=args.processing_workers,
+        max_queue_size=args.queue_size,
+        max_queued_per_client=CLIENT_MAX_QUEUED_JOBS,
+        max_active_per_client=CLIENT_MAX_ACTIVE_JOBS,
+        client_weights=CLIENT_JOB_WEIGHTS
+    )
+    encoder_tuner.processing_pool = processing_pool
+    job_manager = JobManager(processing_pool, result_ttl=JOB_RESULT_TTL, disk_writer=disk_writer)
+    upload_session_manager = UploadSessionManager(disk_writer)
+    result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES, video_processor.get_ffmpeg_version())
+    request_rate_limiter = RateLimiter(rate=CLIENT_REQUEST_RATE, burst=CLIENT_REQUEST_BURST)
+    connection_manager = ConnectionManager(
+        max_connections_per_ip=MAX_CONNECTIONS_PER_IP,
+        rate_limiter=RateLimiter(rate=CONNECTION_RATE, burst=CONNECTION_BURST)
+    )
     status_responder = StatusResponder()
+    metrics.processing_queue_depth.set_function(processing_pool.queue_depth)
+    metrics.processing_active_jobs.set_function(processing_pool.active_jobs)
+    metrics.active_connections.set_function(connection_manager.active_connections)
+    if args.metrics_port:
+        MetricsServer(metrics, host=METRICS_HOST, port=args.metrics_port).start()
 
     def create_request_handler(connection):
-        return RequestHander(
-            connection=connection,
+        return RequestHandler(
             file_receiver=file_receiver,
             storage_checker=storage_checker,
             video_processor=video_processor,
-            status_responder=status_responder
+            status_responder=status_responder,
+            processing_pool=processing_pool,
+            job_manager=job_manager,
+            upload_session_manager=upload_session_manager,
+            result_cache=result_cache,
+            quota_manager=quota_manager,
+            streaming_transcoder=streaming_transcoder,
+            media_prober=media_prober,
+            rate_limiter=request_rate_limiter,
+            metrics=metrics
         )
     
-    server = TCPSocketServer(
-        host=HOST,
-        port=PORT,
-        handler_factory=create_request_handler,
-        connection_manager=connection_manager
-    )
+    if args.engine == "asyncio":
+        server = AsyncTCPSocketServer(
+            host=HOST,
+            port=PORT,
+            handler_factory=create_request_handler,
+            connection_manager=connection_manager,
+            backlog=args.backlog,
+            max_workers=args.workers
+        )
+    else:
+        server = TCPSocketServer(
+            host=HOST,
+            port=PORT,
+            handler_factory=create_request_handler,
+            connection_manager=connection_manager,
+            backlog=args.backlog
+        )
 
-    logger.info(f"Server initializtion complete.Starting now.")
+    logger.info(f"Server initializtion complete.Starting now with the {args.engine} engine.")
     server.start()
 
 if __name__ == "__main__":
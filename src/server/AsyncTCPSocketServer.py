@@ -0,0 +1,298 @@
+"""
+An asyncio based TCP socket server, an alternative engine to TCPSocketServer.
+A single event loop accepts every connection, applies the ConnectionManager
+admission rules and reads every request: header, JSON, media type and the
+payload of uploads and upload chunks all arrive through loop.sock_recv_into,
+so idle, slow-starting and slow-sending clients cost no thread at all. Only
+the work that blocks runs in a bounded thread pool executor: the request
+handler's checks and responses, writing and hashing each received block
+(RequestHandler.begin_request() returns a PayloadSink for that) and the
+CPU-heavy ffmpeg work. While one block is written the loop receives the next.
+A request that waits for its encode on the ProcessingPool, or for an identical
+request the ResultCache merged it with, hands the loop a PendingStep and is
+resumed on the executor once the wait is over; waiting holds no thread.
+Streaming uploads, whose payload is piped straight into ffmpeg, are the one
+request whose handler still reads the socket on its executor thread.
+Persistent connections stay on the loop between requests, and their pipelined
+requests are served concurrently, each on its own RequestChannel.
+The handler_factory / ConnectionManager contract is the same as TCPSocketServer:
+handler_factory(connection) returns a RequestHandler for one client.
+Attributes:
+    host (str): Address to bind the server to.
+    port (int): Port to bind the server to.
+    handler_factory (Callable): Creates a request handler for a connection.
+    connection_manager (ConnectionManager): Admission control for client IPs.
+    backlog (int): Listen backlog of the server socket.
+    max_workers (int): Number of executor threads running request handlers.
+    idle_timeout (float): Seconds a client may stay silent after connecting.
+    keep_alive_timeout (float): Seconds a persistent connection may stay silent between requests.
+Example:
+    server = AsyncTCPSocketServer('0.0.0.0', 5000, create_request_handler, ConnectionManager(), backlog=1024)
+    server.start()
+"""
+
+import asyncio
+import functools
+import os
+import socket
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Callable
+from .Connection import Connection
+from .ConnectionManager import ConnectionManager
+from .PayloadSink import PayloadSink
+from .PendingStep import PendingStep
+from .RequestChannel import RequestChannel
+from .RequestHandler import (RequestHandler, HEADER_SIZE, KEEP_ALIVE_IDLE_TIMEOUT, MAX_PIPELINED_REQUESTS,
+                             REQUEST_INCOMPLETE_HEADER, REQUEST_INCOMPLETE, REQUEST_MALFORMED)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('AsyncTCPSocketServer')
+
+DEFAULT_BACKLOG = 1024
+DEFAULT_IDLE_TIMEOUT = 60
+# Payload bytes received per executor write; two such buffers per upload alternate
+PAYLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+class AsyncTCPSocketServer:
+    def __init__(self, host: str, port: int, handler_factory: Callable, connection_manager: ConnectionManager,
+                 backlog: int = DEFAULT_BACKLOG, max_workers: Optional[int] = None, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 keep_alive_timeout: float = KEEP_ALIVE_IDLE_TIMEOUT):
+        self.server_socket: Optional[socket.socket] = None
+        self.host = host
+        self.port = port
+        self.handler_factory = handler_factory
+        self.connection_manager = connection_manager
+        self.backlog = backlog
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.idle_timeout = idle_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='RequestHandler')
+
+    def start(self):
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            logger.info("Server shutting down due to KeyboardInterrupt.")
+        except Exception as e:
+            logger.critical(f"Server failed to start or crashed: {e}")
+        finally:
+            if self.server_socket:
+                self.server_socket.close()
+                logger.info("Server socket closed.")
+            self.executor.shutdown(wait=False)
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        self.server_socket.setblocking(False)
+        logger.info(f"Async server started and listening on {self.host}:{self.port} (backlog={self.backlog}, workers={self.max_workers})")
+
+        tasks = set()
+        while True:
+            client_socket, client_address = await loop.sock_accept(self.server_socket)
+            task = loop.create_task(self._handle_client(client_socket, client_address))
+            # Keep a reference so pending tasks are not garbage collected
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def _handle_client(self, client_socket: socket.socket, client_address: Tuple[str, int]):
+        loop = asyncio.get_running_loop()
+        ip_address = client_address[0]
+
+        refusal = self.connection_manager.admit(ip_address)
+        if refusal is not None:
+            logger.warning(f"Rejected connection from {client_address}: {refusal}")
+            try:
+                await loop.sock_sendall(client_socket, f"SERVER_BUSY: {refusal}".encode('utf-8'))
+            except OSError:
+                pass
+            finally:
+                client_socket.close()
+            return
+
+        logger.info(f"Accepted connection from {client_address}")
+        Connection.prepare_socket(client_socket, client_address)
+        connection = Connection(client_socket, client_address)
+        requests = set()
+        try:
+            handler = self.handler_factory(connection)
+            # Bounds the requests one connection may have in flight; reading stalls until one finishes
+            slots = asyncio.Semaphore(MAX_PIPELINED_REQUESTS)
+            first = True
+            while True:
+                timeout = self.idle_timeout if first else self.keep_alive_timeout
+                if not await self._wait_readable(client_socket, timeout):
+                    logger.info(f"Client {client_address} sent nothing within {timeout}s. Closing.")
+                    break
+                request = await self._read_request(handler, connection, first)
+                if request is None:
+                    break
+                options, media_type, payload_size = request
+
+                if "request_id" not in options:
+                    if requests:
+                        await asyncio.wait(requests)
+                    await self._serve_request(handler, connection, options, media_type, payload_size)
+                    break
+
+                await slots.acquire()
+                released = loop.create_future()
+                channel = RequestChannel(connection, options["request_id"], connection.bytes_received + payload_size,
+                                         functools.partial(loop.call_soon_threadsafe, self._resolve, released))
+                task = loop.create_task(self._serve_request(handler, channel, options, media_type, payload_size))
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+                task.add_done_callback(lambda _: slots.release())
+                if payload_size:
+                    # The next request follows this one's payload on the wire
+                    await released
+                    unread = channel.unread_payload()
+                    if unread and not await self._discard(connection, unread):
+                        break
+                first = False
+            if requests:
+                await asyncio.wait(requests)
+        except Exception as e:
+            logger.error(f"Unhandled exception in handler for {client_address}: {e}")
+        finally:
+            self.connection_manager.remove_connection(ip_address)
+            connection.close()
+            logger.info(f"Handler finished and connection closed for {ip_address}")
+
+    async def _read_request(self, handler: RequestHandler, conn: Connection, first: bool) -> Optional[Tuple[dict, str, int]]:
+        loop = asyncio.get_running_loop()
+        header_data = await self._receive(conn, HEADER_SIZE)
+        if len(header_data) != HEADER_SIZE:
+            # The client closing a persistent connection between requests is its normal end
+            if first:
+                await loop.run_in_executor(self.executor, handler.reject_request, conn, REQUEST_INCOMPLETE_HEADER)
+            return None
+        json_size, media_type_size, payload_size = handler.parse_header(header_data)
+
+        json_data = await self._receive(conn, json_size)
+        media_type_data = await self._receive(conn, media_type_size) if len(json_data) == json_size else b''
+        if not json_data or len(json_data) != json_size or len(media_type_data) != media_type_size:
+            await loop.run_in_executor(self.executor, handler.reject_request, conn, REQUEST_INCOMPLETE)
+            return None
+
+        request = handler.parse_request(conn, json_data, media_type_data, payload_size)
+        if request is None:
+            await loop.run_in_executor(self.executor, handler.reject_request, conn, REQUEST_MALFORMED)
+        return request
+
+    async def _serve_request(self, handler: RequestHandler, conn: Connection, options: dict, media_type: str, payload_size: int) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            sink = await loop.run_in_executor(self.executor, handler.begin_request, conn, options, media_type, payload_size)
+            if sink is None:
+                # Served completely on the executor; only a streaming upload reads its payload there
+                result = await loop.run_in_executor(self.executor, handler.serve_request, conn, options, media_type, payload_size)
+                return await self._wait_steps(handler, conn, result)
+            if not isinstance(sink, PayloadSink):
+                return sink
+            try:
+                await self._feed(conn, sink)
+            except Exception as e:
+                # finish_payload() still has to run to release what begin_request() took
+                logger.error(f"Error receiving the payload from {conn.address}: {e}")
+            # The payload is in; the loop can read the next pipelined request while this one is finished
+            conn.release()
+            result = await loop.run_in_executor(self.executor, handler.finish_payload, conn, sink)
+            return await self._wait_steps(handler, conn, result)
+        except Exception as e:
+            logger.error(f"Unhandled exception serving a request from {conn.address}: {e}")
+            return False
+        finally:
+            conn.release()
+
+    async def _wait_steps(self, handler: RequestHandler, conn: Connection, result) -> bool:
+        """Wait for what the request waits for on the loop, then resume it on the executor."""
+        loop = asyncio.get_running_loop()
+        while isinstance(result, PendingStep):
+            # A failed future is the request's own business; resume() reports it to the client
+            await asyncio.wait([asyncio.wrap_future(result.future)])
+            result = await loop.run_in_executor(self.executor, handler.resume, conn, result)
+        return result
+
+    async def _feed(self, conn: Connection, sink: PayloadSink):
+        """Receive the payload of sink on the loop; the executor writes one block while the next arrives."""
+        loop = asyncio.get_running_loop()
+        head = await self._receive(conn, sink.head_size)
+        if not await loop.run_in_executor(self.executor, sink.write, memoryview(head)) or len(head) != sink.head_size:
+            return
+        remaining = sink.size - len(head)
+        buffers = [bytearray(min(PAYLOAD_BLOCK_SIZE, remaining)) for _ in range(2 if remaining > PAYLOAD_BLOCK_SIZE else 1)]
+        writing = None
+        index = 0
+        while remaining:
+            view = memoryview(buffers[index])[:min(len(buffers[index]), remaining)]
+            n = await self._receive_into(conn, view)
+            if writing and not await writing:
+                return
+            writing = None
+            if not n:
+                return
+            writing = loop.run_in_executor(self.executor, sink.write, view[:n])
+            remaining -= n
+            index = (index + 1) % len(buffers)
+            if n < len(view):
+                break
+        if writing:
+            await writing
+
+    async def _receive(self, conn: Connection, size: int) -> bytes:
+        buffer = bytearray(size)
+        n = await self._receive_into(conn, memoryview(buffer))
+        return bytes(buffer[:n])
+
+    async def _receive_into(self, conn: Connection, view: memoryview) -> int:
+        """Fill view from the socket. Returns the bytes received, fewer only if the client closed the connection."""
+        loop = asyncio.get_running_loop()
+        received = 0
+        try:
+            while received < len(view):
+                n = await loop.sock_recv_into(conn.socket, view[received:])
+                if not n:
+                    break
+                received += n
+        except OSError as e:
+            logger.error(f"Error receiving data from {conn.address}: {e}")
+        conn.record_received(received)
+        return received
+
+    async def _discard(self, conn: Connection, size: int) -> bool:
+        """Read and drop size bytes, e.g. the payload of a refused request. False if the connection ended first."""
+        buffer = memoryview(bytearray(min(size, PAYLOAD_BLOCK_SIZE)))
+        while size > 0:
+            n = await self._receive_into(conn, buffer[:min(len(buffer), size)])
+            if not n:
+                return False
+            size -= n
+        return True
+
+    @staticmethod
+    def _resolve(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    async def _wait_readable(self, client_socket: socket.socket, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = client_socket.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(True))
+        try:
+            await asyncio.wait_for(readable, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(fd)
@@ -0,0 +1,87 @@
+"""
+Checksum creates the hashers behind end-to-end checksums of uploads and results.
+A client names an algorithm ("checksum_algorithm") and sends the digest of its
+file ("checksum") in the request JSON. The server feeds every received block to
+the hasher as it arrives, so the upload is verified without reading the file a
+second time, and answers with the digest of each output in the same algorithm.
+BLAKE2 and the SHA family come from hashlib; the xxHash algorithms are
+available when the optional xxhash package is installed.
+A verified digest of a collision resistant algorithm also identifies the
+content for the result cache and the probe cache (content_key()), so such
+an upload is hashed only once.
+Attributes:
+    DEFAULT_CHECKSUM_ALGORITHM (str): Algorithm assumed when a request has a checksum but names none.
+    CONTENT_KEY_ALGORITHMS (tuple): Algorithms whose digests may key cached results.
+Example:
+    hasher = Checksum.new("blake2b")
+    tee = HashTee(hasher, hashlib.sha256())
+    tee.update(block)
+    ...
+    if hasher.hexdigest() != options["checksum"]:
+        ...reject the upload...
+    digest = Checksum.file_digest("processed/output.mp4", "blake2b")
+"""
+
+import hashlib
+from typing import List, Optional
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_CHECKSUM_ALGORITHM = "blake2b"
+HASHLIB_ALGORITHMS = ("blake2b", "blake2s", "sha256", "sha512", "sha1", "md5")
+XXHASH_ALGORITHMS = ("xxh64", "xxh3_64", "xxh3_128", "xxh128")
+# A client could craft colliding uploads for the others and be served someone else's cached result
+CONTENT_KEY_ALGORITHMS = ("blake2b", "blake2s", "sha256", "sha512")
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+class Checksum:
+
+    @staticmethod
+    def supported() -> List[str]:
+        return list(HASHLIB_ALGORITHMS) + (list(XXHASH_ALGORITHMS) if xxhash else [])
+
+    @staticmethod
+    def is_supported(algorithm: Optional[str]) -> bool:
+        return algorithm in HASHLIB_ALGORITHMS or bool(xxhash) and algorithm in XXHASH_ALGORITHMS
+
+    @staticmethod
+    def new(algorithm: Optional[str]):
+        """A new hasher for algorithm, or None if the algorithm is not supported."""
+        if algorithm in HASHLIB_ALGORITHMS:
+            return hashlib.new(algorithm)
+        if xxhash and algorithm in XXHASH_ALGORITHMS:
+            return getattr(xxhash, algorithm)()
+        return None
+
+    @staticmethod
+    def content_key(algorithm: Optional[str], digest: str) -> Optional[str]:
+        """Cache key for content with digest, or None if algorithm is not collision resistant."""
+        if algorithm not in CONTENT_KEY_ALGORITHMS:
+            return None
+        # A plain SHA-256 digest is what ResultCache.hash_file() computes for committed upload sessions
+        return digest if algorithm == "sha256" else f"{algorithm}:{digest}"
+
+    @staticmethod
+    def file_digest(file_path: str, algorithm: str) -> Optional[str]:
+        hasher = Checksum.new(algorithm)
+        if hasher is None:
+            return None
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(FILE_CHUNK_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+
+class HashTee:
+    """Feeds the same data to several hashers, e.g. the client's checksum and the cache key."""
+
+    def __init__(self, *hashers):
+        self.hashers = [hasher for hasher in hashers if hasher is not None]
+
+    def update(self, data):
+        for hasher in self.hashers:
+            hasher.update(data)
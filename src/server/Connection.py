@@ -1,30 +1,208 @@
+import os
+import select
 import socket
+import threading
 import logging
-from typing import Optional, Tuple
+from typing import BinaryIO, List, Optional, Tuple
 
 logger = logging.getLogger('Connection')
 
+SEND_CHUNK_SIZE = 64 * 1024
+
+# poll() events; the select() fallback only tells the two apart
+READABLE = getattr(select, 'POLLIN', 1)
+WRITABLE = getattr(select, 'POLLOUT', 4)
+
 class Connection:
 
     def __init__(self, client_socket: socket.socket, client_address: Tuple[str, int]):
         self.socket = client_socket
         self.address = client_address
+        # Set on the channels of requests sent over a persistent connection; echoed in every response
+        self.request_id = None
+        # Responses of pipelined requests are sent from several threads; hold this around a whole message
+        self.send_lock = threading.RLock()
+        # Bytes read from the socket so far, so unread payload can be skipped between requests
+        self.bytes_received = 0
 
-    def send(self, data: bytes) -> bool:
+    @staticmethod
+    def prepare_socket(client_socket: socket.socket, client_address: Tuple[str, int]):
+        """
+        Set up a freshly accepted client socket, once, before any Connection uses it. The socket
+        becomes non-blocking and every call below waits for it with poll, so a send can be given a
+        deadline without switching the mode of a socket that pipelined requests share.
+        """
+        client_socket.setblocking(False)
+        # Responses go out as whole messages (header in one gather write, then the payload). With Nagle's algorithm
+        # the tail of a response would wait for the client's delayed ACK on a connection that is kept open
+        if client_socket.family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError as e:
+                logger.warning(f"Could not disable Nagle's algorithm for {client_address}: {e}")
+
+    def send(self, data: bytes, timeout: Optional[float] = None) -> bool:
+        """
+        Send all of data. timeout bounds how long a single send may stall on a client
+        that stopped reading, as in send_file.
+        """
         try:
-            self.socket.sendall(data)
+            with self.send_lock:
+                view = memoryview(data)
+                while view:
+                    view = view[self._send_ready(view, timeout):]
             return True
+        except socket.timeout:
+            logger.error(f"Timed out sending data to slow client {self.address}")
+            return False
         except Exception as e:
             logger.error(f"Failed to send data to {self.address}: {e}")
             return False
     
+    def send_vectored(self, buffers: List[bytes], timeout: Optional[float] = None) -> bool:
+        # Header, JSON and media type go out in a single gather write instead of one send each
+        try:
+            with self.send_lock:
+                if not hasattr(self.socket, 'sendmsg'):
+                    return self.send(b''.join(buffers), timeout)
+                views = [memoryview(b) for b in buffers if b]
+                while views:
+                    sent = self._wait_for(lambda: self.socket.sendmsg(views), WRITABLE, timeout)
+                    while views and sent >= len(views[0]):
+                        sent -= len(views[0])
+                        views.pop(0)
+                    if views and sent:
+                        views[0] = views[0][sent:]
+            return True
+        except socket.timeout:
+            logger.error(f"Timed out sending data to slow client {self.address}")
+            return False
+        except Exception as e:
+            logger.error(f"Failed to send data to {self.address}: {e}")
+            return False
+
+    def send_file(self, file: BinaryIO, count: int, timeout: Optional[float] = None) -> bool:
+        """
+        Send count bytes of file from its current position with os.sendfile, falling back
+        to chunked sends through a reused buffer. timeout bounds how long a single send may
+        stall on a slow client; it is enforced by waiting for the socket with poll, so other
+        requests on the same socket are not affected.
+        """
+        with self.send_lock:
+            start = file.tell()
+            sent = 0
+            try:
+                try:
+                    while sent < count:
+                        n = self._wait_for(lambda: os.sendfile(self.socket.fileno(), file.fileno(), start + sent, count - sent), WRITABLE, timeout)
+                        if not n:
+                            break
+                        sent += n
+                except socket.timeout:
+                    raise
+                except (OSError, ValueError, AttributeError) as e:
+                    # Not a regular file, or no sendfile on this platform
+                    logger.warning(f"sendfile failed for {self.address}, falling back to chunked send: {e}")
+                if sent < count:
+                    file.seek(start + sent)
+                    sent += self._send_file_chunked(file, count - sent, timeout)
+                file.seek(start + sent)
+                return sent == count
+            except socket.timeout:
+                logger.error(f"Timed out sending file to slow client {self.address}")
+                return False
+            except Exception as e:
+                logger.error(f"Failed to send file to {self.address}: {e}")
+                return False
+
+    def _send_file_chunked(self, file: BinaryIO, count: int, timeout: Optional[float] = None) -> int:
+        buffer = bytearray(SEND_CHUNK_SIZE)
+        view = memoryview(buffer)
+        sent = 0
+        while sent < count:
+            n = file.readinto(view[:min(SEND_CHUNK_SIZE, count - sent)])
+            if not n:
+                break
+            chunk = view[:n]
+            while chunk:
+                chunk = chunk[self._send_ready(chunk, timeout):]
+            sent += n
+        return sent
+
+    def _send_ready(self, data: memoryview, timeout: Optional[float] = None) -> int:
+        return self._wait_for(lambda: self.socket.send(data), WRITABLE, timeout)
+
+    def _wait_for(self, operation, events: int, timeout: Optional[float] = None):
+        """
+        Run a non-blocking socket operation, waiting with poll for as long as it would block.
+        Raises socket.timeout if the socket is not ready within timeout seconds of a wait.
+        """
+        while True:
+            try:
+                return operation()
+            except (BlockingIOError, InterruptedError):
+                pass
+            if not self._poll(events, timeout):
+                raise socket.timeout(f"socket not ready within {timeout}s")
+
+    def _poll(self, events: int, timeout: Optional[float]) -> bool:
+        if not hasattr(select, 'poll'):
+            readers, writers, _ = select.select([self.socket] if events & READABLE else [],
+                                                   [self.socket] if events & WRITABLE else [], [], timeout)
+            return bool(readers or writers)
+        poller = select.poll()
+        poller.register(self.socket, events)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+
     def receive(self, size: int) -> bytes:
         try:
-            return self.socket.recv(size)
+            data = self._wait_for(lambda: self.socket.recv(size), READABLE)
+            self.record_received(len(data))
+            return data
         except Exception as e:
             logger.error(f"Error receiving data: {e}")
             return b''
-    
+
+    def receive_all(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            packet = self.receive(size - len(data))
+            if not packet:
+                break
+            data.extend(packet)
+        return bytes(data)
+
+    def receive_into(self, buffer: memoryview, size: int = 0) -> int:
+        try:
+            n = self._wait_for(lambda: self.socket.recv_into(buffer, size), READABLE)
+            self.record_received(n)
+            return n
+        except Exception as e:
+            logger.error(f"Error receiving data: {e}")
+            return 0
+
+    def record_received(self, size: int):
+        # Also called by readers that bypass receive(), such as splice()
+        self.bytes_received += size
+
+    def wait_readable(self, timeout: Optional[float]) -> bool:
+        try:
+            return self._poll(READABLE, timeout)
+        except (OSError, ValueError):
+            return False
+
+    def wait_writable(self, timeout: Optional[float]) -> bool:
+        try:
+            return self._poll(WRITABLE, timeout)
+        except (OSError, ValueError):
+            return False
+
+    def release(self):
+        """Called once the current request's payload has been read completely."""
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
     def close(self):
         try:
             self.socket.close()
@@ -1,23 +1,49 @@
 import threading
 import logging
+from collections import defaultdict
+from typing import Optional
+from .RateLimiter import RateLimiter
 
 logger = logging.getLogger('ConnectionManager')
 
+# Clients behind one NAT share an IP, so allow many connections and rely on the rate limit and per-client job limits
+DEFAULT_MAX_CONNECTIONS_PER_IP = 64
+
 class ConnectionManager:
-    def __init__(self):
-        self._active_ips = set()
-        self._lock = threading.Lock()
-    
+    def __init__(self, max_connections_per_ip: int = DEFAULT_MAX_CONNECTIONS_PER_IP, rate_limiter: Optional[RateLimiter] = None):
+        self.max_connections_per_ip = max_connections_per_ip
+        # Optional token bucket per IP on new connections
+        self.rate_limiter = rate_limiter
+        self._active_ips = defaultdict(int)
+        # Reentrant, so active_connections() can be read both inside and outside the other methods
+        self._lock = threading.RLock()
+
     def add_connection(self, ip_address: str) -> bool:
+        return self.admit(ip_address) is None
+
+    def admit(self, ip_address: str) -> Optional[str]:
+        """Add a connection for ip_address. Returns None if it was admitted, otherwise the reason it was refused."""
+        if self.rate_limiter:
+            wait = self.rate_limiter.acquire(ip_address)
+            if wait:
+                logger.warning(f"Connection rate limit reached for IP: {ip_address}. Next connection allowed in {wait:.1f}s")
+                return f"Too many new connections from your IP. Please retry after {wait:.1f} seconds."
         with self._lock:
-            if ip_address in self._active_ips:
-                logger.warning(f"Connection attempt from an already active IP: {ip_address}")
-                return False
-            self._active_ips.add(ip_address)
-            logger.info(f"Added new connection for IP: {ip_address}.Active connections: {len(self._active_ips)}")
-            return True
-    
+            if self._active_ips[ip_address] >= self.max_connections_per_ip:
+                logger.warning(f"IP {ip_address} already has {self.max_connections_per_ip} active connections")
+                return f"Your IP has reached its limit of {self.max_connections_per_ip} open connections. Close one and retry."
+            self._active_ips[ip_address] += 1
+            logger.info(f"Added new connection for IP: {ip_address}.Active connections: {self.active_connections()}")
+            return None
+
     def remove_connection(self, ip_address: str):
         with self._lock:
-            self._active_ips.discard(ip_address)
-            logger.info(f"Removed connection for IP: {ip_address}. Active connections: {len(self._active_ips)}")
\ No newline at end of file
+            if self._active_ips.get(ip_address, 0) > 1:
+                self._active_ips[ip_address] -= 1
+            else:
+                self._active_ips.pop(ip_address, None)
+            logger.info(f"Removed connection for IP: {ip_address}. Active connections: {self.active_connections()}")
+
+    def active_connections(self) -> int:
+        with self._lock:
+            return sum(self._active_ips.values())
\ No newline at end of file
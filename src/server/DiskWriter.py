@@ -2,9 +2,16 @@
 A class that handles writing files to disk.
 This class manages file storage operations in a specified directory, 
 handling directory creation and preventing filename collisions.
+Every byte written or deleted is reported to the optional StorageChecker so
+its usage counter stays current without walking the storage tree.
+Files are written under a temporary ".part" name, flushed to disk with fsync
+and only then renamed to their final name, so a file under its final name is
+always complete; a crash leaves at most a ".part" file, removed on the next start.
 Attributes:
     storage_dir (str): Directory path where files will be stored. 
                       Defaults to "uploads".
+    storage_checker (StorageChecker): Optional usage counter to keep up to date.
+    metrics (Metrics): Optional timings of whole-file writes and commits.
 Example:
     ```
     writer = DiskWriter(storage_dir="my_uploads")
@@ -16,7 +23,11 @@ Example:
 
 import os
 import logging
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from .StorageChecker import StorageChecker
+from .Metrics import Metrics
 
 logging.basicConfig(
     level=logging.INFO,
@@ -24,10 +35,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger('DiskWriter')
 
+# Suffix of files that are still being written
+TEMP_SUFFIX = ".part"
+
 class DiskWriter:
 
-    def __init__(self, storage_dir: str = "uploads"):
+    def __init__(self, storage_dir: str = "uploads", storage_checker: Optional[StorageChecker] = None, metrics: Optional[Metrics] = None):
         self.storage_dir = storage_dir
+        self.storage_checker = storage_checker
+        self.metrics = metrics
+        # Client that owns each stored file, so deletions are charged back to the right quota
+        self._owners: Dict[str, str] = {}
+        self._owners_lock = threading.Lock()
 
         if not os.path.exists(self.storage_dir):
             try:
@@ -35,28 +54,134 @@ class DiskWriter:
                 logger.info(f"Created storage directory: {self.storage_dir}")
             except Exception as e:
                 logger.error(f"Failed to create storage directory: {e}")
+        else:
+            self._remove_temp_files()
     
-    def write_to_disk(self, file_data: bytes, filename: str) -> Optional[str]:
+    def write_to_disk(self, file_data: bytes, filename: str, client_id: Optional[str] = None) -> Optional[str]:
         try:
-            # Extract base name and extension
-            base_name, ext = os.path.splitext(filename) 
-            file_path = os.path.join(self.storage_dir, filename)
-            # To handle duplicate filenames
-            counter = 1 
-
-            while os.path.exists(file_path):
-                new_filename = f"{base_name}_{counter}{ext}"
-                file_path = os.path.join(self.storage_dir, new_filename)
-                counter += 1
-            
-            with open(file_path, 'wb') as f:
+            temp_path = self._unique_path(filename) + TEMP_SUFFIX
+
+            started = time.monotonic()
+            with open(temp_path, 'xb') as f:
                 f.write(file_data)
-            
-            logger.info(f"Successfully wrote file to disk: {file_path}")
-            return file_path
+                f.flush()
+                os.fsync(f.fileno())
+            if self.metrics:
+                self.metrics.disk_write_seconds.observe(time.monotonic() - started, "write")
+            self._record_write(temp_path, len(file_data), client_id)
         except Exception as e:
             logger.error(f"Failed to write file to disk: {e}")
             return None
 
+        file_path = self.commit_file(temp_path)
+        if file_path:
+            logger.info(f"Successfully wrote file to disk: {file_path}")
+        return file_path
+
+    def create_file(self, filename: str, file_size: int, client_id: Optional[str] = None, reserved: bool = False) -> Optional[Tuple[str, int]]:
+        """
+        Create an empty file for a streamed upload and preallocate file_size bytes.
+        The file gets a temporary name until it is complete and passed to commit_file().
+        reserved tells that the caller already moved the upload's reservation into the usage
+        counters (StorageChecker.commit_reservation); the size is then only given back on failure.
+        Returns (file_path, fd); the caller owns the descriptor and must fsync and close it.
+        """
+        try:
+            file_path = self._unique_path(filename) + TEMP_SUFFIX
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except Exception as e:
+            logger.error(f"Failed to create file on disk: {e}")
+            if reserved and self.storage_checker:
+                self.storage_checker.record_delete(file_size, client_id)
+            return None
+
+        # Account for the full size up front; a failed upload gives it back in remove_file
+        if reserved:
+            self._record_owner(file_path, client_id)
+        else:
+            self._record_write(file_path, file_size, client_id)
+        if file_size > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, file_size)
+            except OSError as e:
+                # Not every filesystem supports fallocate; the file simply grows as it is written
+                logger.warning(f"Could not preallocate {file_size} bytes for {file_path}: {e}")
+
+        logger.info(f"Created file for streaming: {file_path} ({file_size} bytes)")
+        return file_path, fd
+
+    def commit_file(self, temp_path: str) -> Optional[str]:
+        """
+        Give a complete, fsynced file from create_file() its final name. The rename is atomic,
+        so readers see either no file or the whole file. Returns the final path.
+        """
+        started = time.monotonic()
+        try:
+            file_path = self._unique_path(os.path.basename(temp_path[:-len(TEMP_SUFFIX)]))
+            os.rename(temp_path, file_path)
+            self._sync_directory()
+        except Exception as e:
+            logger.error(f"Failed to commit file {temp_path}: {e}")
+            self.remove_file(temp_path)
+            return None
+
+        if self.metrics:
+            self.metrics.disk_write_seconds.observe(time.monotonic() - started, "commit")
+        with self._owners_lock:
+            if temp_path in self._owners:
+                self._owners[file_path] = self._owners.pop(temp_path)
+        return file_path
+
+    def remove_file(self, file_path: str) -> bool:
+        try:
+            if os.path.exists(file_path):
+                size = os.path.getsize(file_path)
+                os.remove(file_path)
+                with self._owners_lock:
+                    client_id = self._owners.pop(file_path, None)
+                if self.storage_checker:
+                    self.storage_checker.record_delete(size, client_id)
+                logger.info(f"Removed file from disk: {file_path}")
+            return True
+        except OSError as e:
+            logger.error(f"Failed to remove file {file_path}: {e}")
+            return False
+
+    def _record_write(self, file_path: str, size: int, client_id: Optional[str]):
+        self._record_owner(file_path, client_id)
+        if self.storage_checker:
+            self.storage_checker.record_write(size, client_id)
+
+    def _record_owner(self, file_path: str, client_id: Optional[str]):
+        if client_id:
+            with self._owners_lock:
+                self._owners[file_path] = client_id
+
+    def _sync_directory(self):
+        # Makes the rename itself durable
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.storage_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _remove_temp_files(self):
+        # Leftovers of uploads that were cut off by a restart
+        for name in os.listdir(self.storage_dir):
+            if name.endswith(TEMP_SUFFIX):
+                self.remove_file(os.path.join(self.storage_dir, name))
+
+    def _unique_path(self, filename: str) -> str:
+        # Extract base name and extension
+        base_name, ext = os.path.splitext(filename) 
+        file_path = os.path.join(self.storage_dir, filename)
+        # To handle duplicate filenames
+        counter = 1 
 
-            
\ No newline at end of file
+        while os.path.exists(file_path):
+            new_filename = f"{base_name}_{counter}{ext}"
+            file_path = os.path.join(self.storage_dir, new_filename)
+            counter += 1
+        return file_path
@@ -0,0 +1,137 @@
+"""
+EncoderTuner picks x264 settings for a compress job from its urgency and the server load.
+Clients may send a "priority" (low/normal/high) and a "deadline" in seconds.
+The priority sets the starting preset; every full round of work queued ahead
+of the processing slots moves it one step faster, so throughput degrades
+gracefully under load instead of latency blowing up. With a deadline the
+tuner estimates the encode time of each preset from the measured speed of
+earlier encodes of similar inputs (same resolution class) and takes the
+slowest preset that still finishes in time, capping the resolution when even
+the fastest preset would not. The thread budget shrinks as more slots are busy.
+Attributes:
+    processing_pool (ProcessingPool): Pool whose queue depth and active jobs define the load.
+    cpu_count (int): Cores shared by all encodes.
+Example:
+    tuner = EncoderTuner()
+    tuner.processing_pool = pool
+    settings = tuner.select(duration=600, height=2160, options={"deadline": 300, "deadline_at": time.time() + 300})
+    ...encode with settings["preset"], settings["crf"], settings["threads"], settings["max_height"]...
+    tuner.record(2160, settings["preset"], 600, elapsed)
+"""
+
+import os
+import threading
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('EncoderTuner')
+
+# Fastest first
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow"]
+# Speed of each preset relative to "medium", used to fill in presets that have not been measured
+PRESET_SPEED_FACTORS = {
+    "ultrafast": 8.0, "superfast": 6.0, "veryfast": 4.0, "faster": 2.5,
+    "fast": 1.6, "medium": 1.0, "slow": 0.6,
+}
+# Starting preset per priority: urgent jobs favor latency, batch jobs favor compression
+PRIORITY_PRESETS = {"high": "veryfast", "normal": "fast", "low": "medium"}
+DEFAULT_PRIORITY = "normal"
+# x264 constant rate factor of compress jobs; urgency only trades speed, so the quality target stays put
+DEFAULT_CRF = 28
+
+# Resolution classes that share speed measurements, by frame height
+HEIGHT_CLASSES = (480, 720, 1080, 2160)
+# Heights a deadline-bound encode may be scaled down to, largest first
+RESOLUTION_CAPS = (1080, 720, 480, 360)
+# Guess of "medium" speed at 1080p, in seconds of video per second of encoding, before anything is measured
+DEFAULT_MEDIUM_SPEED_1080P = 1.0
+# Weight of the newest measurement in the moving average of encode speeds
+SPEED_SMOOTHING = 0.3
+
+
+class EncoderTuner:
+
+    def __init__(self, processing_pool=None, cpu_count: Optional[int] = None):
+        self.processing_pool = processing_pool
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+
+        # (height class, preset) -> seconds of video encoded per second
+        self._speeds: Dict[Tuple[int, str], float] = {}
+        self._lock = threading.Lock()
+
+    def select(self, duration: Optional[float], height: Optional[int], options: dict) -> dict:
+        """Returns {"preset", "crf", "threads", "max_height"} for a compress job about to start."""
+        busy_slots, load = self._load()
+        index = PRESETS.index(PRIORITY_PRESETS.get(options.get("priority"), PRIORITY_PRESETS[DEFAULT_PRIORITY]))
+        # One step faster for every full round of jobs waiting behind the busy slots
+        index = max(0, index - int(load))
+
+        max_height = None
+        deadline_at = options.get("deadline_at")
+        if deadline_at and duration:
+            remaining = deadline_at - time.time()
+            height_class = self._height_class(height)
+            fitting = [i for i in range(index, -1, -1) if duration / self._speed(height_class, PRESETS[i]) <= remaining]
+            if fitting:
+                index = fitting[0]
+            else:
+                index = 0
+                max_height = self._resolution_cap(duration, height, remaining)
+
+        # Idle servers give one job every core; busy ones split the cores between the running jobs
+        threads = max(1, self.cpu_count // max(1, busy_slots))
+        settings = {"preset": PRESETS[index], "crf": DEFAULT_CRF, "threads": threads, "max_height": max_height}
+        logger.info(f"Encoder settings for priority={options.get('priority', DEFAULT_PRIORITY)}, deadline={options.get('deadline')}, load={load:.2f}: {settings}")
+        return settings
+
+    def record(self, height: Optional[int], preset: str, duration: Optional[float], elapsed: float):
+        """Feed back how fast an encode ran, in seconds of video per second."""
+        if not duration or elapsed <= 0:
+            return
+        key = (self._height_class(height), preset)
+        speed = duration / elapsed
+        with self._lock:
+            previous = self._speeds.get(key)
+            self._speeds[key] = speed if previous is None else previous + SPEED_SMOOTHING * (speed - previous)
+
+    def _load(self) -> Tuple[int, float]:
+        # (slots in use including this job, rounds of queued work per slot)
+        if not self.processing_pool:
+            return 1, 0.0
+        workers = self.processing_pool.max_workers
+        busy_slots = min(workers, max(1, self.processing_pool.active_jobs()))
+        return busy_slots, self.processing_pool.queue_depth() / workers
+
+    def _speed(self, height_class: int, preset: str) -> float:
+        with self._lock:
+            measured = self._speeds.get((height_class, preset))
+            if measured:
+                return measured
+            # Derive from another preset measured for the same resolution class
+            for (measured_class, measured_preset), speed in self._speeds.items():
+                if measured_class == height_class:
+                    return speed * PRESET_SPEED_FACTORS[preset] / PRESET_SPEED_FACTORS[measured_preset]
+        pixels_ratio = (1080 / height_class) ** 2
+        return DEFAULT_MEDIUM_SPEED_1080P * pixels_ratio * PRESET_SPEED_FACTORS[preset]
+
+    def _resolution_cap(self, duration: float, height: Optional[int], remaining: float) -> Optional[int]:
+        # Encode time scales roughly with the pixel count, so estimate from the full-size speed
+        if not height:
+            return None
+        speed = self._speed(self._height_class(height), PRESETS[0])
+        for cap in RESOLUTION_CAPS:
+            if cap < height and duration / (speed * (height / cap) ** 2) <= remaining:
+                return cap
+        return RESOLUTION_CAPS[-1] if RESOLUTION_CAPS[-1] < height else None
+
+    @staticmethod
+    def _height_class(height: Optional[int]) -> int:
+        for height_class in HEIGHT_CLASSES:
+            if height and height <= height_class:
+                return height_class
+        return HEIGHT_CLASSES[-1] if height else 1080
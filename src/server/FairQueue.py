@@ -0,0 +1,126 @@
+"""
+FairQueue is a weighted fair queue of processing jobs, one FIFO lane per client.
+Jobs are scheduled by start-time fair queuing: every job gets a virtual start
+tag when it is queued, one 1/weight step after the previous job of the same
+client, but never earlier than the current virtual time. get() always hands out
+the waiting job with the smallest tag, so clients take turns in proportion to
+their weights and a client that queues fifty jobs only delays its own backlog;
+a newcomer's first job is served after at most one job of every other client.
+Clients can additionally be capped in how many jobs they run at once and how
+many they may have waiting. The interface follows queue.Queue (put_nowait()
+raising queue.Full, blocking get()), with task_done() called per finished job.
+Attributes:
+    maxsize (int): Jobs allowed to wait in total.
+    max_queued_per_client (int): Jobs one client may have waiting (0 = unlimited).
+    max_active_per_client (int): Jobs of one client that may run at once (0 = unlimited).
+    weights (dict): Share of each client ID relative to the default weight of 1.
+Example:
+    jobs = FairQueue(maxsize=16, max_active_per_client=2, weights={"premium-key": 4})
+    jobs.put_nowait("192.0.2.10", job)
+    client_id, job = jobs.get()
+    ...run job...
+    jobs.task_done(client_id)
+"""
+
+import queue
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+DEFAULT_WEIGHT = 1.0
+
+
+class ClientLane:
+
+    def __init__(self):
+        # (virtual start tag, job)
+        self.jobs: Deque[Tuple[float, Any]] = deque()
+        self.last_finish = 0.0
+        self.active = 0
+
+
+class FairQueue:
+
+    def __init__(self, maxsize: int = 0, max_queued_per_client: int = 0, max_active_per_client: int = 0,
+                 weights: Optional[Dict[str, float]] = None):
+        self.maxsize = maxsize
+        self.max_queued_per_client = max_queued_per_client
+        self.max_active_per_client = max_active_per_client
+        self.weights = weights or {}
+
+        self._lanes: Dict[str, ClientLane] = {}
+        self._size = 0
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+    def put_nowait(self, client_id: str, job: Any):
+        """Queue job for client_id. Raises queue.Full when the queue or the client's lane is full."""
+        with self._lock:
+            if self.maxsize and self._size >= self.maxsize:
+                raise queue.Full
+            lane = self._lanes.setdefault(client_id, ClientLane())
+            if self.max_queued_per_client and len(lane.jobs) >= self.max_queued_per_client:
+                raise queue.Full
+
+            start = max(self._virtual_time, lane.last_finish)
+            lane.last_finish = start + 1.0 / self.weights.get(client_id, DEFAULT_WEIGHT)
+            lane.jobs.append((start, job))
+            self._size += 1
+            self._ready.notify()
+
+    def get(self) -> Tuple[str, Any]:
+        """Block until a job may run and return (client ID, job). The job counts as active until task_done()."""
+        with self._lock:
+            while True:
+                client_id = self._next_client()
+                if client_id is not None:
+                    break
+                self._ready.wait()
+
+            lane = self._lanes[client_id]
+            start, job = lane.jobs.popleft()
+            self._virtual_time = max(self._virtual_time, start)
+            lane.active += 1
+            self._size -= 1
+            return client_id, job
+
+    def task_done(self, client_id: str):
+        with self._lock:
+            lane = self._lanes.get(client_id)
+            if lane is None:
+                return
+            lane.active -= 1
+            if not lane.active and not lane.jobs:
+                # Idle clients start over at the current virtual time anyway
+                del self._lanes[client_id]
+            # A client at its active limit may have jobs that can run now
+            self._ready.notify_all()
+
+    def qsize(self) -> int:
+        with self._lock:
+            return self._size
+
+    def full(self) -> bool:
+        with self._lock:
+            return bool(self.maxsize) and self._size >= self.maxsize
+
+    def client_depth(self, client_id: str) -> Tuple[int, int]:
+        """(queued, running) jobs of client_id."""
+        with self._lock:
+            lane = self._lanes.get(client_id)
+            return (len(lane.jobs), lane.active) if lane else (0, 0)
+
+    def _next_client(self) -> Optional[str]:
+        # Caller holds the lock. The eligible lane whose head job has the smallest start tag.
+        best = None
+        best_start = None
+        for client_id, lane in self._lanes.items():
+            if not lane.jobs:
+                continue
+            if self.max_active_per_client and lane.active >= self.max_active_per_client:
+                continue
+            start = lane.jobs[0][0]
+            if best_start is None or start < best_start:
+                best, best_start = client_id, start
+        return best
@@ -1,32 +1,49 @@
 """
 FileReceiver class for receiving files over network connections.
-The FileReceiver handles the protocol for receiving file data from a TCP connection
-and persisting it to disk using a DiskWriter instance.
-The file transfer protocol is as follows:
-1. 4 bytes: Unsigned integer representing the length of the filename (network byte order)
-2. Variable bytes: UTF-8 encoded filename
-3. 8 bytes: Unsigned long long representing the file size in bytes (network byte order)
-4. Variable bytes: Raw file data
+The FileReceiver handles the payload of a request on a TCP connection and
+persists it to disk using a DiskWriter instance. Every request starts with the
+8-byte MMP header, which RequestHandler reads and parses before a FileReceiver
+is involved:
+1. 2 bytes: Unsigned short, the size of the request JSON (network byte order)
+2. 1 byte: Unsigned char, the size of the media type (e.g. "mp4")
+3. 5 bytes: Unsigned integer, the size of the payload (network byte order)
+followed by the UTF-8 JSON, the media type and the raw payload bytes.
+The payload is streamed straight into a file preallocated with open_file() by
+receive_into_file(). Without a hasher and on Linux it uses os.splice, which
+moves the bytes from the socket to the file through a pipe without copying
+them into Python. Payloads that have to be hashed, e.g. for a checksum or the
+result cache, go through recv_into and a reused buffer instead, so memory use
+per upload stays constant whatever the file size. Callers that read the
+socket themselves, such as the asyncio engine, pass the bytes they received
+to write_block(); both paths end with close_file(). receive_range() writes an
+upload chunk in place, and receive_to_pipe() feeds a streaming transcode.
 Attributes:
     disk_writer (DiskWriter): Component responsible for writing received file data to disk.
+    chunk_size (int): Size of the reused receive buffer in bytes.
+    use_splice (bool): Use the os.splice zero-copy path when the platform supports it.
+    metrics (Metrics): Optional counters of received bytes and of receive, write and fsync times.
 
 example usage:
     from .DiskWriter import DiskWriter
-    from .TCPSocketServer import Connection
     from .FileReceiver import FileReceiver
 
     disk_writer = DiskWriter('/path/to/save/files')
     file_receiver = FileReceiver(disk_writer)
-    
-    conn = Connection()  # Assume this is a valid connection object
-    success, filename, filesize = file_receiver.receive_file(conn)
+
+    # conn is the request's Connection, its header, JSON and media type already read
+    file_path, fd = file_receiver.open_file(filename, payload_size)
+    received, write_seconds = file_receiver.receive_into_file(conn, fd, payload_size)
+    saved_path = file_receiver.close_file(file_path, fd, payload_size, received, write_seconds=write_seconds)
 """
 
 import logging
 import os
+import threading
+import time
 from typing import Tuple, Optional
-from .TCPSocketServer import Connection
+from .Connection import Connection
 from .DiskWriter import DiskWriter
+from .Metrics import Metrics
 
 logging.basicConfig(
     level=logging.INFO,
@@ -34,10 +51,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger('FileReceiver')
 
+# Default pipe capacity on Linux, the most a single splice can move
+SPLICE_CHUNK_SIZE = 64 * 1024
+# Seconds a stoppable receive waits for data before it checks whether it was stopped
+STOP_CHECK_INTERVAL = 0.5
+
 class FileReceiver:
 
-    def __init__(self, disk_writer: DiskWriter):
+    def __init__(self, disk_writer: DiskWriter, chunk_size: int = 4096, use_splice: bool = True, metrics: Optional[Metrics] = None):
         self.disk_writer = disk_writer
+        self.chunk_size = chunk_size  # 4KB chunks
+        self.use_splice = use_splice
+        self.metrics = metrics
     
     def save_payload(self, filename: str, payload: bytes) -> Optional[str]:
         logger.info(f"Requesting to write payload to disk as {filename}")
@@ -49,34 +74,261 @@ class FileReceiver:
         return file_path
 
     def receive_file_with_metadata(self, conn: Connection, filename: str, file_size: int) -> Tuple[bool, str, int]:
-        try:
-            logger.info(f"Receiving file with provided metadata: {filename} of size {file_size} bytes")
+        file_path = self.receive_to_disk(conn, filename, file_size)
+        if file_path:
+            return True, filename, file_size
+        return False, filename, file_size
 
-            # Receive the file data in chunks
-            remaining = file_size
-            file_data = bytearray()  # Initialize as empty bytearray
-            chunk_size = 4096  # 4KB chunks
+    def receive_to_disk(self, conn: Connection, filename: str, file_size: int, hasher=None, client_id: Optional[str] = None, head: bytes = b'', commit: bool = True,
+                        reserved: bool = False) -> Optional[str]:
+        """
+        Stream file_size bytes from conn into a new file. hasher, if given, is updated with
+        the payload as it arrives; the splice path never sees the bytes, so it is skipped then.
+        head holds the first bytes of the payload if the caller already read them.
+        The complete file is fsynced and renamed to its final name. With commit=False it keeps
+        its temporary name, e.g. until its checksum is verified, and the caller passes it to
+        DiskWriter.commit_file() or remove_file(). reserved is passed on to DiskWriter.create_file().
+        """
+        logger.info(f"Receiving file with provided metadata: {filename} of size {file_size} bytes")
 
-            while remaining > 0:
-                current_chunk_size = min(chunk_size, remaining)
-                chunk = conn.receive(current_chunk_size)
+        created = self.open_file(filename, file_size, client_id, reserved)
+        if not created:
+            return None
+        file_path, fd = created
 
-                if not chunk:
-                    logger.error(f"Connection closed before receiving the complete file. Missing {remaining} bytes.")
-                    return False, filename, file_size
-                
-                file_data.extend(chunk) # Append the received chunk to file_data
-                remaining -= len(chunk) # Update remaining bytes to receive
+        try:
+            write_seconds = self.write_block(fd, head)
+            received, receive_write_seconds = self.receive_into_file(conn, fd, file_size - len(head), hasher)
+            received += len(head)
+            write_seconds += receive_write_seconds
+        except Exception as e:
+            logger.error(f"Error receiving file: {e}")
+            received = -1
+            write_seconds = 0.0
+        return self.close_file(file_path, fd, file_size, received, commit, write_seconds)
 
-            file_path = self.disk_writer.write_to_disk(file_data, filename)
+    def open_file(self, filename: str, file_size: int, client_id: Optional[str] = None, reserved: bool = False) -> Optional[Tuple[str, int]]:
+        """Create the file an upload is received into. Returns (file_path, fd) for close_file(), or None."""
+        created = self.disk_writer.create_file(filename, file_size, client_id, reserved)
+        if not created:
+            logger.error(f"Failed to create file {filename} on disk")
+        return created
 
-            if file_path:
-                logger.info(f"Successfully received file: {filename} and saved to {file_path}")
-                return True, filename, file_size
+    def receive_into_file(self, conn: Connection, fd: int, size: int, hasher=None) -> Tuple[int, float]:
+        """
+        Stream size bytes from conn into fd. Returns the bytes received and, with metrics
+        enabled, the seconds spent writing them.
+        """
+        started = time.monotonic()
+        if self.use_splice and hasher is None and hasattr(os, 'splice'):
+            received, write_seconds = self._splice_to_file(conn, fd, size)
+        else:
+            received, write_seconds = self._recv_into_file(conn, fd, size, hasher)
+        if self.metrics:
+            self.record_receive(started, received)
+        return received, write_seconds
+
+    def write_block(self, fd: int, data, hasher=None, offset: Optional[int] = None) -> float:
+        """
+        Write bytes the caller received itself, at offset with os.pwrite if given, after updating
+        hasher with them. Returns the seconds spent writing if metrics are enabled.
+        """
+        if hasher and data:
+            hasher.update(data)
+        started = time.monotonic() if self.metrics else 0.0
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            if offset is None:
+                written += os.write(fd, view[written:])
             else:
-                logger.error(f"Failed to write file {filename} to disk")
-                return False, filename, file_size
+                written += os.pwrite(fd, view[written:], offset + written)
+        return time.monotonic() - started if self.metrics else 0.0
 
+    def close_file(self, file_path: str, fd: int, file_size: int, received: int, commit: bool = True, write_seconds: float = 0.0) -> Optional[str]:
+        """
+        Close a file opened with open_file(). A complete file (received == file_size) is fsynced and,
+        with commit, renamed to its final name; an incomplete one is removed. Returns the path or None.
+        """
+        try:
+            if self.metrics:
+                self.metrics.disk_write_seconds.observe(write_seconds, "write")
+            if received == file_size:
+                synced = time.monotonic()
+                os.fsync(fd)
+                if self.metrics:
+                    self.metrics.disk_write_seconds.observe(time.monotonic() - synced, "fsync")
         except Exception as e:
             logger.error(f"Error receiving file: {e}")
-            return False, "", 0
\ No newline at end of file
+            received = -1
+        finally:
+            os.close(fd)
+
+        if received != file_size:
+            if received >= 0:
+                logger.error(f"Connection closed before receiving the complete file. Missing {file_size - received} bytes.")
+            self.disk_writer.remove_file(file_path)
+            return None
+
+        if commit:
+            file_path = self.disk_writer.commit_file(file_path)
+            if not file_path:
+                return None
+        logger.info(f"Successfully received file and saved it to {file_path}")
+        return file_path
+
+    def receive_range(self, conn: Connection, fd: int, offset: int, size: int, hasher=None) -> int:
+        """
+        Receive size bytes into an already open file at offset with os.pwrite, so several
+        connections can fill different ranges of the same file concurrently. hasher, if
+        given, is updated with the received bytes. Returns the number of bytes written.
+        """
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        received = 0
+        started = time.monotonic()
+
+        while received < size:
+            n = conn.receive_into(view, min(self.chunk_size, size - received))
+            if not n:
+                break
+            if hasher:
+                hasher.update(view[:n])
+            written = 0
+            while written < n:
+                written += os.pwrite(fd, view[written:n], offset + received + written)
+            received += n
+        if self.metrics:
+            self.record_receive(started, received)
+        return received
+
+    def receive_to_pipe(self, conn: Connection, pipe_fd: int, size: int, stop: Optional[threading.Event] = None) -> int:
+        """
+        Stream size bytes from conn into a pipe, e.g. the stdin of an ffmpeg process, without
+        touching the disk. If the reader closes the pipe early, the rest of the payload is read
+        and dropped so the connection stays usable for the response. Setting stop ends the
+        transfer between blocks instead and leaves the rest of the payload on the socket for
+        the caller. Returns the bytes forwarded.
+        """
+        splice = self.use_splice and hasattr(os, 'splice')
+        sock_fd = conn.fileno()
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        received = 0
+
+        try:
+            while received < size:
+                if stop and not self._wait_unless_stopped(conn, stop):
+                    break
+                if splice:
+                    # The target already is a pipe, so a single splice moves socket data straight into it
+                    n = self._splice_from(conn, sock_fd, pipe_fd, min(SPLICE_CHUNK_SIZE, size - received))
+                    if not n:
+                        break
+                    conn.record_received(n)
+                    received += n
+                else:
+                    n = conn.receive_into(view, min(self.chunk_size, size - received))
+                    if not n:
+                        break
+                    # Count the bytes as soon as they leave the socket, so a failed write discards the right amount
+                    received += n
+                    written = 0
+                    while written < n:
+                        written += os.write(pipe_fd, view[written:n])
+        except BrokenPipeError:
+            if not (stop and stop.is_set()):
+                logger.warning(f"The pipe reader exited after {received} of {size} bytes. Discarding the rest of the payload.")
+                self._discard(conn, size - received, view)
+        if self.metrics:
+            self.metrics.bytes_received.inc(received)
+        return received
+
+    @staticmethod
+    def _wait_unless_stopped(conn: Connection, stop: threading.Event) -> bool:
+        # True once conn has data to read; False as soon as stop is noticed
+        while not stop.is_set():
+            if conn.wait_readable(STOP_CHECK_INTERVAL):
+                return not stop.is_set()
+        return False
+
+    def discard(self, conn: Connection, size: int) -> bool:
+        """Read and drop size bytes, e.g. a payload the request was refused before reading. False if the connection ended first."""
+        return self._discard(conn, size, memoryview(bytearray(self.chunk_size)))
+
+    def _discard(self, conn: Connection, size: int, view: memoryview) -> bool:
+        while size > 0:
+            n = conn.receive_into(view, min(len(view), size))
+            if not n:
+                break
+            size -= n
+        return size <= 0
+
+    def record_receive(self, started: float, received: int):
+        """Record a payload received since started, also by callers that read the socket themselves."""
+        if not self.metrics:
+            return
+        self.metrics.receive_seconds.observe(time.monotonic() - started)
+        self.metrics.bytes_received.inc(received)
+
+    def _recv_into_file(self, conn: Connection, fd: int, file_size: int, hasher=None) -> Tuple[int, float]:
+        # A single buffer is reused for the whole transfer so memory stays constant.
+        # Returns the bytes received and, with metrics enabled, the seconds spent in write()
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        received = 0
+        timed = self.metrics is not None
+        write_seconds = 0.0
+
+        while received < file_size:
+            n = conn.receive_into(view, min(self.chunk_size, file_size - received))
+            if not n:
+                break
+            if hasher:
+                hasher.update(view[:n])
+            if timed:
+                write_started = time.monotonic()
+            written = 0
+            while written < n:
+                written += os.write(fd, view[written:n])
+            if timed:
+                write_seconds += time.monotonic() - write_started
+            received += n
+        return received, write_seconds
+
+    def _splice_to_file(self, conn: Connection, fd: int, file_size: int) -> Tuple[int, float]:
+        # Linux zero-copy path: socket -> pipe -> file without passing through user space
+        read_end, write_end = os.pipe()
+        sock_fd = conn.fileno()
+        received = 0
+        timed = self.metrics is not None
+        write_seconds = 0.0
+
+        try:
+            while received < file_size:
+                n = self._splice_from(conn, sock_fd, write_end, min(SPLICE_CHUNK_SIZE, file_size - received))
+                if not n:
+                    break
+                conn.record_received(n)
+                if timed:
+                    write_started = time.monotonic()
+                pending = n
+                while pending > 0:
+                    pending -= os.splice(read_end, fd, pending)
+                if timed:
+                    write_seconds += time.monotonic() - write_started
+                received += n
+        finally:
+            os.close(read_end)
+            os.close(write_end)
+        return received, write_seconds
+
+    @staticmethod
+    def _splice_from(conn: Connection, sock_fd: int, out_fd: int, size: int) -> int:
+        # Client sockets are non-blocking; wait for data the way Connection.receive_into() does
+        while True:
+            try:
+                return os.splice(sock_fd, out_fd, size)
+            except (BlockingIOError, InterruptedError):
+                if not conn.wait_readable(None):
+                    return 0
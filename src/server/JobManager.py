@@ -0,0 +1,167 @@
+"""
+JobManager keeps the table of asynchronous processing jobs.
+An asynchronous upload is handed to the ProcessingPool and answered with a job
+ID straight away, so the client can disconnect during a long transcode and
+come back later with lightweight status/fetch requests; the status of a
+running job includes its latest progress report. Finished results stay
+on disk for result_ttl seconds and can be fetched any number of times within
+that window, which lets clients recover from network drops without uploading
+again. A background thread removes expired jobs and their files.
+Attributes:
+    processing_pool (ProcessingPool): Pool that runs the VideoProcessor jobs.
+    disk_writer (DiskWriter): Optional writer that owns the uploaded inputs; removes them when jobs finish.
+    result_ttl (float): Seconds a finished job and its result are retained.
+    cleanup_interval (float): Seconds between sweeps for expired jobs.
+Example:
+    job_manager = JobManager(processing_pool, result_ttl=3600)
+    job_id = job_manager.submit("uploads/video.mp4", {"operation": "compress"})
+    job = job_manager.get(job_id)
+    print(job.to_dict())
+"""
+
+import os
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Union
+from .ProcessingPool import ProcessingPool
+from .DiskWriter import DiskWriter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('JobManager')
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class Job:
+
+    def __init__(self, job_id: str, input_path: str, options: dict, future: Future):
+        self.job_id = job_id
+        self.input_path = input_path
+        self.options = options
+        self.future = future
+        # Latest ProgressTracker report while the job runs
+        self.progress: Optional[dict] = None
+        # A list when the job produced several outputs
+        self.result_path: Union[str, List[str], None] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        if self.finished_at is not None:
+            return STATUS_DONE if self.result_path else STATUS_FAILED
+        return STATUS_RUNNING if self.future.running() else STATUS_QUEUED
+
+    def to_dict(self) -> dict:
+        info = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+        }
+        if self.finished_at is not None:
+            info["finished_at"] = self.finished_at
+        elif self.progress:
+            info["progress"] = self.progress
+        if isinstance(self.result_path, list):
+            info["outputs"] = [self._describe(path) for path in self.result_path]
+        elif self.result_path:
+            info.update(self._describe(self.result_path))
+        return info
+
+    @staticmethod
+    def _describe(path: str) -> dict:
+        return {
+            "media_type": os.path.splitext(path)[1].lstrip('.'),
+            "payload_size": os.path.getsize(path) if os.path.exists(path) else 0,
+        }
+
+
+class JobManager:
+
+    def __init__(self, processing_pool: ProcessingPool, result_ttl: float = 3600, cleanup_interval: float = 60, disk_writer: Optional[DiskWriter] = None):
+        self.processing_pool = processing_pool
+        self.disk_writer = disk_writer
+        self.result_ttl = result_ttl
+        self.cleanup_interval = cleanup_interval
+
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+        cleaner = threading.Thread(target=self._cleanup_loop, name="JobCleaner", daemon=True)
+        cleaner.start()
+
+    def submit(self, input_path: str, options: dict, media_info: Optional[dict] = None, client_id: str = "") -> Optional[str]:
+        # The job does not exist before the pool accepted it, so progress goes through a holder
+        holder = []
+        future = self.processing_pool.submit(input_path, options, media_info, lambda report: self._on_progress(holder, report),
+                                             client_id=client_id)
+        if future is None:
+            return None
+
+        job = Job(str(uuid.uuid4()), input_path, options, future)
+        holder.append(job)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        future.add_done_callback(lambda f: self._on_job_done(job, f))
+        logger.info(f"Submitted job {job.job_id} for {input_path}")
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def job_count(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    @staticmethod
+    def _on_progress(holder: list, report: dict):
+        if holder:
+            holder[0].progress = report
+
+    def _on_job_done(self, job: Job, future: Future):
+        job.result_path = future.result()
+        job.finished_at = time.time()
+        if self.disk_writer:
+            self.disk_writer.remove_file(job.input_path)
+        else:
+            self._remove_file(job.input_path)
+        if job.result_path:
+            logger.info(f"Job {job.job_id} finished: {job.result_path}")
+        else:
+            logger.error(f"Job {job.job_id} failed for {job.input_path}")
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(self.cleanup_interval)
+            self.remove_expired()
+
+    def remove_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+            for job in expired:
+                del self._jobs[job.job_id]
+
+        for job in expired:
+            for path in ([job.result_path] if isinstance(job.result_path, str) else job.result_path or []):
+                self._remove_file(path)
+            logger.info(f"Job {job.job_id} expired and was removed")
+
+    @staticmethod
+    def _remove_file(path: str):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Error deleting job file {path}: {e}")
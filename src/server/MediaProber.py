@@ -0,0 +1,175 @@
+"""
+MediaProber inspects uploads with ffprobe before they are transcoded.
+The first few MB of an upload are probed as soon as they arrive, so files that
+are not audio/video at all, or lack the stream an operation needs, are
+rejected before the rest of the upload is received. Containers whose index
+sits at the end of the file (e.g. MP4 without faststart) cannot be read from
+the head alone; those are probed again once the whole file is on disk, still
+before any transcode starts. The results (duration, codecs, resolution,
+bitrate) are kept in an LRU cache per content hash and handed to
+VideoProcessor so it does not have to probe the file again. A head alone does
+not identify the content, so a head probe serves only its own upload until the
+caller knows the digest of the whole file and hands it to remember().
+Attributes:
+    probe_bytes (int): Bytes from the start of an upload that are probed while it arrives.
+    cache_size (int): Number of probe results kept in the cache.
+    timeout (float): Seconds a single ffprobe run may take.
+Example:
+    prober = MediaProber()
+    media_info, reason = prober.probe_head(head_bytes, payload_size, {"operation": "compress"})
+    if reason:
+        print(f"Rejected: {reason}")
+    if media_info:
+        prober.remember(payload_digest, media_info)
+    media_info = media_info or prober.probe_file("uploads/video.mp4", payload_digest)
+"""
+
+import json
+import re
+import subprocess
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('MediaProber')
+
+DEFAULT_PROBE_BYTES = 4 * 1024 * 1024
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_PROBE_TIMEOUT = 10.0
+
+# ffprobe prefixes messages with the demuxer context once it recognized the container
+DEMUXER_MESSAGE = re.compile(r'^\[([\w,]+) @ 0x[0-9a-f]+\]', re.MULTILINE)
+
+# Result of a probe that could not decide, e.g. an MP4 whose index is not in the head
+INCONCLUSIVE = None
+
+
+class MediaProber:
+
+    def __init__(self, probe_bytes: int = DEFAULT_PROBE_BYTES, cache_size: int = DEFAULT_CACHE_SIZE, timeout: float = DEFAULT_PROBE_TIMEOUT):
+        self.probe_bytes = probe_bytes
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe_head(self, head: bytes, payload_size: int, options: dict) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Probe the first bytes of an upload. Returns (media info, None) when the head was enough,
+        (None, None) when the file has to be probed again once complete, and (None, reason)
+        when the upload should be rejected. The result is not cached; see remember().
+        """
+        media_info, recognized = self._run_probe(['pipe:0'], head)
+        if media_info is None:
+            if recognized:
+                return INCONCLUSIVE, None
+            return None, "the data is not a recognized audio or video format"
+        if not media_info.get("duration") and payload_size > len(head):
+            # Streams were found but the head alone does not say how long the file is
+            return INCONCLUSIVE, self.check(media_info, options)
+        return media_info, self.check(media_info, options)
+
+    def probe_file(self, file_path: str, content_digest: Optional[str] = None) -> Optional[dict]:
+        """Probe a complete file. Results are cached under content_digest when it is given."""
+        if content_digest:
+            media_info = self._get(content_digest)
+            if media_info is not None:
+                return media_info
+
+        media_info, _ = self._run_probe([file_path])
+        if media_info is not None and content_digest:
+            self._put(content_digest, media_info)
+        return media_info
+
+    def remember(self, content_digest: Optional[str], media_info: dict):
+        """Cache a head probe's result under the digest of the complete upload it came from."""
+        if content_digest:
+            self._put(content_digest, media_info)
+
+    @staticmethod
+    def check(media_info: dict, options: dict) -> Optional[str]:
+        """Reason the input cannot serve the requested operation, or None if it can."""
+        if not media_info.get("video_codec") and not media_info.get("audio_codec"):
+            return "the file contains no audio or video streams"
+
+        operations = [options] + [step for step in options.get("operations") or options.get("outputs") or [] if isinstance(step, dict)]
+        needs_video = any(step.get("operation") not in (None, "convert_to_audio") for step in operations)
+        needs_audio = any(step.get("operation") == "convert_to_audio" for step in operations)
+        if needs_video and not media_info.get("video_codec"):
+            return "the file has no video stream"
+        if needs_audio and not media_info.get("audio_codec"):
+            return "the file has no audio stream"
+        return None
+
+    def _run_probe(self, source: list, data: Optional[bytes] = None) -> Tuple[Optional[dict], bool]:
+        # Returns (media info, whether ffprobe recognized the container)
+        command = [
+            'ffprobe',
+            '-v', 'error',
+            '-show_format',
+            '-show_streams',
+            '-of', 'json',
+            '-i', *source
+        ]
+        try:
+            result = subprocess.run(command, input=data, capture_output=True, timeout=self.timeout)
+        except FileNotFoundError:
+            logger.error("FFPROBE command not found. Please ensure FFMPEG is installed and in your PATH.")
+            return None, True
+        except subprocess.TimeoutExpired:
+            logger.warning(f"FFPROBE timed out after {self.timeout}s")
+            return None, True
+
+        stderr = result.stderr.decode('utf-8', errors='replace')
+        if result.returncode != 0:
+            logger.info(f"FFPROBE could not read the input: {stderr.strip()}")
+            return None, bool(DEMUXER_MESSAGE.search(stderr))
+
+        try:
+            return self._parse(json.loads(result.stdout)), True
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Could not parse FFPROBE output: {e}")
+            return None, True
+
+    @staticmethod
+    def _parse(probe: dict) -> dict:
+        media_info = {
+            "format_name": probe.get("format", {}).get("format_name"),
+            "duration": float(probe.get("format", {}).get("duration") or 0) or None,
+            "bit_rate": int(probe.get("format", {}).get("bit_rate") or 0) or None,
+            "video_codec": None,
+            "audio_codec": None,
+            "width": None,
+            "height": None,
+        }
+        for stream in probe.get("streams", []):
+            if stream.get("disposition", {}).get("attached_pic"):
+                # Cover art of an audio file is not a video stream
+                continue
+            if stream.get("codec_type") == "video" and not media_info["video_codec"]:
+                media_info["video_codec"] = stream.get("codec_name")
+                media_info["width"] = stream.get("width")
+                media_info["height"] = stream.get("height")
+            elif stream.get("codec_type") == "audio" and not media_info["audio_codec"]:
+                media_info["audio_codec"] = stream.get("codec_name")
+        return media_info
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            media_info = self._cache.get(key)
+            if media_info is not None:
+                self._cache.move_to_end(key)
+            return media_info
+
+    def _put(self, key: str, media_info: dict):
+        with self._lock:
+            self._cache[key] = media_info
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
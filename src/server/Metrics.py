@@ -0,0 +1,193 @@
+"""
+Metrics keeps the server's per-stage counters, gauges and histograms in memory.
+Every stage of a request reports how long it took and how many bytes it moved:
+receiving the payload, the capacity check, writing and syncing it to disk, each
+ffmpeg run (wall clock and CPU time of the process) and sending the result.
+Gauges such as the processing queue depth and the open connections are read
+from their owners when the metrics are collected, so they cost nothing in
+between. Recording a value is a dictionary lookup and an addition under a lock,
+cheap enough to do a few times per request; nothing is recorded per block.
+The metrics are published in the Prometheus text format by MetricsServer and
+as JSON through the "stats" request of the protocol.
+Attributes:
+    buckets (tuple): Upper bounds in seconds of the buckets of every duration histogram.
+Example:
+    metrics = Metrics()
+    metrics.bytes_received.inc(len(payload))
+    metrics.ffmpeg_wall_seconds.observe(12.5, "compress video")
+    metrics.processing_queue_depth.set_function(processing_pool.queue_depth)
+    text = metrics.render()
+    stats = metrics.snapshot()
+"""
+
+import abc
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Spans the capacity check (sub-millisecond) up to long encodes (tens of minutes)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0)
+
+# Media type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric(abc.ABC):
+    """A named family of samples, one per combination of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[dict, object]]:
+        """(labels, value) of every sample in the family."""
+
+    def _labels(self, values: tuple) -> dict:
+        return dict(zip(self.labelnames, values))
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[Tuple[dict, float]]:
+        with self._lock:
+            return [(self._labels(labels), value) for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A value read from a callable when the metrics are collected, e.g. a queue's current depth."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def samples(self) -> List[Tuple[dict, float]]:
+        return [({}, self._function())] if self._function else []
+
+
+class Histogram(Metric):
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> List[Tuple[dict, dict]]:
+        """Per label set: count, sum and cumulative bucket counts keyed by their upper bound."""
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        samples = []
+        for labels, counts, total in values:
+            cumulative, running = {}, 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                running += count
+                cumulative[bound] = running
+            samples.append((self._labels(labels), {"count": running, "sum": total, "buckets": cumulative}))
+        return samples
+
+
+class Metrics:
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+
+        self.requests = Counter("mmp_requests_total", "Requests read, by request type.", ("request_type",))
+        self.errors = Counter("mmp_errors_total", "Error responses sent, by error code.", ("code",))
+        self.request_seconds = self._histogram("mmp_request_seconds", "Time from reading a request to its last response, by request type.", ("request_type",))
+        self.bytes_received = Counter("mmp_received_bytes_total", "Payload bytes received from clients.")
+        self.receive_seconds = self._histogram("mmp_receive_seconds", "Time spent receiving one payload or chunk.")
+        self.capacity_check_seconds = self._histogram("mmp_capacity_check_seconds", "Time spent reserving storage and quota for a request.")
+        self.disk_write_seconds = self._histogram("mmp_disk_write_seconds", "Time spent writing files to disk, by stage (write, fsync, commit).", ("stage",))
+        self.ffmpeg_wall_seconds = self._histogram("mmp_ffmpeg_wall_seconds", "Wall clock time of ffmpeg runs, by action.", ("action",))
+        self.ffmpeg_cpu_seconds = self._histogram("mmp_ffmpeg_cpu_seconds", "User and system CPU time of ffmpeg runs, by action.", ("action",))
+        self.ffmpeg_failures = Counter("mmp_ffmpeg_failures_total", "ffmpeg runs that exited with an error, by action.", ("action",))
+        self.bytes_sent = Counter("mmp_sent_bytes_total", "Result payload bytes sent to clients.")
+        self.send_seconds = self._histogram("mmp_send_seconds", "Time spent sending one result response.")
+        self.processing_queue_depth = Gauge("mmp_processing_queue_depth", "Jobs waiting for a processing slot.")
+        self.processing_active_jobs = Gauge("mmp_processing_active_jobs", "Jobs running on a processing slot.")
+        self.active_connections = Gauge("mmp_active_connections", "Open client connections.")
+
+        self._metrics: List[Metric] = [value for value in vars(self).values() if isinstance(value, Metric)]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            samples = metric.samples()
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for labels, value in samples:
+                if isinstance(metric, Histogram):
+                    for bound, count in value["buckets"].items():
+                        lines.append(f"{metric.name}_bucket{self._format_labels({**labels, 'le': self._format_value(bound)})} {count}")
+                    lines.append(f"{metric.name}_sum{self._format_labels(labels)} {self._format_value(value['sum'])}")
+                    lines.append(f"{metric.name}_count{self._format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{metric.name}{self._format_labels(labels)} {self._format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """All metrics as a JSON-serializable dict, keyed by metric name."""
+        snapshot = {}
+        for metric in self._metrics:
+            samples = []
+            for labels, value in metric.samples():
+                if isinstance(metric, Histogram):
+                    value = {**value, "buckets": {self._format_value(bound): count for bound, count in value["buckets"].items()}}
+                    samples.append({"labels": labels, **value})
+                else:
+                    samples.append({"labels": labels, "value": value})
+            snapshot[metric.name] = {"type": metric.type, "help": metric.help, "samples": samples}
+        return snapshot
+
+    def _histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Histogram:
+        return Histogram(name, help, labelnames, self.buckets)
+
+    @staticmethod
+    def _format_labels(labels: dict) -> str:
+        if not labels:
+            return ""
+        pairs = ",".join(f'{name}="{Metrics._escape(str(value))}"' for name, value in labels.items())
+        return "{" + pairs + "}"
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        if value == math.inf:
+            return "+Inf"
+        return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,76 @@
+"""
+MetricsServer publishes Metrics over HTTP for a Prometheus scraper.
+GET /metrics answers with every metric in the Prometheus text format; any
+other path is 404. The server runs on a daemon thread next to the video
+service and binds to the loopback interface by default, so the figures are
+only visible from the host itself (or through whatever the operator puts in
+front of it).
+Attributes:
+    metrics (Metrics): The metrics to publish.
+    host (str): Address to bind to.
+    port (int): Port to listen on; 0 picks a free port, which start() then stores here.
+Example:
+    metrics_server = MetricsServer(metrics, host="127.0.0.1", port=19100)
+    metrics_server.start()
+    ...
+    metrics_server.stop()
+"""
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from .Metrics import Metrics, CONTENT_TYPE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('MetricsServer')
+
+METRICS_PATH = "/metrics"
+
+
+class MetricsServer:
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> bool:
+        metrics = self.metrics
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would drown the service's own log
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        except OSError as e:
+            logger.error(f"Failed to start the metrics endpoint on {self.host}:{self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}{METRICS_PATH}")
+        return True
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
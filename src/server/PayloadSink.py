@@ -0,0 +1,55 @@
+"""
+PayloadSink is the receiving end of a request payload.
+RequestHandler.begin_request() checks an upload or an upload chunk, reserves
+its space and returns a sink; whoever reads the socket then feeds the payload
+to it and calls finish(), which answers the request. AsyncTCPSocketServer
+receives the payload on its event loop and runs only write() and finish() in
+its executor, so a slow client holds no thread while its bytes trickle in.
+The thread-per-connection engine hands the socket to receive() instead, which
+keeps the zero-copy splice path for the bulk of the payload.
+The first write() always carries exactly head_size bytes, even when that is
+none: an upload's head is probed before the rest of it is accepted. Any later
+write() may carry any number of bytes. A write() that returns False means the
+request failed or was answered; the rest of the payload is not wanted, and
+finish() still has to be called to clean up.
+Attributes:
+    request_type (str): The request type the payload belongs to.
+    size (int): Payload bytes the request announced.
+    head_size (int): Bytes the first write() carries.
+    started (float): time.monotonic() when the request was read, for the request metrics.
+Example:
+    sink = handler.begin_request(conn, options, media_type, payload_size)
+    if isinstance(sink, PayloadSink):
+        if sink.write(conn.receive_all(sink.head_size)):
+            sink.receive(conn, sink.size - sink.head_size)
+        handler.finish_payload(conn, sink)
+"""
+
+import time
+from typing import Callable
+from .Connection import Connection
+
+
+class PayloadSink:
+
+    def __init__(self, request_type: str, size: int, head_size: int, write: Callable[[memoryview], bool],
+                 receive: Callable[[Connection, int], int], finish: Callable[[], bool]):
+        self.request_type = request_type
+        self.size = size
+        self.head_size = head_size
+        self.started = time.monotonic()
+        self._write = write
+        self._receive = receive
+        self._finish = finish
+
+    def write(self, data: memoryview) -> bool:
+        """Store the next bytes of the payload. False if the rest of the payload is not wanted."""
+        return self._write(data)
+
+    def receive(self, conn: Connection, size: int) -> int:
+        """Read size bytes of the payload from conn and store them. Returns the bytes stored."""
+        return self._receive(conn, size)
+
+    def finish(self) -> bool:
+        """Close the payload and answer the request. Returns the request's result."""
+        return self._finish()
@@ -0,0 +1,39 @@
+"""
+PendingStep is a request that has to wait for something before it can go on.
+RequestHandler steps (serve_request() and finish_payload()) return one instead
+of blocking on the work another thread is doing for them, such as the encode
+on a ProcessingPool worker or the identical request the ResultCache merged them
+with. The engine waits for future however suits it and then passes the step to
+RequestHandler.resume(), which runs the rest of the request and returns its
+result, or the next PendingStep. The thread-per-connection engine simply blocks
+its thread; AsyncTCPSocketServer awaits the future on its event loop, so a
+waiting request holds none of its executor threads.
+A step is resumed exactly once, also when future failed or the client has gone,
+because resuming is what releases the request's files and reservations.
+Attributes:
+    future (concurrent.futures.Future): Done once the request can go on.
+    request_type (str): The request type the step belongs to.
+    started (float): time.monotonic() when the request was read, for the request metrics.
+Example:
+    result = handler.finish_payload(conn, sink)
+    while isinstance(result, PendingStep):
+        concurrent.futures.wait([result.future])
+        result = handler.resume(conn, result)
+"""
+
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+
+class PendingStep:
+
+    def __init__(self, future: Future, resume: Callable[[Future], object], request_type: str = ""):
+        self.future = future
+        self.request_type = request_type
+        self.started = time.monotonic()
+        self._resume = resume
+
+    def resume(self) -> object:
+        """Run the rest of the request once future is done. Returns its result or the next PendingStep."""
+        return self._resume(self.future)
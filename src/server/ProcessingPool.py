@@ -0,0 +1,123 @@
+"""
+ProcessingPool runs VideoProcessor jobs on a fixed number of worker slots.
+Every slot drives one ffmpeg process at a time, so the number of concurrent
+encodes is bounded by max_workers no matter how many clients are connected.
+Jobs wait in a bounded FairQueue in front of the slots, so clients take turns
+for free slots instead of queuing behind whoever submitted the most, and no
+client holds more than max_active_per_client slots at once. When the queue (or
+the client's share of it) is full, submit() refuses the job so the caller can
+tell the client to retry later instead of oversubscribing the CPU. Besides file jobs, any callable that drives
+ffmpeg itself (such as a streaming transcode) can take a slot with submit_task().
+Attributes:
+    video_processor (VideoProcessor): Processor whose process() runs the jobs.
+    max_workers (int): Number of worker slots (concurrent ffmpeg processes).
+    max_queue_size (int): Number of jobs allowed to wait for a free slot.
+    max_queued_per_client (int): Jobs one client may have waiting (0 = unlimited).
+    max_active_per_client (int): Slots one client may use at once (0 = unlimited).
+    client_weights (dict): Relative share of the slots per client ID (default 1).
+Example:
+    pool = ProcessingPool(VideoProcessor("processed"), max_workers=4, max_queue_size=16, max_active_per_client=2)
+    future = pool.submit("uploads/video.mp4", {"operation": "compress"}, client_id="192.0.2.10")
+    if future is None:
+        print(f"Busy, retry after {pool.retry_after()} s")
+    else:
+        processed_path = future.result()
+"""
+
+import math
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+from .VideoProcessor import VideoProcessor
+from .FairQueue import FairQueue
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('ProcessingPool')
+
+# Initial guess of a job's duration, used until real jobs have been measured
+DEFAULT_JOB_SECONDS = 30.0
+# Weight of the newest measurement in the moving average of job durations
+JOB_TIME_SMOOTHING = 0.2
+
+
+class ProcessingPool:
+
+    def __init__(self, video_processor: VideoProcessor, max_workers: Optional[int] = None, max_queue_size: int = 16,
+                 max_queued_per_client: int = 0, max_active_per_client: int = 0, client_weights: Optional[Dict[str, float]] = None):
+        self.video_processor = video_processor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue_size = max_queue_size
+
+        self._queue = FairQueue(max_queue_size, max_queued_per_client, max_active_per_client, client_weights)
+        self._lock = threading.Lock()
+        self._active_jobs = 0
+        self._average_job_seconds = DEFAULT_JOB_SECONDS
+
+        self._workers = []
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"ProcessingWorker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Processing pool started with {self.max_workers} workers and a queue of {max_queue_size}")
+
+    def submit(self, input_path: str, options: dict, media_info: Optional[dict] = None,
+               progress: Optional[Callable[[dict], None]] = None, client_id: str = "") -> Optional[Future]:
+        return self.submit_task(input_path, self.video_processor.process, input_path, options, media_info, progress, client_id=client_id)
+
+    def submit_task(self, label: str, fn: Callable, *args, client_id: str = "") -> Optional[Future]:
+        """Run fn(*args) on a worker slot, scheduled fairly among client_id's peers. label names the job in log messages."""
+        future = Future()
+        try:
+            self._queue.put_nowait(client_id, (future, label, fn, args))
+        except queue.Full:
+            queued, _ = self._queue.client_depth(client_id)
+            logger.warning(f"Processing queue is full ({self.queue_depth()} jobs waiting, {queued} of them from {client_id or 'this client'}). Rejecting {label}")
+            return None
+        logger.info(f"Queued {label} for processing. Queue depth: {self.queue_depth()}")
+        return future
+
+    def is_full(self) -> bool:
+        return self._queue.full()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def active_jobs(self) -> int:
+        with self._lock:
+            return self._active_jobs
+
+    def retry_after(self) -> int:
+        # Time until the jobs ahead of a new request would have drained through the slots
+        with self._lock:
+            average = self._average_job_seconds
+        waiting = self.queue_depth() + 1
+        return max(1, math.ceil(waiting * average / self.max_workers))
+
+    def _worker_loop(self):
+        while True:
+            client_id, (future, label, fn, args) = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                self._queue.task_done(client_id)
+                continue
+
+            with self._lock:
+                self._active_jobs += 1
+            started = time.monotonic()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                logger.error(f"Processing job for {label} failed: {e}")
+                future.set_result(None)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._active_jobs -= 1
+                    self._average_job_seconds += JOB_TIME_SMOOTHING * (elapsed - self._average_job_seconds)
+                self._queue.task_done(client_id)
@@ -0,0 +1,70 @@
+"""
+ProgressSender sends the progress reports of one job to its client from a thread of its own.
+The processing worker hands every report to report(), which only replaces the latest
+report and returns, so a client that stops reading can never stall the encode, the
+worker's slot or ffmpeg's progress pipe. Reports the thread has not sent yet are
+superseded by newer ones, and a report is dropped instead of sent while the socket
+is not writable. Once a send fails or times out the sender gives up on the client.
+close() stops the thread, so no progress frame can follow the job's result.
+Attributes:
+    conn (Connection): Connection the progress frames are written to; only used to check that it is writable.
+    send (Callable[[dict], bool]): Sends one report as a complete frame; False if the client could not take it.
+Example:
+    sender = ProgressSender(conn, lambda report: handler._send_json_response(conn, {"progress": report}))
+    video_processor.process(path, options, media_info, sender.report)
+    sender.close()
+    ...send the result...
+"""
+
+import threading
+import logging
+from typing import Callable, Optional
+from .Connection import Connection
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('ProgressSender')
+
+
+class ProgressSender:
+
+    def __init__(self, conn: Connection, send: Callable[[dict], bool]):
+        self.conn = conn
+        self.send = send
+
+        self._latest: Optional[dict] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def report(self, report: dict):
+        """Called on the processing worker; never blocks on the client."""
+        with self._condition:
+            self._latest = report
+            self._condition.notify()
+
+    def close(self):
+        """Stop sending; reports that have not gone out yet are dropped."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._latest is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                report, self._latest = self._latest, None
+
+            if not self.conn.wait_writable(0):
+                # The client has not read the previous frames yet; a later report replaces this one
+                continue
+            if not self.send(report):
+                logger.warning(f"Could not send progress to {self.conn.address}; no more progress is sent")
+                return
@@ -0,0 +1,106 @@
+"""
+ProgressTracker turns the "-progress" output of ffmpeg into progress reports.
+ffmpeg writes a block of key=value lines (frame, fps, out_time_us, speed, ...)
+ending with a "progress=continue" or "progress=end" line about twice a second.
+A job may run several ffmpeg processes for one output, one after another
+(clip pieces) or side by side (compress segments); each reports through its
+own part, and the tracker adds up the media time every part has covered.
+Reports carry the percentage done, encoded fps, speed relative to real time
+and the estimated seconds left, and are passed to the callback at most once
+per interval.
+Attributes:
+    callback (Callable[[dict], None]): Receives every progress report.
+    duration (float): Seconds of media the job produces, if known. Without it percent and eta are None.
+    interval (float): Smallest number of seconds between two reports.
+Example:
+    tracker = ProgressTracker(print, duration=120.0)
+    report = tracker.part(0)
+    report({"out_time_us": "30000000", "fps": "48.0", "progress": "continue"})
+    # {'percent': 25.0, 'out_time': 30.0, 'fps': 48.0, 'speed': ..., 'eta': ...}
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+DEFAULT_PROGRESS_INTERVAL = 1.0
+
+
+class ProgressTracker:
+
+    def __init__(self, callback: Callable[[dict], None], duration: Optional[float] = None, interval: float = DEFAULT_PROGRESS_INTERVAL):
+        self.callback = callback
+        self.duration = duration
+        self.interval = interval
+
+        # part -> (seconds of media covered, current fps)
+        self._parts: Dict[int, tuple] = {}
+        self._started = time.monotonic()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def part(self, index: int = 0) -> Callable[[dict], None]:
+        """Callback for the progress blocks of one ffmpeg process."""
+        return lambda block: self._update(index, block)
+
+    def reset(self):
+        """Forget all parts, e.g. when a job falls back to another strategy."""
+        with self._lock:
+            self._parts.clear()
+            self._started = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return self._report()
+
+    def _update(self, index: int, block: dict):
+        finished = block.get("progress") == "end"
+        with self._lock:
+            covered = self._parse_seconds(block)
+            if covered is None:
+                covered = self._parts.get(index, (0.0, 0.0))[0]
+            # A finished process no longer adds to the frame rate
+            self._parts[index] = (covered, 0.0 if finished else self._parse_float(block.get("fps")) or 0.0)
+
+            now = time.monotonic()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            report = self._report()
+        self.callback(report)
+
+    def _report(self) -> dict:
+        # Caller holds the lock
+        covered = sum(seconds for seconds, _ in self._parts.values())
+        elapsed = time.monotonic() - self._started
+        speed = covered / elapsed if elapsed > 0 and covered > 0 else None
+
+        percent = eta = None
+        if self.duration:
+            covered = min(covered, self.duration)
+            percent = round(100.0 * covered / self.duration, 1)
+            if speed:
+                eta = round((self.duration - covered) / speed, 1)
+        return {
+            "percent": percent,
+            "out_time": round(covered, 2),
+            "fps": round(sum(fps for _, fps in self._parts.values()), 1),
+            "speed": round(speed, 2) if speed else None,
+            "eta": eta,
+        }
+
+    @staticmethod
+    def _parse_seconds(block: dict) -> Optional[float]:
+        # out_time_ms is in microseconds as well, despite its name; both are "N/A" before the first frame
+        for key in ("out_time_us", "out_time_ms"):
+            value = ProgressTracker._parse_float(block.get(key))
+            if value is not None and value >= 0:
+                return value / 1_000_000
+        return None
+
+    @staticmethod
+    def _parse_float(value: Optional[str]) -> Optional[float]:
+        try:
+            return float(value.rstrip('x')) if value else None
+        except ValueError:
+            return None
@@ -0,0 +1,151 @@
+"""
+QuotaManager enforces per-client storage and bandwidth quotas.
+A client is identified by its API key when it sends one ("api_key" option)
+and by its IP address otherwise. For every client the manager keeps O(1)
+counters of stored bytes, bytes reserved by uploads in flight, concurrent
+reservations, and bytes transferred in the current quota window. Uploads
+reserve against these limits at the same point as the global capacity check;
+DiskWriter keeps the stored-bytes counter current as files are written and
+cleaned up. Usage figures can be queried per client for billing and throttling.
+Attributes:
+    max_storage_bytes (int): Bytes a client may have stored at once (0 = unlimited).
+    max_concurrent_reservations (int): Uploads a client may have in flight (0 = unlimited).
+    max_transfer_bytes (int): Bytes a client may upload and download per window (0 = unlimited).
+    window_seconds (float): Length of the bandwidth quota window.
+    overrides (dict): Per-client limits that replace the defaults, keyed by client ID.
+Example:
+    quota_manager = QuotaManager(max_storage_bytes=50 * 1024 ** 3, max_concurrent_reservations=4,
+                                 overrides={"premium-key": {"max_storage_bytes": 0}})
+    if quota_manager.reserve("192.0.2.10", file_size) is None:
+        quota_manager.commit("192.0.2.10", file_size)   # the file is being written
+        ...
+        quota_manager.release("192.0.2.10", 0)          # the upload is over
+    print(quota_manager.get_usage("192.0.2.10"))
+"""
+
+import threading
+import time
+import logging
+from typing import Dict, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('QuotaManager')
+
+
+class ClientUsage:
+
+    def __init__(self):
+        self.stored_bytes = 0
+        self.reserved_bytes = 0
+        self.active_reservations = 0
+        self.window_start = time.monotonic()
+        self.window_transfer_bytes = 0
+        self.total_received_bytes = 0
+        self.total_sent_bytes = 0
+
+
+class QuotaManager:
+
+    def __init__(self, max_storage_bytes: int = 0, max_concurrent_reservations: int = 0, max_transfer_bytes: int = 0,
+                 window_seconds: float = 24 * 3600, overrides: Optional[Dict[str, dict]] = None):
+        self.max_storage_bytes = max_storage_bytes
+        self.max_concurrent_reservations = max_concurrent_reservations
+        self.max_transfer_bytes = max_transfer_bytes
+        self.window_seconds = window_seconds
+        self.overrides = overrides or {}
+
+        self._usage: Dict[str, ClientUsage] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, client_id: str, file_size: int) -> Optional[str]:
+        """Reserve file_size bytes for client_id. Returns None on success, or the reason it was refused."""
+        with self._lock:
+            usage = self._get_usage(client_id)
+            max_storage = self._limit(client_id, "max_storage_bytes")
+            max_reservations = self._limit(client_id, "max_concurrent_reservations")
+            max_transfer = self._limit(client_id, "max_transfer_bytes")
+
+            if max_reservations and usage.active_reservations >= max_reservations:
+                reason = f"at most {max_reservations} uploads may be in progress at once"
+            elif max_storage and usage.stored_bytes + usage.reserved_bytes + file_size > max_storage:
+                reason = f"storage quota of {max_storage} bytes would be exceeded"
+            elif max_transfer and usage.window_transfer_bytes + file_size > max_transfer:
+                reason = f"transfer quota of {max_transfer} bytes per {int(self.window_seconds)}s would be exceeded"
+            else:
+                usage.reserved_bytes += file_size
+                usage.active_reservations += 1
+                return None
+
+        logger.warning(f"Quota exceeded for client {client_id}: {reason}")
+        return reason
+
+    def release(self, client_id: str, file_size: int):
+        with self._lock:
+            usage = self._get_usage(client_id)
+            usage.reserved_bytes = max(0, usage.reserved_bytes - file_size)
+            usage.active_reservations = max(0, usage.active_reservations - 1)
+
+    def commit(self, client_id: str, file_size: int):
+        """
+        Move file_size reserved bytes into the client's stored bytes once its file is created.
+        The upload still counts as in progress until release(client_id, 0).
+        """
+        with self._lock:
+            usage = self._get_usage(client_id)
+            usage.reserved_bytes = max(0, usage.reserved_bytes - file_size)
+            usage.stored_bytes += file_size
+
+    def record_write(self, client_id: str, size: int):
+        with self._lock:
+            self._get_usage(client_id).stored_bytes += size
+
+    def record_delete(self, client_id: str, size: int):
+        with self._lock:
+            usage = self._get_usage(client_id)
+            usage.stored_bytes = max(0, usage.stored_bytes - size)
+
+    def record_transfer(self, client_id: str, received: int = 0, sent: int = 0):
+        with self._lock:
+            usage = self._get_usage(client_id)
+            usage.window_transfer_bytes += received + sent
+            usage.total_received_bytes += received
+            usage.total_sent_bytes += sent
+
+    def get_usage(self, client_id: str) -> dict:
+        with self._lock:
+            return self._to_dict(client_id, self._get_usage(client_id))
+
+    def all_usage(self) -> Dict[str, dict]:
+        with self._lock:
+            return {client_id: self._to_dict(client_id, usage) for client_id, usage in self._usage.items()}
+
+    def _get_usage(self, client_id: str) -> ClientUsage:
+        # Caller holds the lock
+        usage = self._usage.get(client_id)
+        if usage is None:
+            usage = self._usage[client_id] = ClientUsage()
+        now = time.monotonic()
+        if now - usage.window_start >= self.window_seconds:
+            usage.window_start = now
+            usage.window_transfer_bytes = 0
+        return usage
+
+    def _limit(self, client_id: str, name: str) -> int:
+        return self.overrides.get(client_id, {}).get(name, getattr(self, name))
+
+    def _to_dict(self, client_id: str, usage: ClientUsage) -> dict:
+        return {
+            "client_id": client_id,
+            "stored_bytes": usage.stored_bytes,
+            "reserved_bytes": usage.reserved_bytes,
+            "active_reservations": usage.active_reservations,
+            "window_transfer_bytes": usage.window_transfer_bytes,
+            "total_received_bytes": usage.total_received_bytes,
+            "total_sent_bytes": usage.total_sent_bytes,
+            "max_storage_bytes": self._limit(client_id, "max_storage_bytes"),
+            "max_concurrent_reservations": self._limit(client_id, "max_concurrent_reservations"),
+            "max_transfer_bytes": self._limit(client_id, "max_transfer_bytes"),
+        }
@@ -0,0 +1,58 @@
+"""
+RateLimiter keeps one token bucket per key (client IP or API key).
+Each bucket holds up to burst tokens and refills at rate tokens per second; an
+action is allowed when a token is available and otherwise refused with the
+number of seconds until the next token arrives, which is what the client is
+told to wait. Buckets that have refilled completely carry no state worth
+keeping, so they are dropped periodically and memory stays proportional to
+the number of recently active clients.
+Attributes:
+    rate (float): Tokens added per second.
+    burst (int): Bucket capacity, i.e. the actions allowed back to back.
+Example:
+    limiter = RateLimiter(rate=2.0, burst=10)
+    wait = limiter.acquire("192.0.2.10")
+    if wait:
+        print(f"Rate limited, retry after {wait:.1f}s")
+"""
+
+import threading
+import time
+from typing import Dict, List
+
+# Number of buckets at which full (idle) buckets are swept
+PRUNE_THRESHOLD = 1024
+
+
+class RateLimiter:
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+        # key -> [tokens, time of the last refill]
+        self._buckets: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """Take a token for key. Returns 0 if allowed, otherwise the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= PRUNE_THRESHOLD:
+                    self._prune(now)
+                bucket = self._buckets[key] = [float(self.burst), now]
+
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now: float):
+        # Caller holds the lock
+        for key in [key for key, (tokens, last) in self._buckets.items() if tokens + (now - last) * self.rate >= self.burst]:
+            del self._buckets[key]
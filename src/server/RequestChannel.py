@@ -0,0 +1,53 @@
+"""
+RequestChannel is the view of one request on a persistent connection.
+Requests that carry a "request_id" may be pipelined over one TCP connection and
+are served concurrently, each on its own channel. A channel reads and writes
+the shared socket like the Connection it wraps, shares its send lock so the
+responses of different requests never interleave within a message, and carries
+the request ID that RequestHandler echoes in every response. Closing a channel
+does not close the socket; it only tells the reading side that the request
+no longer needs it.
+Attributes:
+    connection (Connection): The persistent connection the request arrived on.
+    request_id: ID chosen by the client for this request.
+    payload_end (int): Byte count of the connection at which this request's payload ends.
+    on_release (Callable): Called when the channel is released, e.g. to wake an event loop.
+Example:
+    channel = RequestChannel(conn, options["request_id"], conn.bytes_received + payload_size)
+    threading.Thread(target=serve, args=(channel,)).start()
+    channel.released.wait()
+    ...read the next request from conn...
+"""
+
+import threading
+from typing import Callable, Optional
+from .Connection import Connection
+
+
+class RequestChannel(Connection):
+
+    def __init__(self, connection: Connection, request_id, payload_end: int, on_release: Optional[Callable[[], None]] = None):
+        super().__init__(connection.socket, connection.address)
+        self.connection = connection
+        self.request_id = request_id
+        self.payload_end = payload_end
+        self.send_lock = connection.send_lock
+        self.on_release = on_release
+        # Set once the request has read its payload (or will never read it)
+        self.released = threading.Event()
+
+    def record_received(self, size: int):
+        self.connection.record_received(size)
+
+    def unread_payload(self) -> int:
+        return max(0, self.payload_end - self.connection.bytes_received)
+
+    def release(self):
+        # May run more than once; on_release has to cope with that
+        self.released.set()
+        if self.on_release:
+            self.on_release()
+
+    def close(self):
+        # The socket belongs to the persistent connection
+        self.release()
@@ -2,35 +2,99 @@
 RequestHandler class for handling client connections to the video compression service.
 This class manages the protocol for file upload requests, validates storage capacity,
 receives file data, and communicates status responses back to clients.
-The handler implements a simple protocol where:
-1. Client sends a 4-byte length of the filename
-2. Client sends the filename as UTF-8 encoded string
-3. Client sends an 8-byte file size
-4. Client sends the file data if space is available
-5. Server responds with status code
+Every request and response is an MMP message:
+1. 8-byte header: 2-byte JSON size, 1-byte media type size, 5-byte payload size
+2. JSON options (UTF-8)
+3. Media type (UTF-8, e.g. "mp4")
+4. Payload bytes
+The "request_type" option selects what the request does:
+- "upload" (default): the payload is a video to process; the response carries the result
+- "job_status" / "job_fetch": query or download an asynchronous job ("mode": "async")
+- "upload_open" / "upload_chunk" / "upload_status" / "upload_commit": chunked,
+  resumable uploads whose chunks may arrive over several parallel connections
+- "usage": the caller's quota usage (clients are identified by "api_key" or IP)
+- "stats": the server's per-stage metrics as JSON (see Metrics)
+An upload with an "outputs" list is answered with several results in one reply:
+the media type is "multi", the JSON lists every output's media_type and
+payload_size, and the payload is the outputs concatenated in that order.
+An upload with "progress": true is sent progress frames while it is processed:
+JSON-only responses {"progress": {"percent", "out_time", "fps", "speed", "eta"}}
+ahead of the final response; nothing else is in their JSON. Frames a client is too slow
+to read are dropped rather than queued. The status of a running async job carries the same report.
+An upload with "stream": true is transcoded while it arrives. The first response
+carries the output media type and no payload, each following response with an
+empty JSON carries the next chunk of output, and a final JSON response with
+"stream_end" (or an error) closes the stream.
+A request with a "request_id" keeps the connection open for further requests.
+Such requests may be pipelined; each is served as soon as it has been read and
+every response to it (progress frames and stream chunks included) carries the
+same "request_id", so responses can arrive in any order. Closing the
+connection ends the session.
+An upload may carry "checksum" (hex digest of the file) and "checksum_algorithm"
+(blake2b by default). The digest is computed while the payload arrives and the
+file is only committed under its final name if it matches; otherwise the upload
+is refused with CHECKSUM_MISMATCH. Every file response to a request that names a
+"checksum_algorithm" carries the digest of its payload in that algorithm, in
+"checksum" (or per output in "outputs" of a "multi" response).
+Errors are reported as a JSON body {"error": {"code", "description", "solution"}} with no payload.
 Attributes:
     file_receiver (FileReceiver): Component that handles receiving and storing files
     storage_checker (StorageChecker): Component that checks if there's enough storage space
     status_responder (StatusResponder): Component that sends status responses to clients
+    video_processor (VideoProcessor): Component that runs the ffmpeg operations
+    processing_pool (ProcessingPool): Optional bounded pool the processing jobs run on
+    job_manager (JobManager): Optional table of asynchronous jobs
+    upload_session_manager (UploadSessionManager): Optional tracker of resumable uploads
+    result_cache (ResultCache): Optional content-addressed cache of processed outputs
+    quota_manager (QuotaManager): Optional per-client storage and bandwidth quotas
+    streaming_transcoder (StreamingTranscoder): Optional pipeline for "stream" uploads
+    media_prober (MediaProber): Optional ffprobe stage that rejects unusable inputs early
+    rate_limiter (RateLimiter): Optional token bucket per client on requests that start new work
+    metrics (Metrics): Optional per-stage counters and timings, also answered to "stats" requests
 """
 
+import hashlib
 import logging
 import struct
 import json
+import threading
+import time
 import uuid
 import os
-from typing import Optional
+from concurrent.futures import Future, wait
+from typing import Callable, List, Optional, Tuple, Union
 from .Connection import Connection
+from .RequestChannel import RequestChannel
+from .PayloadSink import PayloadSink
+from .PendingStep import PendingStep
 from .FileReceiver import FileReceiver
 from .StorageChecker import StorageChecker
 from .StatusResponder import StatusResponder
+from .ProgressSender import ProgressSender
 from .VideoProcessor import VideoProcessor
+from .ProcessingPool import ProcessingPool
+from .JobManager import JobManager, STATUS_DONE, STATUS_FAILED
+from .ResultCache import ResultCache
+from .QuotaManager import QuotaManager
+from .StreamingTranscoder import StreamingTranscoder
+from .MediaProber import MediaProber
+from .RateLimiter import RateLimiter
+from .Checksum import Checksum, HashTee, DEFAULT_CHECKSUM_ALGORITHM, CONTENT_KEY_ALGORITHMS
+from .Metrics import Metrics
+from .UploadSessionManager import UploadSessionManager, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
 
 ERROR_PROTOCOL = 1001
 ERROR_STORAGE_FULL = 1002
 ERROR_RECEIVING = 1003
 ERROR_SAVING = 1004
 ERROR_PROCESSING = 1005
+ERROR_SERVER_BUSY = 1006
+ERROR_JOB_NOT_FOUND = 1007
+ERROR_CHECKSUM_MISMATCH = 1008
+ERROR_UPLOAD_SESSION_NOT_FOUND = 1009
+ERROR_QUOTA_EXCEEDED = 1010
+ERROR_UNSUPPORTED_MEDIA = 1011
+ERROR_RATE_LIMITED = 1012
 ERROR_UNEXPECTED = 5000
 
 logging.basicConfig(
@@ -39,144 +103,959 @@ logging.basicConfig(
 )
 logger = logging.getLogger('RequestHandler')
 
+# Size of the fixed header in front of every message
+HEADER_SIZE = 8
+
+# Values of the "request_type" option; uploads are the default
+REQUEST_UPLOAD = "upload"
+REQUEST_JOB_STATUS = "job_status"
+REQUEST_JOB_FETCH = "job_fetch"
+REQUEST_UPLOAD_OPEN = "upload_open"
+REQUEST_UPLOAD_CHUNK = "upload_chunk"
+REQUEST_UPLOAD_STATUS = "upload_status"
+REQUEST_UPLOAD_COMMIT = "upload_commit"
+REQUEST_USAGE = "usage"
+REQUEST_STATS = "stats"
+REQUEST_TYPES = (REQUEST_UPLOAD, REQUEST_JOB_STATUS, REQUEST_JOB_FETCH, REQUEST_UPLOAD_OPEN, REQUEST_UPLOAD_CHUNK,
+                 REQUEST_UPLOAD_STATUS, REQUEST_UPLOAD_COMMIT, REQUEST_USAGE, REQUEST_STATS)
+# Requests that start new work and therefore count against the client's rate limit;
+# chunks, status polls and fetches of work already admitted do not
+RATE_LIMITED_REQUESTS = (REQUEST_UPLOAD, REQUEST_UPLOAD_OPEN)
+
+DEFAULT_CHUNK_CHECKSUM = "sha256"
+
+# Value of the "mode" option that returns a job ID instead of waiting for the result
+MODE_ASYNC = "async"
+
+# Media type of a response that carries several outputs back to back
+MEDIA_TYPE_MULTI = "multi"
+
+# Seconds a single send (response, progress frame or file) may stall before a slow client is dropped
+SLOW_CLIENT_TIMEOUT = 60
+
+# Why a request could not be read; see reject_request()
+REQUEST_INCOMPLETE_HEADER = "incomplete_header"
+REQUEST_INCOMPLETE = "incomplete"
+REQUEST_MALFORMED = "malformed"
+
+# Requests one persistent connection may have in flight at once
+MAX_PIPELINED_REQUESTS = 16
+# Seconds a persistent connection may sit idle between requests
+KEEP_ALIVE_IDLE_TIMEOUT = 60
+
 class RequestHandler:
     
-    def __init__(self, file_receiver: FileReceiver, storage_checker: StorageChecker, status_responder: StatusResponder, video_processor: VideoProcessor):
+    def __init__(self, file_receiver: FileReceiver, storage_checker: StorageChecker, status_responder: StatusResponder, video_processor: VideoProcessor, processing_pool: Optional[ProcessingPool] = None, job_manager: Optional[JobManager] = None, upload_session_manager: Optional[UploadSessionManager] = None, result_cache: Optional[ResultCache] = None, quota_manager: Optional[QuotaManager] = None, streaming_transcoder: Optional[StreamingTranscoder] = None, media_prober: Optional[MediaProber] = None, rate_limiter: Optional[RateLimiter] = None, metrics: Optional[Metrics] = None):
         self.file_receiver = file_receiver
         self.storage_checker = storage_checker
         self.status_responder = status_responder
         self.video_processor = video_processor
+        self.processing_pool = processing_pool
+        self.job_manager = job_manager
+        self.upload_session_manager = upload_session_manager
+        self.result_cache = result_cache
+        self.quota_manager = quota_manager
+        self.streaming_transcoder = streaming_transcoder
+        self.media_prober = media_prober
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        # Pipelined requests of the connection this handler serves
+        self._in_flight: List[threading.Thread] = []
+        self._slots = threading.BoundedSemaphore(MAX_PIPELINED_REQUESTS)
 
     def handle_connection(self, conn: Connection) -> bool:
-        saved_path = None
-        procesed_path = None
+        """
+        Serve the requests of one connection. A request without "request_id" is answered and the
+        connection closed. Requests with a "request_id" keep the connection open: each one is
+        served on its own thread as soon as it has been read, so a client can pipeline many
+        requests and gets the responses as they finish, tagged with their request IDs.
+        """
+        logger.info(f"Handling connection from {conn.address}")
+        first = True
+        try:
+            while True:
+                if not first and not conn.wait_readable(KEEP_ALIVE_IDLE_TIMEOUT):
+                    logger.info(f"Persistent connection from {conn.address} was idle for {KEEP_ALIVE_IDLE_TIMEOUT}s")
+                    return True
+                result = self.handle_request(conn, first)
+                if result is not None:
+                    return result
+                first = False
+        finally:
+            self.finish_connection(conn)
+
+    def handle_request(self, conn: Connection, first: bool = True) -> Optional[bool]:
+        """
+        Read and serve the next request of conn. Returns None if the connection stays open for more
+        requests: the request carried a "request_id", is being served on its own thread and its
+        payload has been read. Otherwise returns the result of the connection, which is then done.
+        """
+        request = self._read_request(conn, first)
+        if request is None:
+            # The client closing a persistent connection between requests is its normal end
+            return not first
+        options, media_type, payload_size = request
 
+        if "request_id" not in options:
+            self._join_requests()
+            return self._dispatch(conn, options, media_type, payload_size)
+
+        # Bounds the requests one connection may have in flight; reading stalls until one finishes
+        self._slots.acquire()
+        channel = RequestChannel(conn, options["request_id"], conn.bytes_received + payload_size)
+        thread = threading.Thread(target=self._serve_request, args=(channel, options, media_type, payload_size, self._slots), daemon=True)
+        thread.start()
+        self._in_flight = [t for t in self._in_flight if t.is_alive()] + [thread]
+
+        if payload_size:
+            # The next request follows this one's payload on the wire
+            channel.released.wait()
+            unread = channel.unread_payload()
+            if unread and not self.file_receiver.discard(conn, unread):
+                return False
+        return None
+
+    def finish_connection(self, conn: Connection):
+        """Wait for the requests still being served, then close the connection."""
+        self._join_requests()
+        conn.close()
+        logger.info(f"Connection closed for {conn.address}")
+
+    def _join_requests(self):
+        for thread in self._in_flight:
+            thread.join()
+        self._in_flight = []
+
+    def _read_request(self, conn: Connection, report_errors: bool = True) -> Optional[Tuple[dict, str, int]]:
+        # Returns (options, media type, payload size) with the payload still unread, or None
+        # read header data
+        header_data = conn.receive_all(HEADER_SIZE)
+        if len(header_data) != HEADER_SIZE:
+            if report_errors:
+                self.reject_request(conn, REQUEST_INCOMPLETE_HEADER)
+            return None
+        json_size, media_type_size, payload_size = self.parse_header(header_data)
+
+        # read JSON data and media type
+        json_data = conn.receive_all(json_size)
+        media_type_data = conn.receive_all(media_type_size) if len(json_data) == json_size else b''
+        if not json_data or len(json_data) != json_size or len(media_type_data) != media_type_size:
+            self.reject_request(conn, REQUEST_INCOMPLETE)
+            return None
+
+        request = self.parse_request(conn, json_data, media_type_data, payload_size)
+        if request is None:
+            self.reject_request(conn, REQUEST_MALFORMED)
+        return request
+
+    @staticmethod
+    def parse_header(header_data: bytes) -> Tuple[int, int, int]:
+        """The JSON size, media type size and payload size of an 8-byte request header."""
+        json_size, media_type_size = struct.unpack('!HB', header_data[:3])
+        return json_size, media_type_size, int.from_bytes(header_data[3:HEADER_SIZE], 'big')
+
+    def parse_request(self, conn: Connection, json_data: bytes, media_type_data: bytes, payload_size: int) -> Optional[Tuple[dict, str, int]]:
+        """Decode a request read by the caller. Returns (options, media type, payload size), or None if it is malformed."""
         try:
-            logger.info(f"Handling connection from {conn.address}")
+            options = json.loads(json_data.decode('utf-8'))
+            media_type = media_type_data.decode('utf-8')
+        except ValueError as e:
+            logger.error(f"Protocol error handling connection: {e}")
+            return None
+        if not isinstance(options, dict):
+            logger.error(f"Protocol error handling connection: the options of {conn.address} are not a JSON object")
+            return None
+        logger.info(f"Request from {conn.address}: options={options}, media_type={media_type}, payload_size={payload_size}bytes")
+        return options, media_type, payload_size
+
+    def reject_request(self, conn: Connection, reason: str):
+        """Answer a request that could not be read; reason is one of the REQUEST_INCOMPLETE* / REQUEST_MALFORMED values."""
+        if reason == REQUEST_INCOMPLETE_HEADER:
+            logger.error("Failed to receive header data")
+            self._send_error_response(conn, ERROR_PROTOCOL,  "Header reception failed",  "Ensure the client sends an 8-byte header and try again")
+        elif reason == REQUEST_INCOMPLETE:
+            logger.error("Failed to receive JSON or media type data")
+            self.status_responder.send_status(conn, "ERROR", SLOW_CLIENT_TIMEOUT)
+        else:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Protocol error", "Ensure the client follows the correct protocol for sending requests.")
+
+    def _serve_request(self, channel: RequestChannel, options: dict, media_type: str, payload_size: int, slots: threading.BoundedSemaphore):
+        try:
+            self._dispatch(channel, options, media_type, payload_size)
+        finally:
+            channel.release()
+            slots.release()
+
+    def _dispatch(self, conn: Connection, options: dict, media_type: str, payload_size: int) -> bool:
+        sink = self.begin_request(conn, options, media_type, payload_size)
+        if sink is None:
+            return self._wait_steps(conn, self.serve_request(conn, options, media_type, payload_size))
+        if not isinstance(sink, PayloadSink):
+            return sink
+        try:
+            if sink.write(conn.receive_all(sink.head_size)):
+                sink.receive(conn, sink.size - sink.head_size)
+        finally:
+            # Releases what begin_request() took, e.g. reserved space, whatever became of the payload
+            result = self.finish_payload(conn, sink)
+        return self._wait_steps(conn, result)
+
+    def _wait_steps(self, conn: Connection, result: Union[bool, PendingStep]) -> bool:
+        # Every request has a thread of its own here, so it simply blocks until it can go on
+        while isinstance(result, PendingStep):
+            wait([result.future])
+            result = self.resume(conn, result)
+        return result
+
+    def begin_request(self, conn: Connection, options: dict, media_type: str, payload_size: int) -> Union[PayloadSink, bool, None]:
+        """
+        Start a request whose payload the caller may receive itself. Uploads and upload chunks are
+        checked and their space reserved; they return a PayloadSink to feed the payload to and pass
+        to finish_payload(), or False if they were refused and answered already. Every other request
+        returns None and is served completely, payload and all, by serve_request().
+        """
+        request_type = options.get("request_type", REQUEST_UPLOAD)
+        if request_type == REQUEST_UPLOAD and not options.get("stream"):
+            begin = self._begin_upload
+        elif request_type == REQUEST_UPLOAD_CHUNK:
+            begin = self._begin_upload_chunk
+        else:
+            return None
 
-            # read header data
-            header_data = conn.recv(8)
-            if not header_data or len(header_data) != 8:
-                logger.error("Failed to receive header data")
-                self._send_error_response(conn, ERROR_PROTOCOL,  "Header reception failed",  "Ensure the client sends an 8-byte header and try again")
+        started = time.monotonic()
+        sink = self._run_guarded(conn, lambda: self._check_rate_limit(conn, options, request_type) and begin(conn, options, media_type, payload_size))
+        if isinstance(sink, PayloadSink):
+            sink.started = started
+            return sink
+        self._record_request(request_type, started)
+        return False
+
+    def serve_request(self, conn: Connection, options: dict, media_type: str, payload_size: int) -> Union[bool, PendingStep]:
+        """Serve a request for which begin_request() returned None, or return the PendingStep it waits on."""
+        started = time.monotonic()
+        request_type = options.get("request_type", REQUEST_UPLOAD)
+        result = self._run_guarded(conn, lambda: self._check_rate_limit(conn, options, request_type) and self._route(conn, options, media_type, payload_size, request_type))
+        return self._end_step(result, request_type, started)
+
+    def finish_payload(self, conn: Connection, sink: PayloadSink) -> Union[bool, PendingStep]:
+        """Close the payload fed to sink and answer its request, or return the PendingStep it waits on."""
+        return self._end_step(self._run_guarded(conn, sink.finish), sink.request_type, sink.started)
+
+    def resume(self, conn: Connection, step: PendingStep) -> Union[bool, PendingStep]:
+        """Go on with a request once the future of the PendingStep it returned is done."""
+        return self._end_step(self._run_guarded(conn, step.resume), step.request_type, step.started)
+
+    def _end_step(self, result: Union[bool, PendingStep], request_type, started: float) -> Union[bool, PendingStep]:
+        # A request that still waits is recorded once it has been answered
+        if isinstance(result, PendingStep):
+            result.request_type = request_type
+            result.started = started
+        else:
+            self._record_request(request_type, started)
+        return result
+
+    def _route(self, conn: Connection, options: dict, media_type: str, payload_size: int, request_type: str) -> bool:
+        if request_type == REQUEST_UPLOAD:
+            return self._handle_stream_upload(conn, options, payload_size)
+        elif request_type == REQUEST_JOB_STATUS:
+            return self._handle_job_status(conn, options)
+        elif request_type == REQUEST_JOB_FETCH:
+            return self._handle_job_fetch(conn, options)
+        elif request_type == REQUEST_UPLOAD_OPEN:
+            return self._handle_upload_open(conn, options, media_type)
+        elif request_type == REQUEST_UPLOAD_STATUS:
+            return self._handle_upload_status(conn, options)
+        elif request_type == REQUEST_UPLOAD_COMMIT:
+            return self._handle_upload_commit(conn, options)
+        elif request_type == REQUEST_USAGE:
+            return self._handle_usage(conn, options)
+        elif request_type == REQUEST_STATS:
+            return self._handle_stats(conn)
+        else:
+            logger.error(f"Unknown request type from {conn.address}: {request_type}")
+            self._send_error_response(conn, ERROR_PROTOCOL, "Unknown request type", f"'{request_type}' is not a supported request_type.")
+            return False
+
+    def _run_guarded(self, conn: Connection, step: Callable):
+        try:
+            return step()
+        except Exception as e:
+            logger.error(f"Unexpected error handling connection: {e}")
+            self._send_error_response(conn, ERROR_UNEXPECTED, "Unexpected error", "An unexpected error occurred while processing the request.Please report this issue to the server administrator.")
+            return False
+
+    def _record_request(self, request_type, started: float):
+        if self.metrics:
+            # Unknown types share one label, so clients cannot create series at will
+            label = request_type if request_type in REQUEST_TYPES else "unknown"
+            self.metrics.requests.inc(1, label)
+            self.metrics.request_seconds.observe(time.monotonic() - started, label)
+
+    def _begin_upload(self, conn: Connection, options: dict, media_type: str, payload_size: int) -> Union[PayloadSink, bool]:
+        verifier = None
+        algorithm = options.get("checksum_algorithm", DEFAULT_CHECKSUM_ALGORITHM)
+        if options.get("checksum"):
+            verifier = Checksum.new(algorithm)
+            if verifier is None:
+                self._send_error_response(conn, ERROR_PROTOCOL, "Unsupported checksum algorithm", f"Use one of: {', '.join(Checksum.supported())}.")
                 return False
-            
-            json_size, media_type_size = struct.unpack('!HB', header_data[:3])
-            payload_size = int.from_bytes(header_data[3:], 'big')
-
-            # read JSON data
-            json_data = conn.receive(json_size)
-            if not json_data or len(json_data) != json_size:
-                logger.error("Failed to receive JSON data")
-                self.status_responder.send_status(conn, "ERROR")
+
+        if not self._check_upload_allowed(conn, options, payload_size):
+            return False
+
+        client_id = self._client_id(conn, options)
+        filename = f"{uuid.uuid4()}.{media_type}"
+        # The result cache keys on the content. The client's checksum serves as that key when its algorithm allows,
+        # so the payload is hashed once; and a payload nobody hashes is spliced straight to disk by the threaded engine
+        hasher = hashlib.sha256() if self.result_cache and not (verifier and algorithm in CONTENT_KEY_ALGORITHMS) else None
+        # Both digests are computed from the same pass over the payload
+        tee = HashTee(hasher, verifier) if verifier and hasher else verifier or hasher
+        # Probe the head of the upload before accepting the rest of it
+        head_size = min(self.media_prober.probe_bytes, payload_size) if self.media_prober else 0
+        media_info = None
+        committed = False
+        refused = False
+        created = None
+        written = 0
+        write_seconds = 0.0
+        fed_since = None
+
+        def accept(head: memoryview) -> bool:
+            nonlocal media_info, committed, refused, created, written, write_seconds
+            if len(head) != head_size:
+                logger.error(f"Connection from {conn.address} closed during the upload")
                 return False
-            options = json.loads(json_data.decode('utf-8'))
+            if self.media_prober:
+                media_info, reason = self.media_prober.probe_head(bytes(head), payload_size, options)
+                if reason:
+                    refused = True
+                    self._send_unsupported_media_response(conn, reason)
+                    return False
+            # From here on the bytes count as used; DiskWriter gives them back if the upload fails
+            self._commit_space(client_id, payload_size)
+            committed = True
+            created = self.file_receiver.open_file(filename, payload_size, client_id, reserved=True)
+            if not created:
+                return False
+            write_seconds += self.file_receiver.write_block(created[1], head, tee)
+            written = len(head)
+            return True
 
-            # read media type
-            media_type_data = conn.receive(media_type_size)
-            if not media_type_data or len(media_type_data) != media_type_size:
-                logger.error("Failed to receive media type data")
-                self.status_responder.send_status(conn, "ERROR")
+        def write(data: memoryview) -> bool:
+            nonlocal written, write_seconds, fed_since
+            try:
+                if not committed:
+                    return accept(data)
+                if fed_since is None:
+                    fed_since = time.monotonic()
+                write_seconds += self.file_receiver.write_block(created[1], data, tee)
+                written += len(data)
+                return True
+            except Exception as e:
+                logger.error(f"Error receiving file: {e}")
                 return False
-            media_type = media_type_data.decode('utf-8')
 
-            
+        def receive(conn: Connection, size: int) -> int:
+            nonlocal written, write_seconds
+            received, receive_write_seconds = self.file_receiver.receive_into_file(conn, created[1], size, tee)
+            written += received
+            write_seconds += receive_write_seconds
+            return received
+
+        def finish() -> bool:
+            self._release_space(client_id, 0 if committed else payload_size)
+            saved_path = None
+            if created:
+                if fed_since is not None:
+                    self.file_receiver.record_receive(fed_since, written - head_size)
+                saved_path = self.file_receiver.close_file(created[0], created[1], payload_size, written, verifier is None, write_seconds)
+            if refused:
+                return False
+            if not saved_path:
+                logger.error(f"Failed to receive file from {conn.address}")
+                self._send_error_response(conn, ERROR_RECEIVING, "File reception failed", "The upload was interrupted or could not be written to disk. Please try again.")
+                return False
+            self._record_transfer(client_id, received=payload_size)
+
+            if verifier:
+                if verifier.hexdigest() != str(options["checksum"]).lower():
+                    logger.error(f"Checksum mismatch on the upload from {conn.address}")
+                    self.file_receiver.disk_writer.remove_file(saved_path)
+                    self._send_error_response(conn, ERROR_CHECKSUM_MISMATCH, "Upload checksum mismatch", "The file was corrupted in transit. Please upload it again.")
+                    return False
+                saved_path = self.file_receiver.disk_writer.commit_file(saved_path)
+                if not saved_path:
+                    self._send_error_response(conn, ERROR_SAVING, "File saving failed", "The upload could not be written to disk. Please try again.")
+                    return False
+            payload_digest = hasher.hexdigest() if hasher else Checksum.content_key(algorithm, verifier.hexdigest()) if verifier else None
+            return self._process_upload(conn, saved_path, options, payload_digest, media_info)
+
+        return PayloadSink(REQUEST_UPLOAD, payload_size, head_size, write, receive, finish)
+
+    def _handle_stream_upload(self, conn: Connection, options: dict, payload_size: int) -> Union[bool, PendingStep]:
+        built = self.video_processor.build_stream_command(options) if self.streaming_transcoder else None
+        if not built:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Streaming not supported", "Streaming works for compress, resize and change_aspect_ratio with 'format' mp4 or webm, and for convert_to_audio. Send the request without 'stream' otherwise.")
+            return False
+        command, output_media_type = built
+
+        if self.processing_pool and self.processing_pool.is_full():
+            self._send_busy_response(conn)
+            return False
+
+        # Nothing is stored, but the stream still counts against the client's concurrent uploads
+        client_id = self._client_id(conn, options)
+        if not self._reserve_space(conn, client_id, 0):
+            return False
+        if not self.processing_pool:
+            try:
+                return self._run_stream(conn, command, output_media_type, payload_size, client_id)
+            finally:
+                self._release_space(client_id, 0)
+
+        future = self.processing_pool.submit_task(f"stream from {conn.address}", self._run_stream, conn, command, output_media_type, payload_size, client_id,
+                                                  client_id=client_id)
+        if future is None:
+            self._release_space(client_id, 0)
+            self._send_busy_response(conn)
+            return False
+
+        def finish(done: Future) -> bool:
+            try:
+                return done.result()
+            finally:
+                self._release_space(client_id, 0)
+        return PendingStep(future, finish)
+
+    def _run_stream(self, conn: Connection, command: list, output_media_type: str, payload_size: int, client_id: str) -> bool:
+        json_data = self._encode_json(conn, {"stream": True})
+        media_type = output_media_type.encode('utf-8')
+        if not conn.send_vectored([self._build_header(len(json_data), len(media_type), 0), json_data, media_type], SLOW_CLIENT_TIMEOUT):
+            return False
+
+        def send_chunk(chunk: bytes) -> bool:
+            # Chunks carry no JSON, unless it is needed to tell pipelined requests apart
+            chunk_json = self._encode_json(conn, {}) if conn.request_id is not None else b''
+            return conn.send_vectored([self._build_header(len(chunk_json), 0, len(chunk)), chunk_json, chunk], SLOW_CLIENT_TIMEOUT)
+
+        logger.info(f"Streaming transcode for {conn.address}: {' '.join(command)}")
+        success, sent = self.streaming_transcoder.transcode(conn, command, payload_size, send_chunk)
+        self._record_transfer(client_id, received=payload_size if success else 0, sent=sent)
+        if self.metrics:
+            self.metrics.bytes_sent.inc(sent)
+
+        if not success:
+            self._send_error_response(conn, ERROR_PROCESSING, "Streaming transcode failed", "The upload was interrupted or the input cannot be read from a stream. Use a faststart MP4, WebM or MPEG-TS input, or send the request without 'stream'.", {"stream_end": True})
+            return False
+        logger.info(f"Streamed {sent} bytes of {output_media_type} to {conn.address}")
+        return self._send_json_response(conn, {"stream_end": True, "payload_size": sent})
+
+    def _check_upload_allowed(self, conn: Connection, options: dict, payload_size: int) -> bool:
+        if options.get("mode") == MODE_ASYNC and not self.job_manager:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Asynchronous jobs are not enabled", "Send the request without 'mode': 'async'.")
+            return False
+
+        if self.processing_pool and self.processing_pool.is_full():
+            self._send_busy_response(conn)
+            return False
+
+        return self._reserve_space(conn, self._client_id(conn, options), payload_size)
+
+    def _check_rate_limit(self, conn: Connection, options: dict, request_type: str) -> bool:
+        if not self.rate_limiter or request_type not in RATE_LIMITED_REQUESTS:
+            return True
+        wait = self.rate_limiter.acquire(self._client_id(conn, options))
+        if not wait:
+            return True
+        retry_after = max(1, int(wait + 0.999))
+        logger.warning(f"Request rate limit reached for {self._client_id(conn, options)}. Asking to retry after {retry_after}s")
+        self._send_error_response(conn, ERROR_RATE_LIMITED, "Rate limit exceeded", f"Too many requests from this client. Please retry after {retry_after} seconds.", {"retry_after": retry_after})
+        return False
+
+    def _reserve_space(self, conn: Connection, client_id: str, size: int) -> bool:
+        started = time.monotonic()
+        try:
+            return self._reserve(conn, client_id, size)
+        finally:
+            if self.metrics:
+                self.metrics.capacity_check_seconds.observe(time.monotonic() - started)
+
+    def _reserve(self, conn: Connection, client_id: str, size: int) -> bool:
+        if self.quota_manager:
+            reason = self.quota_manager.reserve(client_id, size)
+            if reason:
+                self._send_error_response(conn, ERROR_QUOTA_EXCEEDED, "Quota exceeded", f"The upload exceeds your client quota: {reason}. Please wait for running uploads to finish or contact the administrator.", {"usage": self.quota_manager.get_usage(client_id)})
+                return False
+
+        if not self.storage_checker.reserve(size):
+            if self.quota_manager:
+                self.quota_manager.release(client_id, size)
+            logger.warning(f"Not enough storage capacity for file from {conn.address}")
+            self._send_error_response(conn, ERROR_STORAGE_FULL, "Insufficient storage", "Server is at capacity. Please try again later.")
+            return False
+        return True
+
+    def _commit_space(self, client_id: str, size: int):
+        # The reserved bytes become used bytes in one step, so an upload never counts twice against capacity or quota
+        self.storage_checker.commit_reservation(size)
+        if self.quota_manager:
+            self.quota_manager.commit(client_id, size)
 
-            logger.info(f"Request from {conn.address}: options={options}, media_type={media_type}, payload_size={payload_size}bytes")
+    def _release_space(self, client_id: str, size: int):
+        self.storage_checker.release_reservation(size)
+        if self.quota_manager:
+            self.quota_manager.release(client_id, size)
 
-            if not self.storage_checker.has_capacity(payload_size):
-                logger.warning(f"Not enough storage capacity for file from {conn.address}")
-                self._send_error_response(conn, ERROR_STORAGE_FULL, "Insufficient storage", "Server is at capacity. Please try again later.")
+    def _record_transfer(self, client_id: str, received: int = 0, sent: int = 0):
+        if self.quota_manager:
+            self.quota_manager.record_transfer(client_id, received, sent)
+
+    @staticmethod
+    def _client_id(conn: Connection, options: dict) -> str:
+        return options.get("api_key") or conn.address[0]
+
+    def _process_upload(self, conn: Connection, saved_path: str, options: dict, payload_digest: Optional[str] = None, media_info: Optional[dict] = None) -> Union[bool, PendingStep]:
+        """
+        Process a fully received upload and respond. Takes ownership of saved_path.
+        media_info holds probe results from the upload's head; without them the file is probed here.
+        Returns a PendingStep while the request waits for its encode or for an identical request.
+        """
+        # The payload is in; a persistent connection can read its next request meanwhile
+        conn.release()
+        processed_path = None
+        cache_key = None
+        claimed = False
+        is_leader = False
+        progress_sender = None
+
+        def step(part: Callable) -> Callable:
+            # Whichever part ends the request, by returning a result or by raising, cleans up after it
+            def run(*args):
+                try:
+                    result = part(*args)
+                except BaseException:
+                    clean_up()
+                    raise
+                if not isinstance(result, PendingStep):
+                    clean_up()
+                return result
+            return run
+
+        def begin() -> Union[bool, PendingStep]:
+            nonlocal options, media_info, saved_path, cache_key
+            if "deadline" in options:
+                # The deadline counts from now; the encoder sees how much of it is left when the job starts
+                try:
+                    options = {**options, "deadline_at": time.time() + float(options["deadline"])}
+                except (TypeError, ValueError):
+                    self._send_error_response(conn, ERROR_PROTOCOL, "Invalid deadline", "'deadline' must be a number of seconds.")
+                    return False
+
+            if self.media_prober and media_info is None:
+                media_info = self.media_prober.probe_file(saved_path, payload_digest)
+                reason = self.media_prober.check(media_info, options) if media_info else "the file could not be read as audio or video"
+                if reason:
+                    self._send_unsupported_media_response(conn, reason)
+                    return False
+            elif self.media_prober:
+                # The head's probe result can be shared now that the whole upload's digest is known
+                self.media_prober.remember(payload_digest, media_info)
+
+            logger.info(f"Handing off {saved_path} to VidoeProcessor with options: {options}")
+            if options.get("mode") == MODE_ASYNC:
+                job_id = self.job_manager.submit(saved_path, options, media_info, self._client_id(conn, options))
+                if job_id is None:
+                    self._send_busy_response(conn)
+                    return False
+                # The JobManager owns the upload from now on
+                saved_path = None
+                return self._send_json_response(conn, self.job_manager.get(job_id).to_dict())
+
+            if self.result_cache and payload_digest and not options.get("outputs"):
+                cache_key = self.result_cache.make_key(payload_digest, options)
+                return claim()
+            return process()
+
+        def claim() -> Union[bool, PendingStep]:
+            nonlocal claimed, is_leader
+            cached_path, is_leader, leader_done = self.result_cache.try_claim(cache_key)
+            if leader_done:
+                # Claim again once the identical request has finished, successfully or not
+                return PendingStep(leader_done, step(lambda _: claim()))
+            claimed = True
+            if not is_leader:
+                return self._send_file_response(conn, cached_path, client_id=self._client_id(conn, options), checksum_algorithm=options.get("checksum_algorithm"))
+            return process()
+
+        def process() -> Union[bool, PendingStep]:
+            nonlocal progress_sender
+            progress_sender = self._progress_sender(conn) if options.get("progress") else None
+            progress = progress_sender.report if progress_sender else None
+            if self.processing_pool:
+                future = self.processing_pool.submit(saved_path, options, media_info, progress, self._client_id(conn, options))
+                if future is None:
+                    self._send_busy_response(conn)
+                    return False
+                return PendingStep(future, step(lambda done: respond(done.result())))
+            return respond(self.video_processor.process(saved_path, options, media_info, progress))
+
+        def respond(result: Union[str, List[str], None]) -> bool:
+            nonlocal processed_path, cache_key, is_leader
+            processed_path = result
+            stop_progress()
+            if cache_key and isinstance(processed_path, str) and self.video_processor.was_downscaled(processed_path):
+                # Scaled down to meet this request's deadline: serve it, but keep it out of the cache
+                # so identical requests without that deadline get the full resolution
+                self.result_cache.complete(cache_key, None)
+                cache_key = None
+            if cache_key and processed_path:
+                # The cache takes over the output file and wakes up identical requests waiting on it
+                processed_path = self.result_cache.complete(cache_key, processed_path)
+                is_leader = False
+
+            if processed_path:
+                logger.info(f"Successfully processed file: {processed_path}")
+                return self._send_result(conn, processed_path, client_id=self._client_id(conn, options), checksum_algorithm=options.get("checksum_algorithm"))
+            else:
+                logger.error(f"Video processing failed for {saved_path}")
+                self._send_error_response(conn, ERROR_PROCESSING, "Videoprocessing failed", "The video file may be corrupted or in an unsupported format.")
                 return False
-            
-            filename = f"{uuid.uuid4()}.{media_type}"
-            saved_path = self.file_receiver.save_payload(filename, payload)
 
+        def stop_progress():
+            nonlocal progress_sender
+            # No progress frame may follow the result or error response
+            if progress_sender:
+                progress_sender.close()
+                progress_sender = None
+
+        def clean_up():
+            nonlocal processed_path
+            stop_progress()
             if saved_path:
-                logger.info(f"Handing off {saved_path} to VidoeProcessor with options: {options}")
-                processed_path = self.video_processor.process(saved_path, options)
-                
-                if processed_path:
-                    logger.info(f"Successfully processed file: {processed_path}")
-                    self._senf_file_response(conn, processed_path)
-                    return True
+                self.file_receiver.disk_writer.remove_file(saved_path)
+            if cache_key and claimed:
+                if is_leader:
+                    # Processing failed or was refused; let a waiting request take over
+                    self.result_cache.complete(cache_key, None)
                 else:
-                    logger.error(f"Video processing failed for {saved_path}")
-                    self._send_error_reponse(conn, ERROR_PROCESSING, "Videoprocessing failed", "The video file may be corrupted or in an unsupported format.")
-            else:
-                logger.error(f"Failed to save file from {conn.address}")
-                self._send_error_response(conn, ERROR_SAVING, "File saving failed", "Ensure the server has write permissions and sufficient space.")
+                    self.result_cache.release(cache_key)
+                processed_path = None
+            for path in ([processed_path] if isinstance(processed_path, str) else processed_path or []):
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                        logger.info(f"Cleaned up processed file: {path}")
+                    except OSError as e:
+                        logger.error(f"Error deleting processed file {path}: {e}")
+
+        return step(begin)()
+
+    def _handle_upload_open(self, conn: Connection, options: dict, media_type: str) -> bool:
+        if not self.upload_session_manager:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Resumable uploads are not enabled", "Send the file as a single upload request.")
+            return False
+
+        client_id = self._client_id(conn, options)
+        try:
+            total_size = int(options.get("total_size", 0))
+            chunk_size = int(options.get("chunk_size", DEFAULT_CHUNK_SIZE))
+        except (TypeError, ValueError):
+            total_size = chunk_size = 0
+        if not self.upload_session_manager.is_valid_session(total_size, chunk_size):
+            self._send_error_response(conn, ERROR_PROTOCOL, "Invalid upload session", f"Provide a positive 'total_size', a media type and a 'chunk_size' of at most {MAX_CHUNK_SIZE} bytes.")
+            return False
+        if not self._reserve_space(conn, client_id, total_size):
+            return False
+
+        try:
+            self._commit_space(client_id, total_size)
+            session = self.upload_session_manager.open_session(media_type, total_size, chunk_size, client_id, reserved=True)
+        finally:
+            self._release_space(client_id, 0)
+        if not session:
+            self._send_error_response(conn, ERROR_SAVING, "Upload session could not be created", "The session file could not be created on the server. Please try again later.")
+            return False
+        return self._send_json_response(conn, self.upload_session_manager.to_dict(session))
+
+    def _begin_upload_chunk(self, conn: Connection, options: dict, media_type: str, payload_size: int) -> Union[PayloadSink, bool]:
+        session = self._find_session(conn, options)
+        if not session:
+            return False
+
+        try:
+            offset = int(options.get("offset", -1))
+        except (TypeError, ValueError):
+            offset = -1
+        if not self.upload_session_manager.is_valid_chunk(session, offset, payload_size):
+            self._send_error_response(conn, ERROR_PROTOCOL, "Invalid chunk", f"Chunks must start at a multiple of {session.chunk_size} bytes and span one full chunk (or the rest of the file).")
+            return False
+
+        try:
+            hasher = hashlib.new(options.get("checksum_algorithm", DEFAULT_CHUNK_CHECKSUM))
+        except ValueError:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Unsupported checksum algorithm", f"Use '{DEFAULT_CHUNK_CHECKSUM}' for chunk checksums.")
+            return False
+
+        # Last check before the sink is returned: once it is, finish() runs and releases the writer
+        if not self.upload_session_manager.acquire_writer(session):
+            self._send_error_response(conn, ERROR_UPLOAD_SESSION_NOT_FOUND, "Upload session not found", "The session was committed or has expired while the chunk arrived.")
+            return False
+
+        received = 0
+
+        def write(data: memoryview) -> bool:
+            nonlocal received
+            try:
+                self.file_receiver.write_block(session.fd, data, hasher, offset + received)
+            except Exception as e:
+                logger.error(f"Error writing chunk at {offset} of session {session.session_id}: {e}")
                 return False
+            received += len(data)
+            return True
+
+        def receive(conn: Connection, size: int) -> int:
+            nonlocal received
+            n = self.file_receiver.receive_range(conn, session.fd, offset + received, size, hasher)
+            received += n
+            return n
+
+        def finish() -> bool:
+            try:
+                if received != payload_size:
+                    logger.error(f"Chunk at {offset} of session {session.session_id} was interrupted after {received} bytes")
+                    self._send_error_response(conn, ERROR_RECEIVING, "Chunk reception failed", "Resend the chunk.")
+                    return False
+
+                if hasher.hexdigest() != options.get("checksum"):
+                    logger.error(f"Checksum mismatch for chunk at {offset} of session {session.session_id}")
+                    self._send_error_response(conn, ERROR_CHECKSUM_MISMATCH, "Chunk checksum mismatch", "The chunk was corrupted in transit. Resend it.", {"offset": offset})
+                    return False
+
+                self.upload_session_manager.mark_received(session, offset, payload_size)
+            finally:
+                self.upload_session_manager.release_writer(session)
+            self._record_transfer(self._client_id(conn, options), received=payload_size)
+            return self._send_json_response(conn, {"session_id": session.session_id, "offset": offset, "size": payload_size})
+
+        return PayloadSink(REQUEST_UPLOAD_CHUNK, payload_size, 0, write, receive, finish)
+
+    def _handle_upload_status(self, conn: Connection, options: dict) -> bool:
+        session = self._find_session(conn, options)
+        if not session:
+            return False
+        return self._send_json_response(conn, self.upload_session_manager.to_dict(session))
+
+    def _handle_upload_commit(self, conn: Connection, options: dict) -> Union[bool, PendingStep]:
+        session = self._find_session(conn, options)
+        if not session:
+            return False
+
+        if not session.is_complete():
+            self._send_error_response(conn, ERROR_PROTOCOL, "Upload incomplete", "Send the missing chunks listed in 'received_ranges' before committing.", self.upload_session_manager.to_dict(session))
+            return False
+        if self.processing_pool and self.processing_pool.is_full():
+            self._send_busy_response(conn)
+            return False
+
+        saved_path = self.upload_session_manager.commit(session)
+        if not saved_path:
+            self._send_error_response(conn, ERROR_UPLOAD_SESSION_NOT_FOUND, "Upload session not found", "The session was already committed or has expired.")
+            return False
+        payload_digest = ResultCache.hash_file(saved_path) if self.result_cache else None
+        return self._process_upload(conn, saved_path, options.get("options", {}), payload_digest)
+
+    def _find_session(self, conn: Connection, options: dict):
+        session_id = options.get("session_id")
+        session = self.upload_session_manager.get(session_id) if self.upload_session_manager and session_id else None
+        if session and session.client_id != self._client_id(conn, options):
+            # Another client's session is reported like an unknown one, so session IDs cannot be probed
+            logger.warning(f"Upload session {session_id} belongs to another client than {conn.address}")
+            session = None
+        if not session:
+            logger.warning(f"Upload session {session_id} requested by {conn.address} was not found")
+            self._send_error_response(conn, ERROR_UPLOAD_SESSION_NOT_FOUND, "Upload session not found", "The session ID is unknown or the session has expired. Open a new upload session.")
+        return session
         
-        except (json.JSONDecodeError, struct.error) as e:
-            logger.error(f"Protocol error handling connection: {e}")
-            self._send_error_reponse(conn, ERROR_PROTOCOL, "Protocol error", "Ensure the client follows the correct protocol for sending requests.")
+    def _handle_job_status(self, conn: Connection, options: dict) -> bool:
+        job = self._find_job(conn, options)
+        if not job:
             return False
+        return self._send_json_response(conn, job.to_dict())
+
+    def _handle_job_fetch(self, conn: Connection, options: dict) -> bool:
+        job = self._find_job(conn, options)
+        if not job:
+            return False
+
+        status = job.status
+        if status == STATUS_DONE:
+            return self._send_result(conn, job.result_path, job.to_dict(), self._client_id(conn, options), options.get("checksum_algorithm"))
+        elif status == STATUS_FAILED:
+            self._send_error_response(conn, ERROR_PROCESSING, "Videoprocessing failed", "The video file may be corrupted or in an unsupported format.", {"job_id": job.job_id})
+            return False
+        # Not finished yet: answer with the status only, the client polls again later
+        return self._send_json_response(conn, job.to_dict())
+
+    def _handle_usage(self, conn: Connection, options: dict) -> bool:
+        if not self.quota_manager:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Quotas not enabled", "This server does not track per-client usage.")
+            return False
+        return self._send_json_response(conn, self.quota_manager.get_usage(self._client_id(conn, options)))
+
+    def _handle_stats(self, conn: Connection) -> bool:
+        if not self.metrics:
+            self._send_error_response(conn, ERROR_PROTOCOL, "Metrics not enabled", "This server does not collect metrics.")
+            return False
+        return self._send_json_response(conn, {"stats": self.metrics.snapshot()})
+
+    def _find_job(self, conn: Connection, options: dict):
+        job_id = options.get("job_id")
+        job = self.job_manager.get(job_id) if self.job_manager and job_id else None
+        if not job:
+            logger.warning(f"Job {job_id} requested by {conn.address} was not found")
+            self._send_error_response(conn, ERROR_JOB_NOT_FOUND, "Job not found", "The job ID is unknown or its result has expired. Please upload the file again.")
+        return job
+
+    def _send_json_response(self, conn: Connection, response: dict) -> bool:
+        json_data = self._encode_json(conn, response)
+        header = self._build_header(len(json_data), 0, 0)
+        return conn.send_vectored([header, json_data], SLOW_CLIENT_TIMEOUT)
+
+    def _progress_sender(self, conn: Connection) -> ProgressSender:
+        # Frames go out from the sender's own thread, so a slow client never holds up the processing worker
+        return ProgressSender(conn, lambda report: self._send_json_response(conn, {"progress": report}))
 
+    def _send_result(self, conn: Connection, result: Union[str, List[str]], response: Optional[dict] = None, client_id: Optional[str] = None,
+                     checksum_algorithm: Optional[str] = None) -> bool:
+        if isinstance(result, list):
+            return self._send_files_response(conn, result, response, client_id, checksum_algorithm)
+        return self._send_file_response(conn, result, response, client_id, checksum_algorithm)
+
+    def _send_files_response(self, conn: Connection, file_paths: List[str], response: Optional[dict] = None, client_id: Optional[str] = None,
+                             checksum_algorithm: Optional[str] = None) -> bool:
+        """Send several outputs as one "multi" response: sizes and media types in the JSON, payloads back to back."""
+        files = []
+        try:
+            for file_path in file_paths:
+                files.append(open(file_path, 'rb'))
+            outputs = [{
+                "media_type": os.path.splitext(path)[1].lstrip('.'),
+                "payload_size": os.fstat(f.fileno()).st_size,
+            } for path, f in zip(file_paths, files)]
+            response = dict(response or {})
+            if Checksum.is_supported(checksum_algorithm):
+                response["checksum_algorithm"] = checksum_algorithm
+                for path, output in zip(file_paths, outputs):
+                    output["checksum"] = Checksum.file_digest(path, checksum_algorithm)
+            payload_size = sum(output["payload_size"] for output in outputs)
+            json_data = self._encode_json(conn, {**response, "outputs": outputs})
+            media_type = MEDIA_TYPE_MULTI.encode('utf-8')
+
+            header = self._build_header(len(json_data), len(media_type), payload_size)
+            started = time.monotonic()
+            # Responses to other pipelined requests wait until the whole message is out
+            with conn.send_lock:
+                if not conn.send_vectored([header, json_data, media_type], SLOW_CLIENT_TIMEOUT):
+                    return False
+                for f, output in zip(files, outputs):
+                    if not conn.send_file(f, output["payload_size"], SLOW_CLIENT_TIMEOUT):
+                        logger.error(f"Failed to send processed file {f.name} to {conn.address}")
+                        return False
+            self._record_send(started, payload_size)
+
+            if client_id:
+                self._record_transfer(client_id, sent=payload_size)
+            logger.info(f"Sent {len(files)} processed files to client.")
+            return True
+
+        except FileNotFoundError as e:
+            logger.error(f"Could not find processed file to send: {e.filename}")
+            self.status_responder.send_status(conn, "ERROR", SLOW_CLIENT_TIMEOUT)
+            return False
         except Exception as e:
-            logger.error(f"Unexpected error handling connection: {e}")
-            self._send_error_response(conn, ERROR_UNEXPECTED, "Unexpected error", "An unexpected error occurred while processing the request.Please report this issue to the server administrator.")
+            logger.error(f"Failed to send file response: {e}")
             return False
         finally:
-            if saved_path and os.path.exists(saved_path):
-                try:
-                    os.remove(saved_path)
-                    logger.info(f"Cleaned up original file: {saved_path}")
-                except OSError as e:
-                    logger.error(f"Error deleting original file {saved_path}: {e}")
-            if procesed_path and os.path.exists(procesed_path):
-                try:
-                    os.remove(procesed_path)
-                    logger.info(f"Cleaned up processed file: {procesed_path}")
-                except OSError as e:
-                    logger.error(f"Error deleting processed file {procesed_path}: {e}")
+            for f in files:
+                f.close()
 
-
-            conn.close()
-            logger.info(f"Connection closed for {conn.address}")
-        
-    def _senf_file_response(self, conn: Connection, file_path: str):
+    def _send_file_response(self, conn: Connection, file_path: str, response: Optional[dict] = None, client_id: Optional[str] = None,
+                            checksum_algorithm: Optional[str] = None) -> bool:
         try:
             with open(file_path, 'rb') as f:
-                payload = f.read()
-
-            payload_size = len(payload)
-            media_type = os.path.splitext(file_path)[1].lstrip('.').encode('utf-8')
-            media_type_size = len(media_type)
+                payload_size = os.fstat(f.fileno()).st_size
+                media_type = os.path.splitext(file_path)[1].lstrip('.').encode('utf-8')
+                response = dict(response or {})
+                if Checksum.is_supported(checksum_algorithm):
+                    # The digest goes in the header, ahead of the payload; the output was just written and is read from the page cache
+                    response["checksum"] = Checksum.file_digest(file_path, checksum_algorithm)
+                    response["checksum_algorithm"] = checksum_algorithm
+                json_data = self._encode_json(conn, response)
 
-            json_data = b'{}'
-            json_size = len(json_data)
+                header = self._build_header(len(json_data), len(media_type), payload_size)
 
-            header = struct.pack('!H', json_size) + struct.pack('!B', media_type_size) + payload_size.to_bytes(5, 'big')
+                started = time.monotonic()
+                with conn.send_lock:
+                    if not conn.send_vectored([header, json_data, media_type], SLOW_CLIENT_TIMEOUT):
+                        return False
+                    if not conn.send_file(f, payload_size, SLOW_CLIENT_TIMEOUT):
+                        logger.error(f"Failed to send processed file {file_path} to {conn.address}")
+                        return False
+                self._record_send(started, payload_size)
+            if client_id:
+                self._record_transfer(client_id, sent=payload_size)
 
-            conn.send(header)
-            conn.send(json_data)
-            conn.send(media_type)
-            conn.send(payload)
             logger.info(f"Sent processed file {file_path} to client.")
+            return True
 
         except FileNotFoundError:
-            logger.error(f"Could not find processed file to senf: {file_path}")
-            self.status_responder.send_status(conn, "ERROR")
+            logger.error(f"Could not find processed file to send: {file_path}")
+            self.status_responder.send_status(conn, "ERROR", SLOW_CLIENT_TIMEOUT)
+            return False
         except Exception as e:
             logger.error(f"Failed to send file response: {e}")
+            return False
     
-    def _send_error_reponse(self, conn: Connection, code: int, description: str, solution: str):
+    def _record_send(self, started: float, payload_size: int):
+        if self.metrics:
+            self.metrics.send_seconds.observe(time.monotonic() - started)
+            self.metrics.bytes_sent.inc(payload_size)
+
+    def _send_unsupported_media_response(self, conn: Connection, reason: str):
+        logger.warning(f"Rejected upload from {conn.address}: {reason}")
+        self._send_error_response(conn, ERROR_UNSUPPORTED_MEDIA, "Unsupported media", f"The upload was rejected because {reason}. Please send a valid video or audio file.", {"reason": reason})
+
+    def _send_busy_response(self, conn: Connection):
+        retry_after = self.processing_pool.retry_after()
+        logger.warning(f"Processing queue full. Asking {conn.address} to retry after {retry_after}s")
+        self._send_error_response(conn, ERROR_SERVER_BUSY, "Server busy", f"All processing slots are in use. Please retry after {retry_after} seconds.", {"retry_after": retry_after})
+
+    def _send_error_response(self, conn: Connection, code: int, description: str, solution: str, extra: Optional[dict] = None):
         error_json = {
             "error": {
                 "code": code,
                 "description": description,
-                "solution": solution
+                "solution": solution,
+                **(extra or {})
             }
         }
-        json_data = json.dumps(error_json).encode('utf-8')
-        json_size = len(json_data)
-
-        header = struct.pack('!H', json_size) + struct.pack('!B', 0) + (0).to_bytes(5, 'big')
+        json_data = self._encode_json(conn, error_json)
+        header = self._build_header(len(json_data), 0, 0)
+        if self.metrics:
+            self.metrics.errors.inc(1, str(code))
 
         try:
-            conn.send(header)
-            conn.send(json_data)
+            conn.send_vectored([header, json_data], SLOW_CLIENT_TIMEOUT)
             logger.info(f"Sent error response to {conn.address}: {error_json}")
         except Exception as e:
-            logger.error(f"Failed to send error response to client: {e}")
\ No newline at end of file
+            logger.error(f"Failed to send error response to client: {e}")
+
+    @staticmethod
+    def _encode_json(conn: Connection, response: dict) -> bytes:
+        if conn.request_id is not None:
+            response = {**response, "request_id": conn.request_id}
+        return json.dumps(response).encode('utf-8')
+
+    @staticmethod
+    def _build_header(json_size: int, media_type_size: int, payload_size: int) -> bytes:
+        return struct.pack('!HB', json_size, media_type_size) + payload_size.to_bytes(5, 'big')
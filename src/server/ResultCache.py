@@ -0,0 +1,207 @@
+"""
+ResultCache stores processed outputs by content so repeated requests skip ffmpeg.
+Entries are keyed on (payload hash, normalized options, ffmpeg version) and
+live as files under cache_dir. The cache stays within max_bytes by evicting
+the least recently used entries. Entries that are being sent to a client are
+pinned and never evicted while in use.
+Identical requests that arrive together are merged: the first caller to claim
+a key becomes the leader and runs the encode, later callers wait for it and
+are served the same output. try_claim() hands such a caller the future to
+wait on instead of blocking, for callers that wait on an event loop.
+Attributes:
+    cache_dir (str): Directory holding the cached output files.
+    max_bytes (int): Byte budget of the cache.
+    ffmpeg_version (str): Version string that is part of every key.
+Example:
+    cache = ResultCache("processed/cache", max_bytes=50 * 1024 ** 3, ffmpeg_version="ffmpeg version 6.1")
+    key = cache.make_key(payload_digest, {"operation": "compress"})
+    cached_path, is_leader = cache.claim(key)
+    if is_leader:
+        cached_path = cache.complete(key, video_processor.process(input_path, options))
+    ...send cached_path...
+    cache.release(key)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('ResultCache')
+
+# Options that steer the protocol rather than the encode, so they are not part of the key.
+# Urgency picks the encoder speed settings, so any full-resolution result serves every
+# deadline; outputs the encoder tuner scaled down to meet a deadline are never cached.
+TRANSPORT_OPTIONS = {
+    "request_type", "mode", "job_id", "session_id", "offset",
+    "checksum", "checksum_algorithm", "options", "api_key", "stream",
+    "priority", "deadline", "deadline_at", "progress", "request_id",
+}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class CacheEntry:
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.pins = 0
+
+
+class ResultCache:
+
+    def __init__(self, cache_dir: str, max_bytes: int, ffmpeg_version: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ffmpeg_version = ffmpeg_version or "unknown"
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Done once the leader producing the key has called complete()
+        self._inflight: Dict[str, Future] = {}
+        self._used_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_existing()
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    def make_key(self, payload_digest: str, options: dict) -> str:
+        normalized = {k: v for k, v in options.items() if k not in TRANSPORT_OPTIONS and v is not None}
+        material = json.dumps({
+            "payload": payload_digest,
+            "options": normalized,
+            "ffmpeg": self.ffmpeg_version,
+        }, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def claim(self, key: str) -> Tuple[Optional[str], bool]:
+        """
+        Look up key. Returns (path, False) on a hit, with the entry pinned until release().
+        Returns (None, True) when the caller must produce the output and call complete().
+        If another caller is already producing it, waits for that caller first.
+        """
+        while True:
+            cached_path, is_leader, leader_done = self.try_claim(key)
+            if leader_done is None:
+                return cached_path, is_leader
+            leader_done.result()
+            # Loop: either the output is cached now, or the leader failed and this caller takes over
+
+    def try_claim(self, key: str) -> Tuple[Optional[str], bool, Optional[Future]]:
+        """
+        claim() without the waiting: if another caller is already producing the output, returns
+        (None, False, future), and the caller claims again once future is done.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry.pins += 1
+                self._entries.move_to_end(key)
+                logger.info(f"Cache hit for {key[:12]}: {entry.path}")
+                return entry.path, False, None
+
+            leader_done = self._inflight.get(key)
+            if leader_done is None:
+                self._inflight[key] = Future()
+                return None, True, None
+
+        logger.info(f"Identical request for {key[:12]} is already being processed. Waiting for it.")
+        return None, False, leader_done
+
+    def complete(self, key: str, output_path: Optional[str]) -> Optional[str]:
+        """
+        Store the leader's output under key and wake up the waiting callers. The output file is
+        moved into the cache; the returned cache path is pinned until release().
+        """
+        try:
+            if not output_path or not os.path.exists(output_path):
+                return None
+
+            ext = os.path.splitext(output_path)[1]
+            cached_path = os.path.join(self.cache_dir, f"{key}{ext}")
+            os.replace(output_path, cached_path)
+            size = os.path.getsize(cached_path)
+
+            with self._lock:
+                entry = CacheEntry(cached_path, size)
+                entry.pins = 1
+                self._entries[key] = entry
+                self._used_bytes += size
+                evicted = self._evict()
+
+            for path in evicted:
+                self._remove_file(path)
+            logger.info(f"Cached {cached_path} ({size} bytes). Cache usage: {self._used_bytes}/{self.max_bytes} bytes")
+            return cached_path
+        finally:
+            with self._lock:
+                leader_done = self._inflight.pop(key, None)
+            if leader_done:
+                leader_done.set_result(None)
+
+    def release(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.pins > 0:
+                entry.pins -= 1
+            evicted = self._evict()
+        for path in evicted:
+            self._remove_file(path)
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return self._used_bytes
+
+    def _evict(self) -> list:
+        # Caller holds the lock. Oldest entries first, skipping the ones in use.
+        evicted = []
+        for key in list(self._entries):
+            if self._used_bytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry.pins:
+                continue
+            del self._entries[key]
+            self._used_bytes -= entry.size
+            evicted.append(entry.path)
+        return evicted
+
+    def _load_existing(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_atime, os.path.splitext(name)[0], path, stat.st_size))
+
+        for _, key, path, size in sorted(files):
+            self._entries[key] = CacheEntry(path, size)
+            self._used_bytes += size
+
+        for path in self._evict():
+            self._remove_file(path)
+        logger.info(f"Result cache loaded {len(self._entries)} entries ({self._used_bytes} bytes) from {self.cache_dir}")
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+            logger.info(f"Evicted cached output {path}")
+        except OSError as e:
+            logger.error(f"Error evicting cached output {path}: {e}")
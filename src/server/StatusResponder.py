@@ -16,7 +16,8 @@ example:
 """
 
 import logging
-from .TCPSocketServer import Connection
+from typing import Optional
+from .Connection import Connection
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,7 +28,7 @@ logger = logging.getLogger('StatusResponder')
 class StatusResponder:
 
     @staticmethod
-    def send_status(conn: Connection, status: str) -> bool:
+    def send_status(conn: Connection, status: str, timeout: Optional[float] = None) -> bool:
         try:
             status_bytes = status.encode('utf-8')
 
@@ -38,7 +39,7 @@ class StatusResponder:
                 # pad with spaces
                 status_bytes = status_bytes + b' ' * (16 - len(status_bytes))
             
-            result = conn.send(status_bytes)
+            result = conn.send(status_bytes, timeout)
 
             if result:
                 logger.info(f"Status sent to {conn.address}: {status}")
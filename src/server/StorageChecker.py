@@ -3,18 +3,34 @@ StorageChecker class for managing and monitoring storage capacity.
 This module provides functionality to check available storage space, 
 track usage against a configured maximum, and determine if there's
 enough capacity for new files.
+Usage is kept in an in-memory counter: it is seeded by walking the storage
+tree once at startup, updated by DiskWriter on every write and delete, and
+reconciled against the disk by a background thread every reconcile_interval
+seconds. A reconcile walk only corrects the counter if no write or delete was
+recorded while it ran, since the walk cannot tell which of those it saw. Space for an upload is reserved atomically with reserve(), so
+parallel uploads cannot both pass the capacity check. When the upload's file is
+created, commit_reservation() turns the reservation into usage in one step, so
+the bytes are never counted as both reserved and used.
 Attributes:
     max_storage_bytes (int): Maximum storage capacity in bytes.
     storage_path (str): Path to the storage directory.
+    reconcile_interval (float): Seconds between background re-walks of the tree (0 disables).
+    quota_manager (QuotaManager): Optional per-client quotas kept up to date with the same writes and deletes.
 Example:
     >>> checker = StorageChecker(max_storage_tb=2.0, storage_path='/data')
-    >>> if checker.has_capacity(file_size):
-    >>>     # proceed with file operation
+    >>> if checker.reserve(file_size):
+    >>>     # the file is about to be written
+    >>>     checker.commit_reservation(file_size)
+    >>> # or, if the upload is refused after all
+    >>> checker.release_reservation(file_size)
 """
 import os
 import logging
 import shutil
+import threading
+import time
 from typing import Optional
+from .QuotaManager import QuotaManager
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,9 +39,11 @@ logging.basicConfig(
 logger = logging.getLogger('StorageChecker')
 
 class StorageChecker:
-    def __init__(self, max_storage_tb: float = 4.0, storage_path: str = None):
-        self.max_storage_bytes = max_storage_tb * 1024 * 1024 * 1024 * 1024
+    def __init__(self, max_storage_tb: float = 4.0, storage_path: str = None, reconcile_interval: float = 300, quota_manager: Optional[QuotaManager] = None):
+        self.max_storage_bytes = int(max_storage_tb * 1024 * 1024 * 1024 * 1024)
         self.storage_path = storage_path or os.getcwd()
+        self.reconcile_interval = reconcile_interval
+        self.quota_manager = quota_manager
 
         if not os.path.exists(self.storage_path):
             try:
@@ -33,23 +51,105 @@ class StorageChecker:
                 logger.info(f"Created storage directory at {self.storage_path}")
             except Exception as e:
                 logger.error(f"Failed to create storage directory {self.storage_path}: {e}")
+
+        self._lock = threading.Lock()
+        self._used_bytes = self.get_used_space() or 0
+        self._reserved_bytes = 0
+        # Bumped on every recorded write and delete, so a reconcile can tell whether the tree changed under its walk
+        self._generation = 0
+        logger.info(f"Storage usage seeded at {self._used_bytes} bytes for {self.storage_path}")
+
+        if self.reconcile_interval:
+            reconciler = threading.Thread(target=self._reconcile_loop, name="StorageReconciler", daemon=True)
+            reconciler.start()
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return self._used_bytes
+
+    def reserved_bytes(self) -> int:
+        with self._lock:
+            return self._reserved_bytes
+
+    def reserve(self, file_size: int) -> bool:
+        with self._lock:
+            free_space = self.max_storage_bytes - self._used_bytes - self._reserved_bytes
+            if free_space < file_size:
+                logger.warning(f"Not enough storage space. Required: {file_size} bytes, Available: {free_space} bytes")
+                return False
+            self._reserved_bytes += file_size
+            return True
+
+    def release_reservation(self, file_size: int):
+        with self._lock:
+            self._reserved_bytes = max(0, self._reserved_bytes - file_size)
+
+    def commit_reservation(self, file_size: int):
+        """Move file_size reserved bytes into the used bytes, e.g. when the reserved upload's file is created."""
+        with self._lock:
+            self._reserved_bytes = max(0, self._reserved_bytes - file_size)
+            self._used_bytes += file_size
+            self._generation += 1
+
+    def record_write(self, size: int, client_id: Optional[str] = None):
+        with self._lock:
+            self._used_bytes += size
+            self._generation += 1
+        if self.quota_manager and client_id:
+            self.quota_manager.record_write(client_id, size)
+
+    def record_delete(self, size: int, client_id: Optional[str] = None):
+        with self._lock:
+            self._used_bytes = max(0, self._used_bytes - size)
+            self._generation += 1
+        if self.quota_manager and client_id:
+            self.quota_manager.record_delete(client_id, size)
+
+    def reconcile(self) -> bool:
+        """Correct the usage counter from a walk of the tree. False if the walk failed or raced with writes or deletes."""
+        with self._lock:
+            generation = self._generation
+        actual = self.get_used_space()
+        if actual is None:
+            return False
+        with self._lock:
+            if self._generation != generation:
+                logger.info("Storage changed during the usage walk; keeping the counter until the next reconcile")
+                return False
+            drift = actual - self._used_bytes
+            self._used_bytes = actual
+        if drift:
+            logger.warning(f"Storage usage counter drifted by {drift} bytes; corrected to {actual} bytes")
+        return True
+
+    def _reconcile_loop(self):
+        while True:
+            time.sleep(self.reconcile_interval)
+            self.reconcile()
     
-    def get_used_space(self) -> int:
+    def get_used_space(self) -> Optional[int]:
+        """
+        Walk the storage tree and sum file sizes, or None if the walk failed. Slow on large
+        trees; used for seeding and reconciling only.
+        """
         try:
             total_size = 0
             # Walk through the directory and sum up the sizes of all files
             for dirpath, _, filenames in os.walk(self.storage_path):
                 for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    if os.path.exists(filepath):
-                        total_size += os.path.getsize(filepath)
+                    try:
+                        total_size += os.path.getsize(os.path.join(dirpath, filename))
+                    except FileNotFoundError:
+                        # Deleted since the directory was listed, which happens all the time
+                        continue
             return total_size
         except Exception as e:
             logger.error(f"Error calculating used space in {self.storage_path}: {e}")
-            return 0
+            return None
     
     def get_free_space(self) -> int:
-        return self.max_storage_bytes - self.get_used_space()
+        with self._lock:
+            return self.max_storage_bytes - self._used_bytes - self._reserved_bytes
     
     def has_capacity(self, file_size: int) -> bool:
         free_space = self.get_free_space()
@@ -0,0 +1,111 @@
+"""
+StreamingTranscoder runs ffmpeg as a pipeline between two sockets' worth of data.
+The upload is forwarded from the connection into ffmpeg's stdin while ffmpeg's
+stdout is handed to the caller chunk by chunk as soon as it is produced, so
+receiving, encoding and sending the result all overlap and neither the input
+nor the output ever touches the disk. The caller decides how chunks are framed
+on the wire. stderr is drained continuously and only its last lines are kept
+for the log, so a chatty ffmpeg can never block on a full pipe.
+Attributes:
+    file_receiver (FileReceiver): Forwards the upload from the socket into ffmpeg's stdin.
+    chunk_size (int): Largest chunk read from ffmpeg's stdout at once.
+Example:
+    transcoder = StreamingTranscoder(file_receiver)
+    command, media_type = video_processor.build_stream_command({"operation": "compress"})
+    success, sent = transcoder.transcode(conn, command, payload_size, send_chunk)
+"""
+
+import os
+import subprocess
+import threading
+import logging
+from collections import deque
+from typing import Callable, List, Tuple
+from .Connection import Connection
+from .FileReceiver import FileReceiver
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('StreamingTranscoder')
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Lines of ffmpeg's stderr kept for the error log
+STDERR_TAIL_LINES = 20
+
+
+class StreamingTranscoder:
+
+    def __init__(self, file_receiver: FileReceiver, chunk_size: int = STREAM_CHUNK_SIZE):
+        self.file_receiver = file_receiver
+        self.chunk_size = chunk_size
+
+    def transcode(self, conn: Connection, command: List[str], payload_size: int, send_chunk: Callable[[bytes], bool]) -> Tuple[bool, int]:
+        """
+        Feed payload_size bytes from conn through command and pass every chunk of its output to
+        send_chunk. Returns (success, bytes of output sent). A False from send_chunk aborts the encode.
+        """
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            logger.error("FFMPEG command not found. Please ensure FFMPEG is installed and in your PATH.")
+            return False, 0
+
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        received = [0]
+        # Tells the feeder to stop reading the socket, which the caller needs back once transcode() returns
+        stop = threading.Event()
+        stderr_thread = threading.Thread(target=self._drain_stderr, args=(process, stderr_tail), daemon=True)
+        feeder = threading.Thread(target=self._feed_stdin, args=(conn, process, payload_size, received, stop), daemon=True)
+        stderr_thread.start()
+        feeder.start()
+
+        sent = 0
+        delivered = True
+        stdout_fd = process.stdout.fileno()
+        try:
+            while True:
+                chunk = os.read(stdout_fd, self.chunk_size)
+                if not chunk:
+                    break
+                if not send_chunk(chunk):
+                    logger.error(f"Client {conn.address} stopped receiving the stream. Aborting the encode.")
+                    delivered = False
+                    break
+                sent += len(chunk)
+        finally:
+            if not delivered:
+                stop.set()
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+            stderr_thread.join()
+            feeder.join()
+
+        if received[0] != payload_size:
+            logger.error(f"Streaming upload from {conn.address} ended after {max(received[0], 0)} of {payload_size} bytes")
+        elif returncode != 0:
+            logger.error(f"FFMPEG failed to transcode the stream (exit code {returncode}).")
+            logger.error(f"Command: {' '.join(command)}")
+            logger.error(f"Stderr: {''.join(stderr_tail)}")
+        return delivered and received[0] == payload_size and returncode == 0, sent
+
+    def _feed_stdin(self, conn: Connection, process: subprocess.Popen, payload_size: int, received: list, stop: threading.Event):
+        try:
+            received[0] = self.file_receiver.receive_to_pipe(conn, process.stdin.fileno(), payload_size, stop)
+        except Exception as e:
+            logger.error(f"Error forwarding the upload to FFMPEG: {e}")
+            received[0] = -1
+        finally:
+            # EOF tells ffmpeg the input is complete
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _drain_stderr(process: subprocess.Popen, stderr_tail: deque):
+        for line in iter(process.stderr.readline, b''):
+            stderr_tail.append(line.decode('utf-8', errors='replace'))
+        process.stderr.close()
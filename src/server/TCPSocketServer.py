@@ -5,6 +5,8 @@ It handles socket creation, connection acceptance, and data transmission with pr
 Classes:
     Connection: Manages an individual client connection, providing methods for sending and receiving data.
     TCPSocketServer: Implements a TCP server that listens for and accepts client connections.
+        Every accepted connection is served on its own daemon thread; see
+        AsyncTCPSocketServer for the event-loop based alternative.
 Example:
     server = TCPSocketServer()
     if server.listen(8080):
@@ -31,28 +33,34 @@ logging.basicConfig(
 logger = logging.getLogger('TCPSocketServer')
 
 
+DEFAULT_BACKLOG = 128
+
+
 class TCPSocketServer:
-    def __init__(self, host: str, port: int, handler_factory: Callable, connection_manager: ConnectionManager):
+    def __init__(self, host: str, port: int, handler_factory: Callable, connection_manager: ConnectionManager, backlog: int = DEFAULT_BACKLOG):
         self.server_socket: Optional[socket.socket] = None
         self.host = host
         self.port = port
         self.handler_factory = handler_factory
         self.connection_manager = connection_manager
+        self.backlog = backlog
 
     def start(self):
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind(self.host, self.port)
-            self.server_socket.listen(5)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
             logger.info(f"Server started and listening on {self.host}:{self.port}")
 
             while True:
                 client_socket, client_address = self.server_socket.accept()
                 ip_address = client_address[0]
 
-                if self.connection_manager.add_connection(ip_address):
+                refusal = self.connection_manager.admit(ip_address)
+                if refusal is None:
                     logger.info(f"Accepted connection from {client_address}")
+                    Connection.prepare_socket(client_socket, client_address)
                     connection = Connection(client_socket, client_address)
                     handler_thread = threading.Thread(
                         target=self._client_handler_wrapper,
@@ -61,9 +69,9 @@ class TCPSocketServer:
                     handler_thread.daemon = True
                     handler_thread.start()
                 else:
-                    logger.warning(f"Rejected connection from {client_address} (IP already processing.)")
+                    logger.warning(f"Rejected connection from {client_address}: {refusal}")
                     try:
-                        client_socket.sendall(b"SERVER_BUSY: Your IP is already proccessing a request.")
+                        client_socket.sendall(f"SERVER_BUSY: {refusal}".encode('utf-8'))
                     finally:
                         client_socket.close()
         except KeyboardInterrupt:
@@ -78,7 +86,7 @@ class TCPSocketServer:
     def _client_handler_wrapper(self, connection: Connection, ip_address: str):
         try:
             handler = self.handler_factory(connection)
-            handler.handle_connection()
+            handler.handle_connection(connection)
         except Exception as e:
             logger.error(f"Unhandled exception in handler for {connection.address}: {e}")
         finally:
@@ -0,0 +1,211 @@
+"""
+UploadSessionManager tracks chunked, resumable uploads.
+A session preallocates the target file once; the client then sends
+offset-addressed chunks, each with its own checksum, over as many parallel
+connections as it likes. Chunks are written straight into place, so a broken
+upload only has to resend the chunks the server does not have yet, which the
+client learns from the session's received ranges. Once every chunk has
+arrived the session is committed and the file is processed like a normal
+upload. Every chunk write is bracketed by acquire_writer()/release_writer(),
+so a commit or discard never closes the file under a chunk that is still
+being written, e.g. a retry arriving on another connection. A session belongs to
+the client that opened it; RequestHandler serves its chunks, status and commit
+to that client only. Sessions that stay idle for longer than session_ttl are discarded
+together with their partial file.
+Attributes:
+    disk_writer (DiskWriter): Creates and removes the session files.
+    session_ttl (float): Seconds an idle session is kept before it is discarded.
+    cleanup_interval (float): Seconds between sweeps for idle sessions.
+Example:
+    manager = UploadSessionManager(disk_writer)
+    session = manager.open_session("mp4", total_size=100 * 1024 * 1024, chunk_size=8 * 1024 * 1024)
+    if manager.acquire_writer(session):
+        ...write the chunk at offset 0 to session.fd...
+        manager.mark_received(session, 0, 8 * 1024 * 1024)
+        manager.release_writer(session)
+    print(manager.received_ranges(session))
+"""
+
+import os
+import threading
+import time
+import uuid
+import logging
+from typing import Dict, List, Optional
+from .DiskWriter import DiskWriter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('UploadSessionManager')
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class UploadSession:
+
+    def __init__(self, session_id: str, file_path: str, fd: int, media_type: str, total_size: int, chunk_size: int,
+                 client_id: Optional[str] = None):
+        self.session_id = session_id
+        self.file_path = file_path
+        self.fd = fd
+        self.media_type = media_type
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+        # The client that opened the session, the only one allowed to use it
+        self.client_id = client_id
+        self.chunk_count = max(1, -(-total_size // chunk_size))
+        self.received_chunks = set()
+        self.last_activity = time.monotonic()
+        # Chunk writes in flight; the file is closed only once none is left
+        self.writers = 0
+        # Set by discard() while writers were in flight; the last of them removes the file
+        self.discarded = False
+
+    def expected_size(self, offset: int) -> int:
+        return min(self.chunk_size, self.total_size - offset)
+
+    def is_complete(self) -> bool:
+        return len(self.received_chunks) == self.chunk_count
+
+
+class UploadSessionManager:
+
+    def __init__(self, disk_writer: DiskWriter, session_ttl: float = 24 * 3600, cleanup_interval: float = 300):
+        self.disk_writer = disk_writer
+        self.session_ttl = session_ttl
+        self.cleanup_interval = cleanup_interval
+
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+        # Notified when the last writer of a session is released
+        self._writers_done = threading.Condition(self._lock)
+
+        cleaner = threading.Thread(target=self._cleanup_loop, name="UploadSessionCleaner", daemon=True)
+        cleaner.start()
+
+    @staticmethod
+    def is_valid_session(total_size: int, chunk_size: int) -> bool:
+        return total_size > 0 and 0 < chunk_size <= MAX_CHUNK_SIZE
+
+    def open_session(self, media_type: str, total_size: int, chunk_size: int = DEFAULT_CHUNK_SIZE, client_id: Optional[str] = None,
+                     reserved: bool = False) -> Optional[UploadSession]:
+        """Create the session and its file. reserved is passed on to DiskWriter.create_file()."""
+        if not self.is_valid_session(total_size, chunk_size):
+            logger.error(f"Invalid upload session parameters: total_size={total_size}, chunk_size={chunk_size}")
+            return None
+
+        session_id = str(uuid.uuid4())
+        created = self.disk_writer.create_file(f"{session_id}.{media_type}", total_size, client_id, reserved)
+        if not created:
+            return None
+        file_path, fd = created
+
+        session = UploadSession(session_id, file_path, fd, media_type, total_size, chunk_size, client_id)
+        with self._lock:
+            self._sessions[session_id] = session
+        logger.info(f"Opened upload session {session_id}: {total_size} bytes in {session.chunk_count} chunks of {chunk_size}")
+        return session
+
+    def get(self, session_id: str) -> Optional[UploadSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session:
+                session.last_activity = time.monotonic()
+            return session
+
+    def is_valid_chunk(self, session: UploadSession, offset: int, size: int) -> bool:
+        return (0 <= offset < session.total_size
+                and offset % session.chunk_size == 0
+                and size == session.expected_size(offset))
+
+    def acquire_writer(self, session: UploadSession) -> bool:
+        """Register a chunk write to session.fd. False if the session was committed or discarded meanwhile."""
+        with self._lock:
+            if self._sessions.get(session.session_id) is not session:
+                return False
+            session.writers += 1
+            return True
+
+    def release_writer(self, session: UploadSession):
+        with self._lock:
+            session.writers -= 1
+            if session.writers:
+                return
+            self._writers_done.notify_all()
+            if not session.discarded:
+                return
+        self._remove(session)
+
+    def mark_received(self, session: UploadSession, offset: int, size: int):
+        with self._lock:
+            session.received_chunks.add(offset // session.chunk_size)
+            session.last_activity = time.monotonic()
+
+    def received_ranges(self, session: UploadSession) -> List[List[int]]:
+        """Merged [start, end) byte ranges the server already holds."""
+        with self._lock:
+            chunks = sorted(session.received_chunks)
+
+        ranges = []
+        for index in chunks:
+            start = index * session.chunk_size
+            end = start + session.expected_size(start)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def to_dict(self, session: UploadSession) -> dict:
+        return {
+            "session_id": session.session_id,
+            "total_size": session.total_size,
+            "chunk_size": session.chunk_size,
+            "received_ranges": self.received_ranges(session),
+            "complete": session.is_complete(),
+        }
+
+    def commit(self, session: UploadSession) -> Optional[str]:
+        """Close a complete session and hand its file over to the caller."""
+        with self._lock:
+            if not session.is_complete() or self._sessions.get(session.session_id) is not session:
+                return None
+            del self._sessions[session.session_id]
+            # No new writer can start now; wait for a chunk still being rewritten, e.g. a client retry
+            while session.writers:
+                self._writers_done.wait()
+
+        try:
+            os.fsync(session.fd)
+        finally:
+            os.close(session.fd)
+        file_path = self.disk_writer.commit_file(session.file_path)
+        logger.info(f"Committed upload session {session.session_id}: {file_path}")
+        return file_path
+
+    def discard(self, session: UploadSession):
+        with self._lock:
+            if self._sessions.pop(session.session_id, None) is None:
+                return
+            if session.writers:
+                # The last writer removes the file once it is done with it
+                session.discarded = True
+                return
+        self._remove(session)
+
+    def _remove(self, session: UploadSession):
+        os.close(session.fd)
+        self.disk_writer.remove_file(session.file_path)
+        logger.info(f"Discarded upload session {session.session_id}")
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(self.cleanup_interval)
+            now = time.monotonic()
+            with self._lock:
+                idle = [s for s in self._sessions.values() if now - s.last_activity > self.session_ttl]
+            for session in idle:
+                self.discard(session)
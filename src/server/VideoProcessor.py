@@ -1,92 +1,638 @@
 import subprocess
 import logging
+import math
 import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
+from .EncoderTuner import EncoderTuner, DEFAULT_CRF
+from .ProgressTracker import ProgressTracker
+from .Metrics import Metrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('VideoProcessor')
 
+# Containers that can be written to a pipe, with the muxer options that make them streamable
+STREAM_CONTAINERS = {
+    "mp4": ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4'],
+    "webm": ['-f', 'webm'],
+}
+# VP9 quality target of compressed WebM streams; libvpx has no x264 presets, so only threads and resolution are tuned
+VP9_STREAM_CRF = 36
+STREAM_VIDEO_CODECS = {
+    "mp4": ['-vcodec', 'libx264', '-preset', 'fast'],
+    "webm": ['-vcodec', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-acodec', 'libopus'],
+}
+
+# Operations that only touch the video stream, so any ordered list of them runs as one decode and one encode
+CHAINABLE_OPERATIONS = ("compress", "resize", "change_aspect_ratio")
+
+CLIP_FORMATS = ('gif', 'webm', 'mp4')
+# Encoders used when a clip has to be re-encoded: (video options, audio options)
+CLIP_ENCODERS = {
+    "webm": (['-vcodec', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-crf', '36', '-b:v', '0'], ['-acodec', 'libopus']),
+    "mp4": (['-vcodec', 'libx264', '-preset', 'fast', '-crf', '23'], ['-acodec', 'aac']),
+}
+# Source video codecs each clip container can take by stream copy
+COPYABLE_CODECS = {
+    "webm": {"vp8", "vp9", "av1"},
+    "mp4": {"h264", "hevc", "av1", "mpeg4"},
+}
+# Source audio codecs each clip container can take by stream copy; any other audio is re-encoded
+COPYABLE_AUDIO_CODECS = {
+    "webm": {"opus", "vorbis"},
+    "mp4": {"aac", "mp3", "alac", "ac3", "eac3"},
+}
+# Encoders matching the source codec, for the boundary GOPs of a smart-rendered clip
+SMART_RENDER_ENCODERS = {
+    "h264": ['-vcodec', 'libx264', '-preset', 'fast', '-crf', '18'],
+    "hevc": ['-vcodec', 'libx265', '-preset', 'fast', '-crf', '20'],
+    "vp9": ['-vcodec', 'libvpx-vp9', '-deadline', 'good', '-crf', '30', '-b:v', '0'],
+    "vp8": ['-vcodec', 'libvpx', '-crf', '10', '-b:v', '2M'],
+}
+# Seconds a keyframe may be off the requested cut point and still count as on it
+KEYFRAME_TOLERANCE = 0.01
+
+# Settings of a compress job when no EncoderTuner is configured
+DEFAULT_ENCODE_SETTINGS = {"preset": "fast", "crf": DEFAULT_CRF, "threads": None, "max_height": None}
+
+# Compressing in parallel segments only pays off when every segment gets at least this much video
+MIN_SEGMENT_SECONDS = 30
+
+# Lines of ffmpeg's stderr kept for the error log
+STDERR_TAIL_LINES = 20
+
+# Outputs remembered as downscaled by the encoder tuner; older entries are forgotten, e.g. of async jobs nobody asks about
+MAX_DOWNSCALED_OUTPUTS = 1024
+
 class VideoProcessor:
-    def __init__(self, output_dir="processed"):
+    def __init__(self, output_dir="processed", max_segments: Optional[int] = None, encoder_tuner: Optional[EncoderTuner] = None,
+                 metrics: Optional[Metrics] = None):
         self.output_dir = output_dir
+        # Optional wall clock and CPU time of every ffmpeg run, by action
+        self.metrics = metrics
+        # Picks preset, threads and resolution cap of compress jobs from their deadline and the load
+        self.encoder_tuner = encoder_tuner
+        # Upper bound of segments encoded in parallel, by one compress job and by all of them together
+        self.max_segments = max_segments or os.cpu_count() or 1
+        self._segment_slots = threading.BoundedSemaphore(self.max_segments)
+        self._ffmpeg_version = None
+        # Outputs the tuner scaled down to meet a deadline; they do not answer the same request without one
+        self._downscaled: "OrderedDict[str, None]" = OrderedDict()
+        self._downscaled_lock = threading.Lock()
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+
+    def get_ffmpeg_version(self) -> str:
+        if self._ffmpeg_version is None:
+            try:
+                result = subprocess.run(['ffmpeg', '-version'], check=True, capture_output=True, text=True)
+                self._ffmpeg_version = result.stdout.splitlines()[0] if result.stdout else "unknown"
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                logger.error("Could not determine the FFMPEG version. Please ensure FFMPEG is installed and in your PATH.")
+                self._ffmpeg_version = "unknown"
+        return self._ffmpeg_version
     
-    def process(self, input_path: str, options: dict) -> str:
+    def process(self, input_path: str, options: dict, media_info: Optional[dict] = None,
+                progress: Optional[Callable[[dict], None]] = None) -> Union[str, List[str], None]:
+        """
+        Run the requested operation(s) on input_path. media_info, if given, holds MediaProber
+        results for the input (duration, codecs, ...) so they do not have to be probed again.
+        progress, if given, is called with ProgressTracker reports while ffmpeg runs.
+        """
+        media_info = media_info or {}
+        tracker = ProgressTracker(progress, media_info.get("duration")) if progress else None
         operation = options.get("operation")
         output_path = os.path.join(self.output_dir, f"processed_{os.path.basename(input_path)}")
 
+        outputs = options.get("outputs")
+        if outputs:
+            return self._process_outputs(input_path, outputs, options, media_info, tracker)
+
+        steps = options.get("operations")
+        if steps:
+            return self._process_chain(input_path, output_path, steps, options, media_info, tracker)
+
         if operation == "compress":
-            return self._compress_video(input_path, output_path)
+            return self._compress_video(input_path, output_path, options=options, media_info=media_info, tracker=tracker)
         elif operation == "resize":
             width = options.get("width")
             height = options.get("height")
-            return self._resize_video(input_path, output_path, width, height)
+            return self._resize_video(input_path, output_path, width, height, tracker)
         elif operation == "change_aspect_ratio":
             aspect_ratio = options.get("aspect_ratio")
-            return self._change_aspect_ratio(input_path, output_path, aspect_ratio)
+            return self._change_aspect_ratio(input_path, output_path, aspect_ratio, tracker)
         elif operation == "convert_to_audio":
             audio_output_path = os.path.splitext(output_path)[0] + '.mp3'
-            return self._convert_to_audio(input_path, audio_output_path)
+            return self._convert_to_audio(input_path, audio_output_path, tracker)
         elif operation == "create_clip":
             start_time = options.get("start_time")
             end_time = options.get("end_time")
             output_format = options.get("format", "gif")
-            return self._create_clip(input_path, start_time, end_time, output_format)
+            return self._create_clip(input_path, start_time, end_time, output_format, media_info, tracker)
         else:
             logger.error(f"Unknown operation: {operation}")
             return None
 
-    def _compress_video(self, input_path: str, output_path: str) -> str:
+    def was_downscaled(self, output_path: str) -> bool:
+        """
+        True if output_path came from a compress job whose resolution the encoder tuner capped
+        to meet a deadline. Such an output must not be cached under the request's options,
+        which do not say what resolution it has. Each output is reported once.
+        """
+        with self._downscaled_lock:
+            return self._downscaled.pop(output_path, False) is None
+
+    def build_stream_command(self, options: dict) -> Optional[Tuple[List[str], str]]:
+        """
+        Build an ffmpeg command that reads the input from stdin and writes the result to
+        stdout, for operations whose output can be muxed without seeking (fragmented MP4,
+        WebM, MP3). Returns (command, output media type), or None if the request cannot
+        be streamed. The input has to be streamable as well, e.g. a faststart MP4,
+        Matroska/WebM or MPEG-TS.
+        """
+        steps = options.get("operations") or [options]
+        if len(steps) == 1 and steps[0].get("operation") == "convert_to_audio":
+            return ['ffmpeg', '-hide_banner', '-i', 'pipe:0', '-vn', '-acodec', 'libmp3lame', '-q:a', '2', '-f', 'mp3', 'pipe:1'], 'mp3'
+
+        output_format = options.get("format", "mp4")
+        if output_format not in STREAM_CONTAINERS:
+            logger.error(f"Unsupported streaming format: {output_format}. Supported formats are {', '.join(STREAM_CONTAINERS)}.")
+            return None
+
+        compiled = self._compile_steps(steps)
+        if not compiled:
+            return None
+        filters, aspect_ratio, compress = compiled
+        # The stream is not probed, so the tuner goes by priority and load alone
+        settings = self._encode_settings(None, None, options) if compress else None
+        if not compress:
+            codec_args = STREAM_VIDEO_CODECS[output_format]
+        elif output_format == "mp4":
+            codec_args = self._x264_args(settings)
+        else:
+            codec_args = [*STREAM_VIDEO_CODECS[output_format], '-crf', str(VP9_STREAM_CRF), '-b:v', '0']
+
+        command = ['ffmpeg', '-hide_banner', '-i', 'pipe:0',
+                   *codec_args, *self._chain_args(filters, aspect_ratio, settings), *STREAM_CONTAINERS[output_format], 'pipe:1']
+        return command, output_format
+
+    def _chain_args(self, filters: List[str], aspect_ratio: Optional[str], settings: Optional[dict] = None) -> List[str]:
+        """
+        Output options of a compiled operation chain: resizes become one -vf filter chain in the
+        given order and the last aspect ratio wins. settings, given for a chain with a compress
+        step, add the tuned thread count and resolution cap to the same filter chain.
+        """
+        if settings:
+            args = self._tuning_args(settings, settings["threads"], filters)
+        else:
+            args = ['-vf', ','.join(filters)] if filters else []
+        if aspect_ratio:
+            args += ['-aspect', aspect_ratio]
+        return args
+
+    def _compile_steps(self, steps: list) -> Optional[Tuple[List[str], Optional[str], bool]]:
+        # Returns (video filters in order, final aspect ratio, compress)
+        filters = []
+        aspect_ratio = None
+        compress = False
+
+        for step in steps:
+            operation = step.get("operation") if isinstance(step, dict) else None
+            if operation == "compress":
+                compress = True
+            elif operation == "resize":
+                width = step.get("width")
+                height = step.get("height")
+                if not width or not height:
+                    logger.error("Resize operation requires 'width' and 'height' options.")
+                    return None
+                filters.append(f'scale={width}:{height}')
+            elif operation == "change_aspect_ratio":
+                aspect_ratio = step.get("aspect_ratio")
+                if not aspect_ratio:
+                    logger.error("Change aspect ratio operation requires 'aspect_ratio' option.")
+                    return None
+            else:
+                logger.error(f"Operation cannot be chained: {operation}. Chainable operations are {', '.join(CHAINABLE_OPERATIONS)}.")
+                return None
+        return filters, aspect_ratio, compress
+
+    def _process_chain(self, input_path: str, output_path: str, steps: list, options: Optional[dict] = None, media_info: Optional[dict] = None,
+                       tracker: Optional[ProgressTracker] = None) -> Optional[str]:
+        if not isinstance(steps, list):
+            logger.error("The 'operations' option must be a list of operations.")
+            return None
+
+        compiled = self._compile_steps(steps)
+        if not compiled:
+            return None
+        filters, aspect_ratio, compress = compiled
+        if compress and not filters and not aspect_ratio:
+            # Nothing but compression: keep the segment-parallel path
+            return self._compress_video(input_path, output_path, options=options, media_info=media_info, tracker=tracker)
+
+        settings = self._job_settings(input_path, options, media_info) if compress else None
+        logger.info(f"Running {len(steps)} chained operations on {input_path} in one pass...")
+        command = [
+            'ffmpeg',
+            '-y',
+            '-i', input_path,
+            *(self._x264_args(settings) if settings else []),
+            *self._chain_args(filters, aspect_ratio, settings),
+            output_path
+        ]
+        if not self._run_ffmpeg(command, "run the chained operations", tracker):
+            return None
+        logger.info(f"Chained operations finished successfully: {output_path}")
+        return self._note_resolution_cap(output_path, settings) if settings else output_path
+
+    def _process_outputs(self, input_path: str, outputs: list, options: Optional[dict] = None, media_info: Optional[dict] = None,
+                         tracker: Optional[ProgressTracker] = None) -> Optional[List[str]]:
+        """
+        Produce several outputs from a single decode. The video stream is split once in a
+        filtergraph and every branch is filtered and encoded for its own output: an operation
+        chain (same container as the input), a GIF, WebM or MP4 clip, or the MP3 audio track.
+        Returns the output paths in the order requested, or None if anything fails.
+        """
+        if not isinstance(outputs, list) or not all(isinstance(item, dict) for item in outputs):
+            logger.error("The 'outputs' option must be a list of operations.")
+            return None
+
+        base_name, ext = os.path.splitext(os.path.basename(input_path))
+        video_outputs = [item for item in outputs if item.get("operation") != "convert_to_audio"]
+        branches = [f'[v{i}]' for i in range(len(video_outputs))]
+        filter_parts = [f"[0:v]split={len(branches)}{''.join(branches)}"] if len(branches) > 1 else []
+        if len(branches) == 1:
+            filter_parts.append('[0:v]null[v0]')
+
+        output_args = []
+        output_paths = []
+        branch = 0
+        # All compressed outputs come from one job, so they share its settings and split its thread budget
+        compressed = [item for item in video_outputs if any(isinstance(step, dict) and step.get("operation") == "compress"
+                                                            for step in item.get("operations") or [item])]
+        settings = self._job_settings(input_path, options, media_info) if compressed else None
+        threads = max(1, settings["threads"] // len(compressed)) if settings and settings["threads"] else None
+        for index, item in enumerate(outputs):
+            operation = item.get("operation")
+            if operation == "convert_to_audio":
+                output_path = os.path.join(self.output_dir, f"processed_{base_name}_{index}.mp3")
+                output_args += ['-map', '0:a', '-vn', '-acodec', 'libmp3lame', '-q:a', '2', output_path]
+                output_paths.append(output_path)
+                continue
+
+            label = f'[v{branch}]'
+            out_label = f'[o{branch}]'
+            if operation == "create_clip":
+                output_format = item.get("format", "gif")
+                start = self._parse_time(item.get("start_time"))
+                end = self._parse_time(item.get("end_time"))
+                if start is None or end is None or output_format not in CLIP_FORMATS:
+                    logger.error(f"Clip outputs require 'start_time', 'end_time' and a 'format' of {', '.join(CLIP_FORMATS)}.")
+                    return None
+                trim = f'trim=start={start}:end={end},setpts=PTS-STARTPTS'
+                output_path = os.path.join(self.output_dir, f"clip_{base_name}_{index}.{output_format}")
+                if output_format == 'gif':
+                    filter_parts.append(f'{label}{trim},fps=10,scale=320:-1:flags=lanczos,split[g{branch}][h{branch}];'
+                                        f'[g{branch}]palettegen[p{branch}];[h{branch}][p{branch}]paletteuse{out_label}')
+                    output_args += ['-map', out_label, output_path]
+                else:
+                    # The trim applies to the video branch only, so clips in a multi-output run carry no audio
+                    video_codec, _ = CLIP_ENCODERS[output_format]
+                    filter_parts.append(f'{label}{trim}{out_label}')
+                    output_args += ['-map', out_label, '-an', *video_codec, output_path]
+            else:
+                compiled = self._compile_steps(item.get("operations") or [item])
+                if not compiled:
+                    return None
+                filters, aspect_ratio, compress = compiled
+                if compress:
+                    filters = filters + self._cap_filters(settings)
+                filter_parts.append(f"{label}{','.join(filters) or 'null'}{out_label}")
+                output_path = os.path.join(self.output_dir, f"processed_{base_name}_{index}{ext}")
+                output_args += ['-map', out_label, '-map', '0:a?',
+                                *(['-aspect', aspect_ratio] if aspect_ratio else []),
+                                *(self._x264_args(settings) + (['-threads', str(threads)] if threads else []) if compress else []),
+                                output_path]
+            output_paths.append(output_path)
+            branch += 1
+
+        logger.info(f"Producing {len(output_paths)} outputs from {input_path} in one pass...")
+        command = ['ffmpeg', '-y', '-i', input_path]
+        if filter_parts:
+            command += ['-filter_complex', ';'.join(filter_parts)]
+        command += output_args
+
+        if not self._run_ffmpeg(command, "produce the requested outputs", tracker):
+            for output_path in output_paths:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+            return None
+        logger.info(f"Outputs created successfully: {', '.join(output_paths)}")
+        return output_paths
+
+    @staticmethod
+    def _parse_time(value) -> Optional[float]:
+        # Accepts seconds or an ffmpeg style [HH:]MM:SS[.ms] timestamp
+        if value is None:
+            return None
+        try:
+            seconds = 0.0
+            for part in str(value).split(':'):
+                seconds = seconds * 60 + float(part)
+            return seconds
+        except ValueError:
+            logger.error(f"Invalid time value: {value}")
+            return None
+
+    def _compress_video(self, input_path: str, output_path: str, allow_segments: bool = True,
+                        options: Optional[dict] = None, media_info: Optional[dict] = None,
+                        tracker: Optional[ProgressTracker] = None) -> str:
+        media_info = media_info or {}
+        duration = media_info.get("duration")
+        if not duration and (self.encoder_tuner or tracker or (allow_segments and self.max_segments > 1)):
+            duration = self._probe_duration(input_path)
+        if tracker and duration:
+            tracker.duration = duration
+        settings = self._encode_settings(duration, media_info.get("height"), options or {})
+
+        if allow_segments:
+            segments = self._reserve_segments(self._segment_count(duration, settings["threads"]))
+            try:
+                compressed = self._compress_segmented(input_path, output_path, duration, segments, settings, media_info, tracker) if segments > 1 else None
+            finally:
+                for _ in range(segments):
+                    self._segment_slots.release()
+            if compressed:
+                return self._note_resolution_cap(compressed, settings)
+            if segments > 1:
+                # The slots are free again, so other jobs can segment while this one encodes in a single pass
+                return self._compress_single(input_path, output_path, options, media_info, tracker)
+
         logger.info(f"Compressing {input_path} to {output_path}...") 
         command = [
             'ffmpeg',
+            '-y',
             '-i', input_path,
-            '-vcodec', 'libx264',
-            '-crf', '28',
-            '-preset', 'fast',
+            *self._x264_args(settings),
+            *self._tuning_args(settings, settings["threads"]),
             output_path
         ]
 
+        started = time.monotonic()
+        if not self._run_ffmpeg(command, "compress video", tracker):
+            return None
+        self._record_speed(media_info, settings, duration, started)
+        logger.info(f"Video compressed successfully: {output_path}")
+        return self._note_resolution_cap(output_path, settings)
+
+    def _note_resolution_cap(self, output_path: Optional[str], settings: dict) -> Optional[str]:
+        if output_path and settings.get("max_height"):
+            with self._downscaled_lock:
+                self._downscaled[output_path] = None
+                while len(self._downscaled) > MAX_DOWNSCALED_OUTPUTS:
+                    self._downscaled.popitem(last=False)
+        return output_path
+    
+    def _encode_settings(self, duration: Optional[float], height: Optional[int], options: dict) -> dict:
+        if self.encoder_tuner:
+            return self.encoder_tuner.select(duration, height, options)
+        return dict(DEFAULT_ENCODE_SETTINGS)
+
+    def _record_speed(self, media_info: dict, settings: dict, duration: Optional[float], started: float):
+        if self.encoder_tuner:
+            self.encoder_tuner.record(media_info.get("height"), settings["preset"], duration, time.monotonic() - started)
+
+    def _job_settings(self, input_path: str, options: Optional[dict], media_info: Optional[dict]) -> dict:
+        # Settings of a compress job that does not go through _compress_video()
+        media_info = media_info or {}
+        duration = media_info.get("duration")
+        if not duration and self.encoder_tuner:
+            duration = self._probe_duration(input_path)
+        return self._encode_settings(duration, media_info.get("height"), options or {})
+
+    @staticmethod
+    def _x264_args(settings: dict) -> List[str]:
+        return ['-vcodec', 'libx264', '-crf', str(settings["crf"]), '-preset', settings["preset"]]
+
+    @classmethod
+    def _tuning_args(cls, settings: dict, threads: Optional[int], filters: Optional[List[str]] = None) -> List[str]:
+        # filters, if given, are the output's own video filters; the resolution cap joins their chain
+        args = []
+        if threads:
+            args += ['-threads', str(threads)]
+        filters = list(filters or []) + cls._cap_filters(settings)
+        if filters:
+            args += ['-vf', ','.join(filters)]
+        return args
+
+    @staticmethod
+    def _cap_filters(settings: dict) -> List[str]:
+        # Never upscale; -2 keeps the width even as x264 requires
+        return [f"scale=-2:'min(ih,{settings['max_height']})'"] if settings.get("max_height") else []
+
+    def _segment_count(self, duration: Optional[float], thread_budget: Optional[int] = None) -> int:
+        # One segment per core of the job's budget, but never so many that segments get shorter than MIN_SEGMENT_SECONDS
+        if not duration:
+            return 1
+        return max(1, min(self.max_segments, thread_budget or self.max_segments, int(duration // MIN_SEGMENT_SECONDS)))
+
+    def _reserve_segments(self, wanted: int) -> int:
+        # Concurrent jobs share the segment slots, so together they never start more encodes than max_segments;
+        # a job takes the slots that are free instead of waiting for more. The caller releases what it got
+        reserved = 0
+        while reserved < wanted and self._segment_slots.acquire(blocking=False):
+            reserved += 1
+        return reserved
+
+    def _probe_duration(self, input_path: str) -> Optional[float]:
+        command = [
+            'ffprobe',
+            '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            input_path
+        ]
         try:
             result = subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"FFMPEG output: {result.stdout}")
-            logger.info(f"Video compressed successfully: {output_path}")
-            return output_path
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFMPEG failed to compress video.")
-            logger.error(f"Command: {' '.join(command)}")
-            logger.error(f"Stderr: {e.stderr}")
+            return float(result.stdout.strip())
+        except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+            logger.warning(f"Could not determine the duration of {input_path}: {getattr(e, 'stderr', e)}")
             return None
+
+    def _compress_segmented(self, input_path: str, output_path: str, duration: float, segments: int, settings: dict,
+                            media_info: Optional[dict] = None, tracker: Optional[ProgressTracker] = None) -> Optional[str]:
+        """
+        Split the input at keyframes with stream copy, encode the video of every segment in its
+        own ffmpeg process, then join the segments losslessly with the concat demuxer and mux
+        the original audio back in. Returns None if any step fails; the caller then releases
+        the segment slots and falls back to a single encode.
+        """
+        logger.info(f"Compressing {input_path} to {output_path} in {segments} parallel segments...")
+        ext = os.path.splitext(input_path)[1]
+        work_dir = tempfile.mkdtemp(prefix="segments_", dir=self.output_dir)
+        try:
+            split_command = [
+                'ffmpeg',
+                '-y',
+                '-i', input_path,
+                '-map', '0:v:0',
+                '-c', 'copy',
+                '-f', 'segment',
+                '-segment_time', f'{duration / segments:.3f}',
+                '-reset_timestamps', '1',
+                os.path.join(work_dir, f'part_%03d{ext}')
+            ]
+            if not self._run_ffmpeg(split_command, "split the video into segments"):
+                return None
+
+            parts = sorted(name for name in os.listdir(work_dir) if name.startswith('part_'))
+            threads_per_segment = max(1, (settings["threads"] or os.cpu_count() or 1) // min(len(parts), segments))
+            encode_commands = [[
+                'ffmpeg',
+                '-y',
+                '-i', os.path.join(work_dir, part),
+                *self._x264_args(settings),
+                *self._tuning_args(settings, threads_per_segment),
+                os.path.join(work_dir, f'encoded_{part}')
+            ] for part in parts]
+
+            started = time.monotonic()
+
+            # The split may cut more parts than slots were reserved; the extra ones wait for a free encoder
+            with ThreadPoolExecutor(max_workers=min(len(parts), segments)) as executor:
+                # Every segment reports as its own part, so the progress is the sum of the encoded time
+                results = list(executor.map(lambda indexed: self._run_ffmpeg(indexed[1], "encode a segment", tracker, indexed[0]),
+                                            enumerate(encode_commands)))
+            if not all(results):
+                return None
+            self._record_speed(media_info or {}, settings, duration, started)
+
+            list_path = os.path.join(work_dir, 'segments.txt')
+            with open(list_path, 'w') as f:
+                for part in parts:
+                    f.write(f"file '{os.path.abspath(os.path.join(work_dir, f'encoded_{part}'))}'\n")
+
+            concat_command = [
+                'ffmpeg',
+                '-y',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', list_path,
+                '-i', input_path,
+                '-map', '0:v',
+                '-map', '1:a?',
+                '-c', 'copy',
+                output_path
+            ]
+            if not self._run_ffmpeg(concat_command, "join the encoded segments"):
+                return None
+
+            logger.info(f"Video compressed successfully in {len(parts)} segments: {output_path}")
+            return output_path
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _compress_single(self, input_path: str, output_path: str, options: Optional[dict] = None, media_info: Optional[dict] = None,
+                         tracker: Optional[ProgressTracker] = None) -> Optional[str]:
+        logger.warning(f"Segmented compression failed for {input_path}. Falling back to a single encode.")
+        if tracker:
+            tracker.reset()
+        return self._compress_video(input_path, output_path, allow_segments=False, options=options, media_info=media_info, tracker=tracker)
+
+    def _run_ffmpeg(self, command: List[str], action: str, tracker: Optional[ProgressTracker] = None, part: int = 0) -> bool:
+        """
+        Run an ffmpeg command. With a tracker, ffmpeg writes its progress blocks to stdout, which
+        are parsed line by line as they arrive. stderr is drained on a separate thread and only
+        its last lines are kept for the error log, however much ffmpeg writes.
+        """
+        if tracker:
+            command = [command[0], '-progress', 'pipe:1', '-nostats', *command[1:]]
+        started = time.monotonic()
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE if tracker else subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True, errors='replace')
         except FileNotFoundError:
             logger.error("FFMPEG command not found. Please ensure FFMPEG is installed and in your PATH.")
-            return None
-    
-    def _resize_video(self, input_path: str, output_path: str, width: int, height: int) -> str:
+            return False
+
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        stderr_thread = threading.Thread(target=self._drain_stderr, args=(process, stderr_tail), daemon=True)
+        stderr_thread.start()
+
+        if tracker:
+            report = tracker.part(part)
+            block = {}
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                block[key] = value
+                # "progress" is the last key of every block
+                if key == 'progress':
+                    report(block)
+                    block = {}
+            process.stdout.close()
+
+        returncode, cpu_seconds = self._wait(process)
+        stderr_thread.join()
+        if self.metrics:
+            self.metrics.ffmpeg_wall_seconds.observe(time.monotonic() - started, action)
+            if cpu_seconds is not None:
+                self.metrics.ffmpeg_cpu_seconds.observe(cpu_seconds, action)
+            if returncode != 0:
+                self.metrics.ffmpeg_failures.inc(1, action)
+        if returncode != 0:
+            logger.error(f"FFMPEG failed to {action}.")
+            logger.error(f"Command: {' '.join(command)}")
+            logger.error(f"Stderr: {''.join(stderr_tail)}")
+            return False
+        return True
+
+    @staticmethod
+    def _wait(process: subprocess.Popen) -> Tuple[int, Optional[float]]:
+        """
+        Wait for process to exit. Returns its exit code and the user + system CPU seconds it used,
+        which os.wait4 reports for exactly this child (RUSAGE_CHILDREN would mix in every ffmpeg
+        running concurrently); None where wait4 is not available.
+        """
+        if not hasattr(os, 'wait4'):
+            return process.wait(), None
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            return process.wait(), None
+        # Popen must not wait for the reaped child again
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, usage.ru_utime + usage.ru_stime
+
+    @staticmethod
+    def _drain_stderr(process: subprocess.Popen, stderr_tail: deque):
+        for line in process.stderr:
+            stderr_tail.append(line)
+        process.stderr.close()
+
+    def _resize_video(self, input_path: str, output_path: str, width: int, height: int, tracker: Optional[ProgressTracker] = None) -> str:
         if not width or not height:
             logger.error("Resize operation requires 'width' and 'height' options.")
             return None
         logger.info(f"Resizing {input_path} to {width}:{height}...")
         command = [
-            'ffmpg',
+            'ffmpeg',
             '-i', input_path,
             '-vf', f'scale={width}:{height}',
             output_path
         ]
 
-        try:
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"FFMPEG output: {result.stdout}")
-            logger.info(f"Video resized successfully: {output_path}")
-            return output_path
-        except subprocess.CalledProccessError as e:
-            logger.error(f"FFMPEG failed to resize video.")
-            logger.error(f"Command: {' '.join(command)}")
-            logger.error(f"Stderr: {e.stderr}")
+        if not self._run_ffmpeg(command, "resize video", tracker):
             return None
-        except FileNotFoundError:
-            logger.error("FFMPEG command not found.Please ensure FFMPEG is installed in your system's PATH.")
+        logger.info(f"Video resized successfully: {output_path}")
+        return output_path
     
-    def _change_aspect_ratio(self, input_path: str, output_path: str, aspect_ratio: str) -> str:
+    def _change_aspect_ratio(self, input_path: str, output_path: str, aspect_ratio: str, tracker: Optional[ProgressTracker] = None) -> str:
         if not aspect_ratio:
             logger.error("Change aspect ratio operation requires 'aspect_ration' option.")
             return None
@@ -99,21 +645,12 @@ class VideoProcessor:
             output_path
         ]
 
-        try:
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"FFMPEG output: {result.stdout}")
-            logger.info(f"Aspect ratio changed successfully: {output_path}")
-            return output_path
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFMPEG failed to change aspect ratio.")
-            logger.error(f"Command: {' '.join(command)}")
-            logger.error(f"Stderr: {e.stderr}")
-            return None
-        except FileNotFoundError:
-            logger.error("FFMPEG command not found. Please ensure FFMPEG is installed and in your PATH.")
+        if not self._run_ffmpeg(command, "change aspect ratio", tracker):
             return None
+        logger.info(f"Aspect ratio changed successfully: {output_path}")
+        return output_path
     
-    def _convert_to_audio(self, input_path: str, output_path: str) -> str:
+    def _convert_to_audio(self, input_path: str, output_path: str, tracker: Optional[ProgressTracker] = None) -> str:
         logger.info(f"Converting {input_path} to audio {output_path}...")
         command = [
             'ffmpeg',
@@ -124,28 +661,28 @@ class VideoProcessor:
             output_path
         ]
 
-        try:
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"FFMPEG output: {result.stdout}")
-            logger.info(f"Audio converted successfully: {output_path}")
-            return output_path
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFMPEG failed to convert video to audio.")
-            logger.error(f"Command: {' '.join(command)}")
-            logger.error(f"Stderr: {e.stderr}")
-            return None
-        except FileNotFoundError:
-            logger.error("FFMPEG command not found. Please ensure FFMPEG is installed and in your PATH.")
+        if not self._run_ffmpeg(command, "convert video to audio", tracker):
             return None
+        logger.info(f"Audio converted successfully: {output_path}")
+        return output_path
     
-    def _create_clip(self, input_path: str, start_time: str, end_time: str, output_format: str) -> str:
-        if not all[start_time, end_time, output_format]:
+    def _create_clip(self, input_path: str, start_time: str, end_time: str, output_format: str, media_info: Optional[dict] = None,
+                     tracker: Optional[ProgressTracker] = None) -> str:
+        if not all([start_time, end_time, output_format]):
             logger.error("Create clip operation requires 'start_time', 'end_time', and 'format' options.")
             return None
         
-        if output_format not in ['gif', 'webm']:
-            logger.error(f"Unsupported output format: {output_format}. Supported formats are 'gif' and 'webm'.")
+        if output_format not in CLIP_FORMATS:
+            logger.error(f"Unsupported output format: {output_format}. Supported formats are {', '.join(CLIP_FORMATS)}.")
+            return None
+
+        start = self._parse_time(start_time)
+        end = self._parse_time(end_time)
+        if start is None or end is None or end <= start:
+            logger.error(f"Invalid clip range: {start_time} to {end_time}")
             return None
+        if tracker:
+            tracker.duration = end - start
         
         base_name = os.path.basename(input_path)
         output_filename = f"clip_{os.path.splitext(base_name)[0]}.{output_format}"
@@ -153,59 +690,207 @@ class VideoProcessor:
 
         logger.info(f"Creating clip from {input_path} from {start_time} to {end_time} in {output_format} format...")
 
-        command = [
+        # -ss before -i seeks in the demuxer, so only the clip range itself is decoded
+        if output_format == 'gif':
+            command = [
+                'ffmpeg',
+                '-y',
+                '-ss', f'{start:.3f}',
+                '-t', f'{end - start:.3f}',
+                '-i', input_path,
+                '-filter_complex', 'fps=10,scale=320:-1:flags=lanczos,split[x][y];[x]palettegen[p];[y][p]paletteuse',
+                output_path
+            ]
+        else:
+            command = self._build_video_clip_command(input_path, output_path, start, end, output_format, media_info, tracker)
+            if command is None:
+                # Stream copy or smart render produced the clip already
+                return output_path if os.path.exists(output_path) else None
+
+        if not self._run_ffmpeg(command, "create clip", tracker):
+            return None
+        logger.info(f"Clip created successfully: {output_path}")
+        return output_path
+
+    def _build_video_clip_command(self, input_path: str, output_path: str, start: float, end: float, output_format: str,
+                                  media_info: Optional[dict] = None, tracker: Optional[ProgressTracker] = None) -> Optional[List[str]]:
+        """
+        Pick the cheapest way to cut an mp4/webm clip exactly: stream copy when it starts on a
+        keyframe, smart render when the source codec can be re-encoded for the boundary GOPs,
+        and a full re-encode of the range otherwise, which is also the fallback when either of
+        the others fails. Returns the ffmpeg command to run, or None after stream copy or smart
+        render has already written output_path.
+        """
+        media_info = media_info or {}
+        codec = media_info.get("video_codec") or self._probe_codec(input_path, 'v:0')
+        copyable = codec in COPYABLE_CODECS[output_format]
+        keyframes = self._probe_keyframes(input_path, start, end) if copyable else []
+
+        # The end needs no keyframe for stream copy: the last copied GOP still starts with one
+        if any(abs(keyframe - start) <= KEYFRAME_TOLERANCE for keyframe in keyframes):
+            # A probed input without an audio codec has no audio stream
+            audio = media_info.get("audio_codec") if media_info.get("video_codec") else self._probe_codec(input_path, 'a:0')
+            if audio is None or audio in COPYABLE_AUDIO_CODECS[output_format]:
+                logger.info("Clip starts on a keyframe. Using stream copy.")
+                audio_args = ['-c:a', 'copy']
+            else:
+                logger.info(f"Clip starts on a keyframe. Copying the video and re-encoding the {audio} audio for {output_format}.")
+                _, audio_args = CLIP_ENCODERS[output_format]
+            copy_command = [
+                'ffmpeg',
+                '-y',
+                '-ss', f'{start:.3f}',
+                '-t', f'{end - start:.3f}',
+                '-i', input_path,
+                '-map', '0:v:0',
+                '-map', '0:a?',
+                '-c:v', 'copy',
+                *audio_args,
+                '-avoid_negative_ts', 'make_zero',
+                output_path
+            ]
+            if self._run_ffmpeg(copy_command, "copy a clip", tracker):
+                return None
+            logger.warning(f"Stream copy failed for {input_path}. Re-encoding the whole clip.")
+            if tracker:
+                tracker.reset()
+            return self._reencode_clip_command(input_path, output_path, start, end, output_format)
+
+        if codec in SMART_RENDER_ENCODERS and any(start < keyframe < end for keyframe in keyframes):
+            if self._smart_render_clip(input_path, output_path, start, end, output_format, codec, keyframes, tracker):
+                return None
+            logger.warning(f"Smart render failed for {input_path}. Re-encoding the whole clip.")
+            if tracker:
+                tracker.reset()
+
+        return self._reencode_clip_command(input_path, output_path, start, end, output_format)
+
+    @staticmethod
+    def _reencode_clip_command(input_path: str, output_path: str, start: float, end: float, output_format: str) -> List[str]:
+        video_codec, audio_codec = CLIP_ENCODERS[output_format]
+        return [
             'ffmpeg',
+            '-y',
+            '-ss', f'{start:.3f}',
+            '-t', f'{end - start:.3f}',
             '-i', input_path,
-            '-ss', start_time,
-            '-to', end_time,
-            '-c:v', 'copy',
-            '-c:a', 'copy',
+            *video_codec,
+            *audio_codec,
             output_path
         ]
 
-        if output_format == 'gif':
-            palette_path = os.path.join(self.output_dir, "palette.png")
-            palette_command = [
+    def _smart_render_clip(self, input_path: str, output_path: str, start: float, end: float, output_format: str,
+                           codec: str, keyframes: List[float], tracker: Optional[ProgressTracker] = None) -> bool:
+        """
+        Frame-accurate clip that re-encodes only the partial GOPs at both ends: [start, first
+        keyframe) and [last keyframe, end) are encoded with the source codec, the GOPs in between
+        are stream-copied, and the pieces are joined with the concat demuxer. The audio of the
+        range is encoded separately and muxed in, so the cost no longer grows with clip length.
+        """
+        first_keyframe = min(k for k in keyframes if k > start)
+        last_keyframe = max(k for k in keyframes if k < end)
+        # MPEG-TS repeats H.264/HEVC parameter sets in-band, so pieces with different encoder settings still join
+        ext = '.ts' if codec in ('h264', 'hevc') else '.mkv'
+        work_dir = tempfile.mkdtemp(prefix="clip_", dir=self.output_dir)
+
+        def piece_command(piece_start: float, piece_end: float, codec_args: List[str], piece_path: str) -> List[str]:
+            return [
                 'ffmpeg',
                 '-y',
+                '-ss', f'{piece_start:.3f}',
+                '-t', f'{piece_end - piece_start:.3f}',
                 '-i', input_path,
-                '-ss', start_time,
-                '-to', end_time,
-                '-vf', 'fps=10,scale=320:-1:flags=lanczos,palettegen',
-                palette_path
+                '-map', '0:v:0',
+                '-an',
+                *codec_args,
+                piece_path
             ]
 
-            command = [
+        try:
+            pieces = [
+                (start, first_keyframe, SMART_RENDER_ENCODERS[codec]),
+                (first_keyframe, last_keyframe, ['-c', 'copy']),
+                (last_keyframe, end, SMART_RENDER_ENCODERS[codec]),
+            ]
+            piece_paths = []
+            for index, (piece_start, piece_end, codec_args) in enumerate(pieces):
+                if piece_end - piece_start <= KEYFRAME_TOLERANCE:
+                    continue
+                piece_path = os.path.join(work_dir, f'piece_{index}{ext}')
+                if not self._run_ffmpeg(piece_command(piece_start, piece_end, codec_args, piece_path), "render a clip piece", tracker, index):
+                    return False
+                piece_paths.append(piece_path)
+
+            list_path = os.path.join(work_dir, 'pieces.txt')
+            with open(list_path, 'w') as f:
+                for piece_path in piece_paths:
+                    f.write(f"file '{os.path.abspath(piece_path)}'\n")
+
+            _, audio_codec = CLIP_ENCODERS[output_format]
+            join_command = [
                 'ffmpeg',
                 '-y',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', list_path,
+                '-ss', f'{start:.3f}',
+                '-t', f'{end - start:.3f}',
                 '-i', input_path,
-                '-i', palette_path,
-                '-ss', start_time,
-                '-to', end_time,
-                'vf', 'fps=10, scale=320:-1:flags=lanczos[x];[x][1:v]paletteuse',
+                '-map', '0:v',
+                '-map', '1:a?',
+                '-c:v', 'copy',
+                *audio_codec,
                 output_path
             ]
+            if not self._run_ffmpeg(join_command, "join the clip pieces"):
+                return False
+            logger.info(f"Smart-rendered clip: re-encoded {first_keyframe - start:.3f}s + {end - last_keyframe:.3f}s, copied {last_keyframe - first_keyframe:.3f}s")
+            return True
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
-            try:
-                subprocess.rn(palette_command, check=True, capture_output=True, text=True)
-            except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                logger.error(f"FFMPEG failed to generate palette for GIF: {getattr(e, 'stderr', e)}")
-                return None
-            
+    def _probe_codec(self, input_path: str, stream: str) -> Optional[str]:
+        # Codec of the first stream matching the ffprobe stream specifier, e.g. 'v:0'; None if there is no such stream
+        command = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', stream,
+            '-show_entries', 'stream=codec_name',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            input_path
+        ]
         try:
             result = subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"Clip created successfully: {output_path}")
-            return output_path
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFMPEG failed to create clip.")
-            logger.error(f"Command: {' '.join(command)}")
-            logger.error(f"Stderr: {e.stderr}")
+            return result.stdout.strip() or None
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            logger.warning(f"Could not determine the codec of stream {stream} of {input_path}: {getattr(e, 'stderr', e)}")
             return None
-        except FileNotFoundError:
-            logger.error("FFMPEG command not found. Please ensure FFMPEG is installed and in your PATH.")
-            return None
-
-
-
 
+    def _probe_keyframes(self, input_path: str, start: float, end: float) -> List[float]:
+        """Timestamps of the video keyframes in [start, end], read from packet flags without decoding."""
+        command = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-read_intervals', f'{start:.3f}%{end:.3f}',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            input_path
+        ]
+        try:
+            result = subprocess.run(command, check=True, capture_output=True, text=True)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            logger.warning(f"Could not read the keyframes of {input_path}: {getattr(e, 'stderr', e)}")
+            return []
 
+        keyframes = []
+        for line in result.stdout.splitlines():
+            fields = line.split(',')
+            if len(fields) >= 2 and 'K' in fields[1]:
+                try:
+                    pts_time = float(fields[0])
+                except ValueError:
+                    continue
+                if start - KEYFRAME_TOLERANCE <= pts_time <= end:
+                    keyframes.append(pts_time)
+        return sorted(keyframes)
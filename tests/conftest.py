@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server and client packages live under src/ and are run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
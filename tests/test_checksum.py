@@ -0,0 +1,69 @@
+import hashlib
+
+import pytest
+
+from server import Checksum as checksum_module
+from server.Checksum import Checksum, HashTee, DEFAULT_CHECKSUM_ALGORITHM, HASHLIB_ALGORITHMS, XXHASH_ALGORITHMS
+from server.ResultCache import ResultCache
+
+
+@pytest.mark.parametrize("algorithm", HASHLIB_ALGORITHMS)
+def test_hashlib_algorithms_match_hashlib(algorithm):
+    hasher = Checksum.new(algorithm)
+    hasher.update(b"payload")
+    assert hasher.hexdigest() == hashlib.new(algorithm, b"payload").hexdigest()
+
+
+def test_unknown_algorithms_are_refused():
+    assert Checksum.new("crc32") is None
+    assert Checksum.new(None) is None
+    assert not Checksum.is_supported("crc32")
+    assert Checksum.is_supported(DEFAULT_CHECKSUM_ALGORITHM)
+
+
+def test_xxhash_depends_on_the_optional_package(monkeypatch):
+    monkeypatch.setattr(checksum_module, "xxhash", None)
+    assert Checksum.new("xxh64") is None
+    assert not Checksum.is_supported("xxh64")
+    assert Checksum.supported() == list(HASHLIB_ALGORITHMS)
+
+
+def test_xxhash_algorithms_when_installed():
+    xxhash = pytest.importorskip("xxhash")
+    for algorithm in XXHASH_ALGORITHMS:
+        hasher = Checksum.new(algorithm)
+        hasher.update(b"payload")
+        assert hasher.hexdigest() == getattr(xxhash, algorithm)(b"payload").hexdigest()
+    assert set(XXHASH_ALGORITHMS) <= set(Checksum.supported())
+
+
+def test_file_digest_equals_the_streamed_digest(tmp_path, monkeypatch):
+    # Smaller chunks, so the file is hashed in several blocks
+    monkeypatch.setattr(checksum_module, "FILE_CHUNK_SIZE", 7)
+    data = bytes(range(256)) * 3
+    path = tmp_path / "a.mp4"
+    path.write_bytes(data)
+    assert Checksum.file_digest(str(path), "sha256") == hashlib.sha256(data).hexdigest()
+    assert Checksum.file_digest(str(path), "crc32") is None
+
+
+def test_hash_tee_feeds_every_hasher_and_skips_none():
+    client = Checksum.new("blake2b")
+    cache_key = hashlib.sha256()
+    tee = HashTee(client, None, cache_key)
+    assert len(tee.hashers) == 2
+
+    for block in (b"first ", memoryview(b"second "), bytearray(b"third")):
+        tee.update(block)
+    assert client.hexdigest() == hashlib.blake2b(b"first second third").hexdigest()
+    assert cache_key.hexdigest() == hashlib.sha256(b"first second third").hexdigest()
+
+
+def test_content_key_only_for_collision_resistant_algorithms(tmp_path):
+    path = tmp_path / "a.mp4"
+    path.write_bytes(b"payload")
+    # SHA-256 keys match the digest ResultCache computes for committed upload sessions
+    assert Checksum.content_key("sha256", hashlib.sha256(b"payload").hexdigest()) == ResultCache.hash_file(str(path))
+    assert Checksum.content_key("blake2b", "ab12") == "blake2b:ab12"
+    assert Checksum.content_key("md5", "ab12") is None
+    assert Checksum.content_key("xxh64", "ab12") is None
@@ -0,0 +1,97 @@
+import queue
+import threading
+
+import pytest
+
+from server.FairQueue import FairQueue
+
+
+def drain(jobs: FairQueue, count: int) -> list:
+    order = []
+    for _ in range(count):
+        client_id, job = jobs.get()
+        order.append(job)
+        jobs.task_done(client_id)
+    return order
+
+
+def test_clients_take_turns():
+    jobs = FairQueue()
+    for i in range(3):
+        jobs.put_nowait("a", f"a{i}")
+    jobs.put_nowait("b", "b0")
+    jobs.put_nowait("b", "b1")
+
+    assert drain(jobs, 5) == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_newcomer_waits_for_at_most_one_job_per_client():
+    jobs = FairQueue()
+    for i in range(50):
+        jobs.put_nowait("bulk", i)
+    assert drain(jobs, 2) == [0, 1]
+
+    jobs.put_nowait("newcomer", "n0")
+    assert "n0" in drain(jobs, 2)
+
+
+def test_weights_share_slots_proportionally():
+    jobs = FairQueue(weights={"premium": 3})
+    for i in range(6):
+        jobs.put_nowait("premium", f"p{i}")
+        jobs.put_nowait("basic", f"b{i}")
+
+    first_eight = drain(jobs, 8)
+    assert sum(job.startswith("p") for job in first_eight) == 6
+
+
+def test_lanes_are_fifo():
+    jobs = FairQueue()
+    for i in range(5):
+        jobs.put_nowait("a", i)
+    assert drain(jobs, 5) == [0, 1, 2, 3, 4]
+
+
+def test_total_and_per_client_limits():
+    jobs = FairQueue(maxsize=3, max_queued_per_client=2)
+    jobs.put_nowait("a", 1)
+    jobs.put_nowait("a", 2)
+    with pytest.raises(queue.Full):
+        jobs.put_nowait("a", 3)
+
+    jobs.put_nowait("b", 1)
+    assert jobs.full()
+    with pytest.raises(queue.Full):
+        jobs.put_nowait("c", 1)
+    assert jobs.qsize() == 3
+
+
+def test_active_limit_holds_back_a_client_until_task_done():
+    jobs = FairQueue(max_active_per_client=1)
+    jobs.put_nowait("a", "a0")
+    jobs.put_nowait("a", "a1")
+    jobs.put_nowait("b", "b0")
+
+    assert jobs.get() == ("a", "a0")
+    # a is at its limit, so b runs next even though a queued first
+    assert jobs.get() == ("b", "b0")
+    assert jobs.client_depth("a") == (1, 1)
+
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(jobs.get()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+
+    jobs.task_done("a")
+    waiter.join(5)
+    assert result == [("a", "a1")]
+
+
+def test_idle_client_state_is_dropped():
+    jobs = FairQueue()
+    jobs.put_nowait("a", 1)
+    client_id, _ = jobs.get()
+    jobs.task_done(client_id)
+    assert jobs.client_depth("a") == (0, 0)
+    assert jobs.qsize() == 0
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from benchmark.engine_benchmark import UnlimitedConnectionManager, find_free_port, wait_for_port
+from server.AsyncTCPSocketServer import AsyncTCPSocketServer
+from server.DiskWriter import DiskWriter
+from server.FileReceiver import FileReceiver
+from server.RequestHandler import RequestHandler, ERROR_UPLOAD_SESSION_NOT_FOUND
+from server.StatusResponder import StatusResponder
+from server.StorageChecker import StorageChecker
+from server.TCPSocketServer import TCPSocketServer
+
+
+class EchoVideoProcessor:
+    """Answers every upload with the uploaded bytes, after the "sleep" the request asks for."""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+
+    def process(self, input_path: str, options: dict, media_info=None, progress=None) -> str:
+        time.sleep(float(options.get("sleep", 0)))
+        output_path = os.path.join(self.output_dir, f"processed_{os.path.basename(input_path)}")
+        shutil.copy(input_path, output_path)
+        return output_path
+
+
+@pytest.fixture(scope="module", params=["threaded", "asyncio"])
+def server_port(request, tmp_path_factory):
+    logging.disable(logging.WARNING)
+    storage_dir = str(tmp_path_factory.mktemp(request.param))
+    file_receiver = FileReceiver(DiskWriter(os.path.join(storage_dir, "uploads")))
+    storage_checker = StorageChecker(max_storage_tb=1.0, storage_path=storage_dir, reconcile_interval=0)
+    video_processor = EchoVideoProcessor(storage_dir)
+    status_responder = StatusResponder()
+
+    def create_request_handler(connection):
+        return RequestHandler(file_receiver=file_receiver, storage_checker=storage_checker,
+                              video_processor=video_processor, status_responder=status_responder)
+
+    port = find_free_port()
+    engine = AsyncTCPSocketServer if request.param == "asyncio" else TCPSocketServer
+    server = engine("127.0.0.1", port, create_request_handler, UnlimitedConnectionManager())
+    # The servers run until the process ends
+    threading.Thread(target=server.start, daemon=True).start()
+    assert wait_for_port(port)
+    yield port
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def client(server_port):
+    sock = socket.create_connection(("127.0.0.1", server_port), timeout=10)
+    yield sock
+    sock.close()
+
+
+def send_request(sock: socket.socket, options: dict, payload: bytes = b"", media_type: bytes = b"mp4"):
+    json_data = json.dumps(options).encode("utf-8")
+    sock.sendall(struct.pack('!HB', len(json_data), len(media_type)) + len(payload).to_bytes(5, 'big') + json_data + media_type + payload)
+
+
+def receive_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError(f"connection closed after {len(data)} of {size} bytes")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def receive_response(sock: socket.socket):
+    header = receive_exactly(sock, 8)
+    json_size, media_type_size = struct.unpack('!HB', header[:3])
+    payload_size = int.from_bytes(header[3:], 'big')
+    response = json.loads(receive_exactly(sock, json_size))
+    receive_exactly(sock, media_type_size)
+    return response, receive_exactly(sock, payload_size)
+
+
+def test_pipelined_requests_are_answered_by_request_id(client):
+    payloads = {"slow": b"s" * 300_000, "fast": b"f" * 1000, "tiny": b"e"}
+    send_request(client, {"request_id": "slow", "operation": "compress", "sleep": 0.5}, payloads["slow"])
+    send_request(client, {"request_id": "fast", "operation": "compress"}, payloads["fast"])
+    send_request(client, {"request_id": "tiny", "operation": "compress"}, payloads["tiny"])
+
+    order = []
+    for _ in payloads:
+        response, payload = receive_response(client)
+        order.append(response["request_id"])
+        assert payload == payloads[response["request_id"]]
+    # Served concurrently, so the slow encode does not hold back the requests behind it
+    assert order[-1] == "slow"
+
+
+def test_refused_payload_is_skipped_before_the_next_request(client):
+    send_request(client, {"request_id": "chunk", "request_type": "upload_chunk", "session_id": "unknown", "offset": 0}, b"c" * 50_000)
+    send_request(client, {"request_id": "next", "operation": "compress"}, b"n" * 2000)
+
+    responses = {response["request_id"]: (response, payload) for response, payload in
+                 (receive_response(client) for _ in range(2))}
+    assert responses["chunk"][0]["error"]["code"] == ERROR_UPLOAD_SESSION_NOT_FOUND
+    assert responses["next"][1] == b"n" * 2000
+
+
+def test_connection_stays_open_between_requests(client):
+    for i in range(3):
+        send_request(client, {"request_id": i, "operation": "compress"}, bytes([i]) * 100)
+        response, payload = receive_response(client)
+        assert response["request_id"] == i
+        assert payload == bytes([i]) * 100
+        time.sleep(0.1)
+
+
+def test_request_without_id_closes_the_connection(client):
+    send_request(client, {"request_id": "kept", "operation": "compress"}, b"k" * 10)
+    assert receive_response(client)[0]["request_id"] == "kept"
+
+    send_request(client, {"operation": "compress"}, b"last")
+    response, payload = receive_response(client)
+    assert "request_id" not in response and payload == b"last"
+    assert client.recv(1) == b""
@@ -0,0 +1,40 @@
+import pytest
+
+from server.MediaProber import MediaProber
+
+MEDIA_INFO = {"format_name": "mov,mp4", "duration": 12.5, "video_codec": "h264", "audio_codec": "aac"}
+
+
+@pytest.fixture
+def prober(monkeypatch):
+    prober = MediaProber(probe_bytes=4)
+    prober.runs = []
+
+    def run_probe(source, data=None):
+        prober.runs.append(source[0])
+        return dict(MEDIA_INFO), True
+    monkeypatch.setattr(prober, "_run_probe", run_probe)
+    return prober
+
+
+def test_head_probes_are_not_shared_between_uploads(prober):
+    # Two different uploads may well start with the same bytes and have the same size
+    for _ in range(2):
+        media_info, reason = prober.probe_head(b"head", 100, {"operation": "compress"})
+        assert media_info == MEDIA_INFO and reason is None
+    assert prober.runs == ["pipe:0", "pipe:0"]
+
+
+def test_remembered_head_probe_serves_the_same_content(prober):
+    media_info, _ = prober.probe_head(b"head", 100, {"operation": "compress"})
+    prober.remember("digest", media_info)
+
+    assert prober.probe_file("uploads/a.mp4", "digest") == MEDIA_INFO
+    assert prober.probe_file("uploads/b.mp4", "other") == MEDIA_INFO
+    assert prober.runs == ["pipe:0", "uploads/b.mp4"]
+
+
+def test_remember_without_digest_caches_nothing(prober):
+    prober.remember(None, dict(MEDIA_INFO))
+    prober.probe_file("uploads/a.mp4")
+    assert prober.runs == ["uploads/a.mp4"]
@@ -0,0 +1,70 @@
+from server import QuotaManager as quota_manager_module
+from server.QuotaManager import QuotaManager
+from server.StorageChecker import StorageChecker
+
+
+def test_upload_lifecycle_accounting():
+    quotas = QuotaManager(max_storage_bytes=1000)
+    assert quotas.reserve("a", 400) is None
+    usage = quotas.get_usage("a")
+    assert (usage["reserved_bytes"], usage["active_reservations"]) == (400, 1)
+
+    quotas.commit("a", 400)
+    usage = quotas.get_usage("a")
+    assert (usage["stored_bytes"], usage["reserved_bytes"], usage["active_reservations"]) == (400, 0, 1)
+
+    quotas.release("a", 0)
+    usage = quotas.get_usage("a")
+    assert (usage["stored_bytes"], usage["reserved_bytes"], usage["active_reservations"]) == (400, 0, 0)
+
+
+def test_storage_quota_counts_stored_and_reserved_bytes():
+    quotas = QuotaManager(max_storage_bytes=1000)
+    quotas.record_write("a", 500)
+    assert quotas.reserve("a", 400) is None
+    assert "storage quota" in quotas.reserve("a", 200)
+    # Another client has its own quota
+    assert quotas.reserve("b", 1000) is None
+
+    quotas.record_delete("a", 500)
+    assert quotas.reserve("a", 200) is None
+
+
+def test_concurrent_reservation_limit():
+    quotas = QuotaManager(max_concurrent_reservations=2)
+    assert quotas.reserve("a", 1) is None
+    assert quotas.reserve("a", 1) is None
+    assert "in progress" in quotas.reserve("a", 1)
+    quotas.release("a", 1)
+    assert quotas.reserve("a", 1) is None
+
+
+def test_transfer_quota_resets_with_the_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quota_manager_module.time, "monotonic", lambda: now[0])
+    quotas = QuotaManager(max_transfer_bytes=1000, window_seconds=60)
+    quotas.record_transfer("a", received=600, sent=300)
+    assert "transfer quota" in quotas.reserve("a", 200)
+
+    now[0] += 60
+    assert quotas.reserve("a", 200) is None
+    usage = quotas.get_usage("a")
+    assert (usage["window_transfer_bytes"], usage["total_received_bytes"], usage["total_sent_bytes"]) == (0, 600, 300)
+
+
+def test_overrides_replace_the_defaults():
+    quotas = QuotaManager(max_storage_bytes=100, overrides={"premium": {"max_storage_bytes": 0}})
+    assert quotas.reserve("premium", 10 ** 9) is None
+    assert quotas.reserve("basic", 200) is not None
+    assert quotas.get_usage("premium")["max_storage_bytes"] == 0
+
+
+def test_storage_checker_charges_writes_and_deletes_to_the_client(tmp_path):
+    quotas = QuotaManager()
+    checker = StorageChecker(max_storage_tb=1.0, storage_path=str(tmp_path), reconcile_interval=0, quota_manager=quotas)
+    checker.record_write(300, "a")
+    checker.record_write(50)
+    checker.record_delete(100, "a")
+    assert quotas.get_usage("a")["stored_bytes"] == 200
+    assert checker.used_bytes() == 250
+    assert set(quotas.all_usage()) == {"a"}
@@ -0,0 +1,60 @@
+import pytest
+
+from server import RateLimiter as rate_limiter_module
+from server.RateLimiter import RateLimiter, PRUNE_THRESHOLD
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_refused_with_wait(clock):
+    limiter = RateLimiter(rate=2.0, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+
+
+def test_tokens_refill_at_rate(clock):
+    limiter = RateLimiter(rate=2.0, burst=3)
+    for _ in range(3):
+        limiter.acquire("a")
+
+    clock.now += 0.25
+    assert limiter.acquire("a") == pytest.approx(0.25)
+    clock.now += 0.25
+    assert limiter.acquire("a") == 0.0
+
+
+def test_refill_is_capped_at_burst(clock):
+    limiter = RateLimiter(rate=1.0, burst=2)
+    limiter.acquire("a")
+    clock.now += 3600
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, pytest.approx(1.0)]
+
+
+def test_keys_have_separate_buckets(clock):
+    limiter = RateLimiter(rate=1.0, burst=1)
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("a") > 0
+    assert limiter.acquire("b") == 0.0
+
+
+def test_full_buckets_are_pruned(clock):
+    limiter = RateLimiter(rate=1.0, burst=1)
+    for i in range(PRUNE_THRESHOLD):
+        limiter.acquire(f"idle-{i}")
+    clock.now += 10
+    limiter.acquire("busy")
+    assert len(limiter._buckets) == 1
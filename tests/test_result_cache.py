@@ -0,0 +1,115 @@
+import os
+import threading
+
+import pytest
+
+from server.ResultCache import ResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"), max_bytes=100, ffmpeg_version="ffmpeg version 6.1")
+
+
+def make_output(tmp_path, name: str, size: int) -> str:
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_key_ignores_transport_options(cache):
+    options = {"operation": "compress", "crf": 28}
+    key = cache.make_key("digest", options)
+    assert cache.make_key("digest", dict(options, request_id=7, api_key="k", checksum="abc", mode="async",
+                                         deadline=30, priority="high", progress=True)) == key
+    assert cache.make_key("digest", {"crf": 28, "operation": "compress", "width": None}) == key
+
+
+def test_key_depends_on_payload_options_and_ffmpeg(cache, tmp_path):
+    key = cache.make_key("digest", {"operation": "compress"})
+    assert cache.make_key("other", {"operation": "compress"}) != key
+    assert cache.make_key("digest", {"operation": "resize", "width": 640}) != key
+
+    other_version = ResultCache(str(tmp_path / "other"), max_bytes=100, ffmpeg_version="ffmpeg version 7.0")
+    assert other_version.make_key("digest", {"operation": "compress"}) != key
+
+
+def test_hash_file_is_the_content_digest(tmp_path):
+    first = make_output(tmp_path, "a.mp4", 10)
+    second = make_output(tmp_path, "b.mp4", 10)
+    assert ResultCache.hash_file(first) == ResultCache.hash_file(second)
+
+
+def test_miss_then_hit(cache, tmp_path):
+    key = cache.make_key("digest", {"operation": "compress"})
+    assert cache.claim(key) == (None, True)
+
+    cached_path = cache.complete(key, make_output(tmp_path, "out.mp4", 10))
+    assert cached_path.endswith(".mp4") and os.path.exists(cached_path)
+    cache.release(key)
+
+    assert cache.claim(key) == (cached_path, False)
+    cache.release(key)
+
+
+def test_failed_leader_hands_the_key_over(cache):
+    key = cache.make_key("digest", {"operation": "compress"})
+    assert cache.claim(key) == (None, True)
+    assert cache.complete(key, None) is None
+    assert cache.claim(key) == (None, True)
+
+
+def test_identical_requests_wait_for_the_leader(cache, tmp_path):
+    key = cache.make_key("digest", {"operation": "compress"})
+    cache.claim(key)
+
+    results = []
+    follower = threading.Thread(target=lambda: results.append(cache.claim(key)))
+    follower.start()
+    follower.join(0.2)
+    assert follower.is_alive()
+
+    cached_path = cache.complete(key, make_output(tmp_path, "out.mp4", 10))
+    follower.join(5)
+    assert results == [(cached_path, False)]
+
+
+def test_try_claim_returns_the_leaders_future(cache, tmp_path):
+    key = cache.make_key("digest", {"operation": "compress"})
+    assert cache.try_claim(key) == (None, True, None)
+
+    cached_path, is_leader, leader_done = cache.try_claim(key)
+    assert (cached_path, is_leader) == (None, False)
+    assert not leader_done.done()
+
+    cached_path = cache.complete(key, make_output(tmp_path, "out.mp4", 10))
+    assert leader_done.done()
+    assert cache.try_claim(key) == (cached_path, False, None)
+
+
+def test_lru_eviction_skips_pinned_entries(cache, tmp_path):
+    paths = {}
+    for name in ("a", "b", "c"):
+        key = cache.make_key(name, {})
+        cache.claim(key)
+        paths[name] = (key, cache.complete(key, make_output(tmp_path, f"{name}.mp4", 40)))
+    # c pushed the cache over budget while every entry was pinned, so nothing could go yet
+    assert cache.used_bytes() == 120
+
+    # Once a and b are sent, the least recently used one goes; c is still being sent
+    cache.release(paths["a"][0])
+    cache.release(paths["b"][0])
+    assert not os.path.exists(paths["a"][1])
+    assert os.path.exists(paths["b"][1]) and os.path.exists(paths["c"][1])
+    assert cache.used_bytes() == 80
+
+
+def test_existing_entries_are_loaded(cache, tmp_path):
+    key = cache.make_key("digest", {})
+    cache.claim(key)
+    cached_path = cache.complete(key, make_output(tmp_path, "out.mp4", 10))
+    cache.release(key)
+
+    reopened = ResultCache(cache.cache_dir, max_bytes=100, ffmpeg_version=cache.ffmpeg_version)
+    assert reopened.claim(key) == (cached_path, False)
+    assert reopened.used_bytes() == 10
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from server.DiskWriter import DiskWriter
+from server.StorageChecker import StorageChecker
+
+# 1 KiB of storage, in terabytes
+KIB_TB = 1024 / 1024 ** 4
+
+
+@pytest.fixture
+def checker(tmp_path):
+    return StorageChecker(max_storage_tb=KIB_TB, storage_path=str(tmp_path), reconcile_interval=0)
+
+
+def test_usage_is_seeded_from_the_tree(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.mp4").write_bytes(b"x" * 100)
+    (tmp_path / "b.mp4").write_bytes(b"x" * 50)
+    checker = StorageChecker(max_storage_tb=KIB_TB, storage_path=str(tmp_path), reconcile_interval=0)
+    assert checker.used_bytes() == 150
+    assert checker.get_free_space() == 1024 - 150
+
+
+def test_reservations_cannot_overcommit(checker):
+    assert checker.reserve(600)
+    assert not checker.reserve(600)
+    assert checker.reserve(424)
+    assert checker.get_free_space() == 0
+
+    checker.release_reservation(424)
+    assert checker.reserved_bytes() == 600
+
+
+def test_commit_moves_reserved_bytes_into_usage_once(checker):
+    checker.reserve(600)
+    checker.commit_reservation(600)
+    assert (checker.used_bytes(), checker.reserved_bytes()) == (600, 0)
+    assert checker.get_free_space() == 424
+
+
+def test_disk_writer_keeps_the_counter_current(checker, tmp_path):
+    writer = DiskWriter(str(tmp_path / "uploads"), storage_checker=checker)
+    path = writer.write_to_disk(b"x" * 100, "a.mp4")
+    assert checker.used_bytes() == 100
+
+    writer.remove_file(path)
+    assert checker.used_bytes() == 0
+
+
+def test_reserved_upload_is_counted_once(checker, tmp_path):
+    writer = DiskWriter(str(tmp_path / "uploads"), storage_checker=checker)
+    assert checker.reserve(300)
+    checker.commit_reservation(300)
+    file_path, fd = writer.create_file("a.mp4", 300, reserved=True)
+    os.close(fd)
+    assert (checker.used_bytes(), checker.reserved_bytes()) == (300, 0)
+
+    # A failed upload gives its preallocated size back
+    writer.remove_file(file_path)
+    assert checker.used_bytes() == 0
+
+
+def test_reconcile_corrects_drift(checker, tmp_path):
+    (tmp_path / "a.mp4").write_bytes(b"x" * 70)
+    assert checker.used_bytes() == 0
+    assert checker.reconcile()
+    assert checker.used_bytes() == 70
+
+
+def test_reconcile_keeps_the_counter_when_writes_race_the_walk(checker, tmp_path, monkeypatch):
+    walk = checker.get_used_space
+
+    def walk_during_write():
+        total = walk()
+        checker.record_write(10)
+        return total
+
+    monkeypatch.setattr(checker, "get_used_space", walk_during_write)
+    (tmp_path / "a.mp4").write_bytes(b"x" * 70)
+    assert not checker.reconcile()
+    assert checker.used_bytes() == 10